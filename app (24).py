@@ -1,18 +1,22 @@
+import time
+_debut_execution = time.perf_counter()
+
 import streamlit as st
-import json
-import pandas as pd
 from datetime import datetime, timedelta
 import os
-import folium
-from streamlit_folium import folium_static
-from geopy.distance import geodesic
 import random
 import base64
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
 import io
 import math
+# pandas, folium, geopy, reportlab et le calcul d'itinéraire (numpy) sont importés
+# à l'intérieur des pages et fonctions qui en ont besoin
+from stockage import CHAMP_VERSION, FICHIERS, DonneesPartagees, ouvrir_stockage
+import archives
+from modeles import depuis_json, vers_json
+from identifiants import AllocateurIdentifiants
+from cache_distances import CacheDistances
+import horaires
+from tournees import RegistreTournees
 
 # Configuration de la page
 st.set_page_config(
@@ -21,73 +25,203 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialisation des données
-def load_data():
-    if 'magasins_source' not in st.session_state:
-        try:
-            with open('magasins_source.json', 'r') as f:
-                st.session_state.magasins_source = json.load(f)
-        except FileNotFoundError:
-            st.session_state.magasins_source = {
-                "maison": {
-                    "nom": "Maison - Départ Automobile",
-                    "position": [31.362120, -7.961128],
-                    "type": "depart"
-                },
-                "depot_central": {
-                    "nom": "Dépôt Central",
-                    "position": [31.609110, -7.968425],
-                    "prix_achat": {
-                        "poulet": {
-                            "ailes": 12, "pilons": 16, "cuisses": 20, 
-                            "foies": 8, "blanc": 24, "gorges": 10,
-                            "saucisse": 18, "escalopes": 22, "hauts de cuisse": 19
-                        },
-                        "dinde": {
-                            "blanc": 28, "cuisses": 24, "ailes": 14,
-                            "escalopes": 30, "rôti": 35
-                        },
-                        "boeuf": {
-                            "steak": 45, "haché": 38, "côte": 50,
-                            "rôti": 55, "brochettes": 42
-                        },
-                        "agneau": {
-                            "côte": 60, "gigot": 65, "épaule": 58,
-                            "brochettes": 52
-                        }
-                    },
-                    "type": "magasin"
-                }
+# Données par défaut lorsqu'aucun fichier n'existe encore
+MAGASINS_DEFAUT = {
+    "maison": {
+        "nom": "Maison - Départ Automobile",
+        "position": [31.362120, -7.961128],
+        "type": "depart"
+    },
+    "depot_central": {
+        "nom": "Dépôt Central",
+        "position": [31.609110, -7.968425],
+        "prix_achat": {
+            "poulet": {
+                "ailes": 12, "pilons": 16, "cuisses": 20, 
+                "foies": 8, "blanc": 24, "gorges": 10,
+                "saucisse": 18, "escalopes": 22, "hauts de cuisse": 19
+            },
+            "dinde": {
+                "blanc": 28, "cuisses": 24, "ailes": 14,
+                "escalopes": 30, "rôti": 35
+            },
+            "boeuf": {
+                "steak": 45, "haché": 38, "côte": 50,
+                "rôti": 55, "brochettes": 42
+            },
+            "agneau": {
+                "côte": 60, "gigot": 65, "épaule": 58,
+                "brochettes": 52
             }
+        },
+        "type": "magasin"
+    }
+}
+
+DEFAUTS = {
+    "magasins_source": MAGASINS_DEFAUT,
+    "clients": {},
+    "commandes": [],
+    "livraisons": [],
+    "tresorerie": []
+}
+
+# Délai (secondes) avant l'écriture en arrière-plan des modifications ; 0 = écriture immédiate
+DELAI_ECRITURE = float(os.environ.get("GESTION_DELAI_ECRITURE", 2))
+
+# Enregistrements compacts (__slots__) en mémoire au lieu de dictionnaires ; 0 pour désactiver
+MODELE_COMPACT = os.environ.get("GESTION_MODELE_COMPACT", "1") != "0"
+
+# Temps maximal (secondes) d'amélioration 2-opt / Or-opt de l'itinéraire ; 0 = tournée gloutonne seule
+BUDGET_ITINERAIRE = float(os.environ.get("GESTION_BUDGET_ITINERAIRE", 1.0))
+
+# Graphe routier local (JSON ou GeoJSON, voir reseau_routier.py) pour les distances par la route ; vide = à vol d'oiseau
+RESEAU_ROUTIER = os.environ.get("GESTION_RESEAU_ROUTIER", "")
+
+# Processus optimisant en parallèle les tournées de plusieurs véhicules ou zones ; 1 = dans le processus de l'application
+PROCESSUS_ITINERAIRE = int(os.environ.get("GESTION_PROCESSUS_ITINERAIRE", 0)) or os.cpu_count() or 1
+
+# Collections nécessaires à chaque page (chargées au premier accès)
+COLLECTIONS_PAR_PAGE = {
+    "Magasins Source": ["magasins_source"],
+    "Clients": ["clients", "commandes"],
+    "Commandes": ["magasins_source", "clients", "commandes"],
+    "Itinéraire": ["magasins_source", "clients", "commandes"],
+    "Livraisons": ["clients", "commandes", "livraisons", "tresorerie"],
+    "Trésorerie": ["clients", "tresorerie"],
+    "Rapports": ["clients", "commandes"],
+    "Recherche": ["clients", "commandes"]
+}
+
+@st.cache_resource
+def mesures_demarrage():
+    """Durées d'exécution mesurées pour le processus (démarrage à froid et dernière page)"""
+    return {"demarrage_a_froid": None, "derniere_execution": None}
+
+@st.cache_resource
+def donnees_partagees():
+    """Données chargées une seule fois pour tout le processus et partagées entre les sessions"""
+    donnees = DonneesPartagees(ouvrir_stockage(), DEFAUTS, depuis_json if MODELE_COMPACT else None)
+    if DELAI_ECRITURE > 0:
+        donnees.demarrer_ecriture_differee(DELAI_ECRITURE)
+    return donnees
+
+def enregistrement(nom, valeur):
+    """Nouvel enregistrement d'une collection, au format des données chargées (compact ou dictionnaire)"""
+    return depuis_json(nom, [valeur])[0] if MODELE_COMPACT else valeur
+
+@st.cache_resource
+def allocateur_identifiants():
+    """Allocateur d'identifiants partagé par les sessions du processus"""
+    return AllocateurIdentifiants()
+
+def nouvel_identifiant(prefixe):
+    return allocateur_identifiants().suivant(prefixe)
+
+@st.cache_resource
+def cache_distances():
+    """Cache des distances entre coordonnées, partagé par les sessions et conservé sur disque"""
+    return CacheDistances()
+
+@st.cache_resource
+def registre_tournees():
+    """Ordres de passage retenus, base des mises à jour incrémentales"""
+    return RegistreTournees()
+
+@st.cache_resource
+def cache_plans():
+    """Plans de tournée calculés, partagés par les sessions"""
+    import plans
     
-    if 'clients' not in st.session_state:
-        try:
-            with open('clients.json', 'r') as f:
-                st.session_state.clients = json.load(f)
-        except FileNotFoundError:
-            st.session_state.clients = {}
+    return plans.CacheCalculs()
+
+@st.cache_resource
+def cache_cartes():
+    """Cartes d'itinéraire déjà rendues (HTML), par empreinte de la tournée"""
+    import plans
     
-    if 'commandes' not in st.session_state:
-        try:
-            with open('commandes.json', 'r') as f:
-                st.session_state.commandes = json.load(f)
-        except FileNotFoundError:
-            st.session_state.commandes = []
+    return plans.CacheCalculs(capacite=32)
+
+@st.cache_resource
+def reseau_routier():
+    """Réseau routier chargé une fois pour le processus, ou None s'il n'est pas configuré"""
+    if not RESEAU_ROUTIER:
+        return None
+    from reseau_routier import ReseauRoutier
     
-    if 'livraisons' not in st.session_state:
-        try:
-            with open('livraisons.json', 'r') as f:
-                st.session_state.livraisons = json.load(f)
-        except FileNotFoundError:
-            st.session_state.livraisons = []
+    return ReseauRoutier.charger(RESEAU_ROUTIER)
+
+@st.cache_resource
+def executeur_itineraire():
+    """Pool de processus créé une fois pour le processus et partagé par les sessions, ou None avec un seul processus"""
+    if PROCESSUS_ITINERAIRE <= 1:
+        return None
+    import itineraire as routage
     
-    if 'tresorerie' not in st.session_state:
-        try:
-            with open('tresorerie.json', 'r') as f:
-                st.session_state.tresorerie = json.load(f)
-        except FileNotFoundError:
-            st.session_state.tresorerie = []
+    return routage.creer_executeur(PROCESSUS_ITINERAIRE)
+
+@st.cache_resource
+def etat_precalcul():
+    """Thread de précalcul des tournées, une fois démarré"""
+    return {"precalcul": None}
+
+@st.cache_resource
+def precalcul_plans():
+    """Précalcul en arrière-plan des tournées du lendemain, relancé à chaque modification
+
+    Démarré à la première ouverture de la page Itinéraire ou au premier
+    enregistrement de commandes, pas au démarrage du processus.
+    """
+    import plans
+    
+    precalcul = plans.PrecalculPlans(donnees_partagees(), cache_plans(), registre_tournees(), cache_distances(),
+                                     BUDGET_ITINERAIRE, delai=DELAI_ECRITURE or 2, reseau=reseau_routier(),
+                                     executeur=executeur_itineraire())
+    precalcul.start()
+    precalcul.demander()
+    etat_precalcul()["precalcul"] = precalcul
+    return precalcul
+
+@st.cache_resource
+def etat_index_positions():
+    """Index spatial des clients et magasins, construit à la première recherche de proximité"""
+    return {"index": None}
+
+def index_positions():
+    from index_spatial import IndexDonnees
     
+    etat = etat_index_positions()
+    if etat["index"] is None:
+        etat["index"] = IndexDonnees(donnees_partagees())
+    return etat["index"]
+
+def indexer_position(genre, cle, position):
+    """Tenir l'index spatial à jour après une création, un déplacement ou une suppression, s'il est déjà construit"""
+    index = etat_index_positions()["index"]
+    if index is not None:
+        index.indexer(genre, cle, position)
+
+def invalider_distances(*positions):
+    """Oublier les distances d'une position modifiée ou supprimée"""
+    cache = cache_distances()
+    for position in positions:
+        cache.invalider(position)
+    cache.enregistrer()
+
+# Initialisation des données
+def load_data(collections):
+    donnees = donnees_partagees()
+    donnees.recharger_si_modifie()
+    
+    # Vues sur les collections partagées (références, sans copie) ;
+    # seules celles demandées par la page sont chargées
+    for nom in FICHIERS:
+        if nom in collections:
+            st.session_state[nom] = donnees[nom]
+        elif nom in st.session_state:
+            del st.session_state[nom]
+    
+    # Seuls le panier et le magasin sélectionné sont propres à la session
     if 'panier' not in st.session_state:
         st.session_state.panier = []
     
@@ -105,6 +239,7 @@ def gerer_produits_magasin(magasin_id):
     if st.button("➕ Ajouter type", key=f"add_type_{magasin_id}"):
         if nouveau_type and nouveau_type not in magasin["prix_achat"]:
             magasin["prix_achat"][nouveau_type] = {}
+            marquer_modifie("magasins_source", magasin_id)
             save_data()
             st.success(f"Type {nouveau_type} ajouté!")
             st.rerun()
@@ -122,6 +257,7 @@ def gerer_produits_magasin(magasin_id):
             if st.button("➕ Ajouter morceau", key=f"add_morceau_{magasin_id}_{type_viande}"):
                 if nouveau_morceau and nouveau_morceau not in magasin["prix_achat"][type_viande]:
                     magasin["prix_achat"][type_viande][nouveau_morceau] = nouveau_prix
+                    marquer_modifie("magasins_source", magasin_id)
                     save_data()
                     st.success(f"Morceau {nouveau_morceau} ajouté!")
                     st.rerun()
@@ -142,115 +278,193 @@ def gerer_produits_magasin(magasin_id):
                     # Mettre à jour le prix immédiatement
                     if nouveau_prix != magasin["prix_achat"][type_viande][morceau]:
                         magasin["prix_achat"][type_viande][morceau] = nouveau_prix
+                        marquer_modifie("magasins_source", magasin_id)
                         save_data()
                 with col3:
                     if st.button("❌", key=f"del_{magasin_id}_{type_viande}_{morceau}"):
                         del magasin["prix_achat"][type_viande][morceau]
+                        marquer_modifie("magasins_source", magasin_id)
                         save_data()
                         st.rerun()
 
+def marquer_modifie(collection, cle=None):
+    """Marquer une collection (ou un enregistrement) à sauvegarder"""
+    donnees_partagees().marquer(collection, cle)
+
 def save_data():
-    with open('magasins_source.json', 'w') as f:
-        json.dump(st.session_state.magasins_source, f, indent=4)
-    with open('clients.json', 'w') as f:
-        json.dump(st.session_state.clients, f, indent=4)
-    with open('commandes.json', 'w') as f:
-        json.dump(st.session_state.commandes, f, indent=4)
-    with open('livraisons.json', 'w') as f:
-        json.dump(st.session_state.livraisons, f, indent=4)
-    with open('tresorerie.json', 'w') as f:
-        json.dump(st.session_state.tresorerie, f, indent=4)
+    """Sauvegarder les collections modifiées (en arrière-plan si l'écriture différée est active)"""
+    donnees = donnees_partagees()
+    with donnees.verrou:
+        commandes_modifiees = donnees.modifications.est_modifie("commandes")
+    donnees.demander_sauvegarde()
+    precalcul = etat_precalcul()["precalcul"]
+    if commandes_modifiees:
+        precalcul_plans().demander()
+    elif precalcul is not None:
+        precalcul.demander()
+
+def rechercher_commandes(**filtres):
+    """Commandes filtrées par date, statuts et magasin (requête SQL en mode SQLite)"""
+    return donnees_partagees().rechercher_commandes(**filtres)
+
+# Couleurs des tournées sur la carte, une par véhicule
+COULEURS_VEHICULES = ["blue", "purple", "orange", "darkgreen", "cadetblue", "darkred", "pink", "black"]
+
+# Nombre de points de la tournée au-delà duquel les marqueurs sont regroupés sur la carte
+SEUIL_REGROUPEMENT = 50
 
 # Fonctions utilitaires
-def calculer_distance(pos1, pos2):
-    return geodesic(pos1, pos2).km
-
-def trouver_meilleur_itineraire(commandes_du_jour, magasin_id):
-    positions = [st.session_state.magasins_source["maison"]["position"]]
-    clients_ids = []
-    
-    # Ajouter le magasin source
-    if magasin_id in st.session_state.magasins_source:
-        positions.append(st.session_state.magasins_source[magasin_id]["position"])
-    
-    # Ajouter les clients
-    for cmd in commandes_du_jour:
-        if cmd['client_id'] in st.session_state.clients and cmd['client_id'] not in clients_ids:
-            client = st.session_state.clients[cmd['client_id']]
-            if 'position' in client:
-                positions.append(tuple(client['position']))
-                clients_ids.append(cmd['client_id'])
-    
-    # Retour à la maison
-    positions.append(st.session_state.magasins_source["maison"]["position"])
-    
-    # Algorithme simple d'optimisation d'itinéraire (plus proche voisin)
-    optimized_positions = [positions[0]]  # Départ maison
-    remaining_positions = positions[1:]
-    
-    while remaining_positions:
-        last_pos = optimized_positions[-1]
-        closest_idx = 0
-        closest_dist = float('inf')
-        
-        for i, pos in enumerate(remaining_positions):
-            dist = calculer_distance(last_pos, pos)
-            if dist < closest_dist:
-                closest_dist = dist
-                closest_idx = i
-        
-        optimized_positions.append(remaining_positions[closest_idx])
-        remaining_positions.pop(closest_idx)
+def saisir_horaires(client=None, cle=""):
+    """Champs facultatifs de fenêtre horaire et de durée de livraison d'un client (dans un formulaire)"""
+    client = client or {}
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        debut = st.text_input("Livraison à partir de (HH:MM)", value=client.get("fenetre_debut") or "", key=f"fenetre_debut{cle}")
+    with col2:
+        fin = st.text_input("Livraison jusqu'à (HH:MM)", value=client.get("fenetre_fin") or "", key=f"fenetre_fin{cle}")
+    with col3:
+        service = st.number_input("Durée de livraison (min)", min_value=0, value=int(client.get("duree_service", horaires.SERVICE_DEFAUT)),
+                                  key=f"duree_service{cle}")
+    return debut.strip(), fin.strip(), service
+
+def horaires_valides(debut, fin):
+    """Vérifier le format HH:MM et l'ordre des bornes de la fenêtre horaire"""
+    try:
+        debut_min, fin_min = horaires.minutes(debut), horaires.minutes(fin)
+    except ValueError:
+        return False
+    return debut_min is None or fin_min is None or debut_min < fin_min
+
+def trouver_meilleur_itineraire(date_livraison, magasin_id=None, vehicules=1, capacite=None, depart=None, incremental=True,
+                                zones=0):
+    """Plan des tournées du jour (depuis le cache des plans si les commandes n'ont pas changé), voir plans.py"""
+    import plans
     
-    return optimized_positions
+    return plans.plan_du_jour(donnees_partagees(), cache_plans(), registre_tournees(), date_livraison, magasin_id,
+                              vehicules, capacite, depart, incremental, cache=cache_distances(), budget=BUDGET_ITINERAIRE,
+                              reseau=reseau_routier(), zones=zones, executeur=executeur_itineraire())
 
-def creer_carte_itineraire(positions, magasin_nom):
-    m = folium.Map(location=positions[0], zoom_start=12)
+def construire_carte(plan, distances, noms, positions_clients, reseau=None):
+    """Carte folium des tournées (une couleur par véhicule), rendue en HTML
+
+    Avec un `reseau` routier, les tournées suivent les routes au lieu de
+    relier les arrêts en ligne droite. Un plan découpé en zones affiche
+    chaque zone comme une région de la couleur de sa tournée.
+    """
+    import folium
+    from folium.plugins import FastMarkerCluster, MarkerCluster
+    import itineraire as routage
+    from zones import enveloppe_convexe
+    
+    points = plan["points"]
+    m = folium.Map(location=points[0], zoom_start=12)
     
     # Ajouter la maison (départ)
     folium.Marker(
-        positions[0],
-        popup=st.session_state.magasins_source["maison"]["nom"],
+        points[0],
+        popup=noms["maison"],
         icon=folium.Icon(color='green', icon='home')
     ).add_to(m)
     
-    # Ajouter le magasin source
-    folium.Marker(
-        positions[1],
-        popup=magasin_nom,
-        icon=folium.Icon(color='red', icon='warehouse')
-    ).add_to(m)
+    # Ajouter les magasins source
+    for point, magasin_id in enumerate(plan["magasins_ids"]):
+        if magasin_id is not None:
+            folium.Marker(
+                points[point],
+                popup=noms[magasin_id],
+                icon=folium.Icon(color='red', icon='warehouse')
+            ).add_to(m)
     
-    # Ajouter les points de livraison clients
-    for i, pos in enumerate(positions[2:-1], 2):
-        for client_id, client in st.session_state.clients.items():
-            if 'position' in client and client['position'] == list(pos):
-                folium.Marker(
-                    pos,
-                    popup=f"{client['nom']}",
-                    icon=folium.Icon(color='blue', icon='user')
-                ).add_to(m)
-                break
-    
-    # Ajouter la ligne d'itinéraire
-    folium.PolyLine(positions, color="blue", weight=2.5, opacity=1).add_to(m)
-    
-    # Calculer la distance totale
-    distance_totale = 0
-    for i in range(len(positions) - 1):
-        distance_totale += calculer_distance(positions[i], positions[i + 1])
+    # Au-delà de SEUIL_REGROUPEMENT arrêts, les marqueurs proches sont regroupés (par véhicule)
+    regrouper = len(plan["clients_ids"]) > SEUIL_REGROUPEMENT
+    for numero, vehicule in enumerate(plan["vehicules"]):
+        couleur = COULEURS_VEHICULES[numero % len(COULEURS_VEHICULES)]
+        calque = MarkerCluster(name=f"Véhicule {numero + 1}").add_to(m) if regrouper else m
+        
+        # Région couverte par la zone (enveloppe de ses arrêts)
+        if plan.get("zones"):
+            enveloppe = enveloppe_convexe([points[i] for i in vehicule["tournee"] if plan["clients_ids"][i] is not None])
+            if len(enveloppe) >= 3:
+                folium.Polygon(enveloppe, color=couleur, weight=1, fill=True, fill_color=couleur, fill_opacity=0.15,
+                               tooltip=f"Zone {numero + 1}").add_to(m)
+            else:
+                for position in enveloppe:
+                    folium.Circle(position, radius=300, color=couleur, weight=1, fill=True, fill_opacity=0.15,
+                                  tooltip=f"Zone {numero + 1}").add_to(m)
+        
+        # Ajouter les arrêts clients du véhicule (un marqueur par adresse, avec tous ses clients)
+        for numero_arret, (position, clients_ids) in enumerate(routage.regrouper_arrets(plan, vehicule["tournee"]), 1):
+            noms_arret = ", ".join(noms[client_id] for client_id in clients_ids)
+            folium.Marker(
+                position,
+                popup=f"Arrêt {numero_arret}: {noms_arret} (véhicule {numero + 1})",
+                tooltip=noms_arret,
+                icon=folium.Icon(color=couleur, icon='user')
+            ).add_to(calque)
+        
+        # Ajouter la ligne d'itinéraire
+        trace = reseau.trace(vehicule["positions"]) if reseau is not None else vehicule["positions"]
+        folium.PolyLine(trace, color=couleur, weight=2.5, opacity=1,
+                        tooltip=f"Véhicule {numero + 1}").add_to(m)
+    
+    # Clients qu'aucun véhicule ne peut livrer (capacité ou flotte insuffisante)
+    index = routage.index_clients(plan)
+    for position, clients_ids in routage.regrouper_arrets(plan, [index[client_id] for client_id in plan["non_affectes"]]):
+        noms_arret = ", ".join(noms[client_id] for client_id in clients_ids)
+        folium.Marker(
+            position,
+            popup=f"{noms_arret} (non affecté)",
+            tooltip=noms_arret,
+            icon=folium.Icon(color='gray', icon='user')
+        ).add_to(m)
     
+    # Tous les clients, en calque regroupé rendu côté navigateur
+    if positions_clients:
+        FastMarkerCluster(positions_clients, name="Tous les clients").add_to(m)
+    if regrouper or positions_clients:
+        folium.LayerControl().add_to(m)
+    
+    distance_totale = sum(distances)
     folium.Marker(
-        positions[0],
+        points[0],
         popup=f"Distance totale: {distance_totale:.2f} km",
         icon=folium.DivIcon(html=f"""<div style="font-weight: bold; background: white; padding: 5px; border-radius: 5px; border: 2px solid blue;">
             {distance_totale:.2f} km
         </div>""")
     ).add_to(m)
     
-    return m, distance_totale
+    return m.get_root().render()
+
+def creer_carte_itineraire(plan, precision="geodesique", tous_clients=False):
+    """HTML de la carte des tournées et distance de chaque tournée
+
+    La carte rendue est mise en cache selon l'empreinte des tournées : un
+    nouvel affichage du même plan ne reconstruit pas la carte.
+    """
+    import itineraire as routage
+    import plans
+    
+    # Distance de chaque tournée (exacte, ou d'après la matrice du plan), conservée dans le plan
+    distances = plans.distances_vehicules(plan, precision, cache_distances())
+    cache_distances().enregistrer()
+    
+    noms = {client_id: get_client_name(client_id) for client_id in plan["clients_ids"] if client_id is not None}
+    noms.update({magasin_id: st.session_state.magasins_source[magasin_id]['nom']
+                 for magasin_id in plan["magasins_ids"] if magasin_id is not None})
+    noms["maison"] = st.session_state.magasins_source["maison"]["nom"]
+    positions_clients = [client['position'] for client in st.session_state.clients.values() if 'position' in client] if tous_clients else []
+    
+    # Tracé par la route pour un plan calculé sur le réseau routier
+    reseau = reseau_routier() if plan.get("precision") == routage.PRECISION_ROUTE else None
+    cle = plans.cle_carte(plan, precision, noms=noms, positions_clients=positions_clients,
+                          reseau=reseau.nom if reseau is not None else None)
+    html = cache_cartes().obtenir(cle, lambda: construire_carte(plan, distances, noms, positions_clients, reseau))
+    return html, distances
 
 def generer_bon_pdf(commande_id, client_id, details_commande, montant_paye, quantites_livrees):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=letter)
     
@@ -412,7 +626,7 @@ def modifier_commande(commande_index):
         submitted = st.form_submit_button("💾 Enregistrer les modifications")
         
         if submitted:
-            st.session_state.commandes[commande_index] = {
+            st.session_state.commandes[commande_index] = enregistrement("commandes", {
                 "id": commande['id'],
                 "client_id": client_id,
                 "date_commande": commande['date_commande'],
@@ -421,15 +635,14 @@ def modifier_commande(commande_index):
                 "statut": commande['statut'],
                 "notes": notes,
                 "total_commande": sum(p['quantite'] * p['prix_vente'] for p in nouveaux_produits),
-                "cout_achat": sum(p['quantite'] * p['prix_achat'] for p in nouveaux_produits)
-            }
+                "cout_achat": sum(p['quantite'] * p['prix_achat'] for p in nouveaux_produits),
+                "_version": commande.get('_version', 0)
+            })
+            marquer_modifie("commandes", commande['id'])
             save_data()
             st.success("Commande modifiée avec succès!")
             st.rerun()
 
-# Chargement des données
-load_data()
-
 # Interface principale
 st.title("🚚 Gestion des Livraisons Automobile - Système Complet")
 st.sidebar.title("Navigation")
@@ -438,6 +651,9 @@ st.sidebar.title("Navigation")
 page = st.sidebar.radio("Choisir une section:", 
                         ["Magasins Source", "Clients", "Commandes", "Itinéraire", "Livraisons", "Trésorerie", "Rapports", "Recherche"])
 
+# Chargement des données de la page
+load_data(COLLECTIONS_PAR_PAGE[page])
+
 if page == "Magasins Source":
     st.header("🏭 Configuration des Magasins Source")
     
@@ -461,8 +677,13 @@ if page == "Magasins Source":
                         
                         submitted = st.form_submit_button("💾 Enregistrer les informations de base")
                         if submitted:
+                            ancienne_position = st.session_state.magasins_source[magasin_id]["position"]
                             st.session_state.magasins_source[magasin_id]["nom"] = nom
                             st.session_state.magasins_source[magasin_id]["position"] = [lat, lon]
+                            if list(ancienne_position) != [lat, lon]:
+                                invalider_distances(ancienne_position)
+                                indexer_position("magasin", magasin_id, [lat, lon])
+                            marquer_modifie("magasins_source", magasin_id)
                             save_data()
                             st.success("Informations de base modifiées!")
                     
@@ -495,6 +716,8 @@ if page == "Magasins Source":
                         },
                         "type": "magasin"
                     }
+                    indexer_position("magasin", magasin_id, [lat, lon])
+                    marquer_modifie("magasins_source", magasin_id)
                     save_data()
                     st.success(f"Magasin {nom} ajouté!")
                 else:
@@ -516,6 +739,8 @@ if page == "Magasins Source":
             st.success(f"Magasin actuel: {st.session_state.magasins_source[selected_mag]['nom']}")
 
 elif page == "Clients":
+    import pandas as pd
+    
     st.header("📋 Gestion des Clients")
     
     tab1, tab2 = st.tabs(["Nouveau Client", "Liste des Clients"])
@@ -532,20 +757,29 @@ elif page == "Clients":
                 lat = st.number_input("Latitude*", value=31.609110, format="%.6f")
                 lon = st.number_input("Longitude*", value=-7.968425, format="%.6f")
             
+            fenetre_debut, fenetre_fin, duree_service = saisir_horaires()
+            
             submitted = st.form_submit_button("Enregistrer le client")
             
             if submitted:
-                if nom and telephone and adresse:
-                    client_id = f"CL{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                    st.session_state.clients[client_id] = {
+                if not horaires_valides(fenetre_debut, fenetre_fin):
+                    st.error("Fenêtre horaire invalide (format HH:MM, début avant fin)")
+                elif nom and telephone and adresse:
+                    client_id = nouvel_identifiant("CL")
+                    st.session_state.clients[client_id] = enregistrement("clients", {
                         "nom": nom,
                         "telephone": telephone,
                         "email": email,
                         "adresse": adresse,
                         "position": [lat, lon],
                         "solde": 0.0,
-                        "date_creation": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }
+                        "date_creation": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        "fenetre_debut": fenetre_debut or None,
+                        "fenetre_fin": fenetre_fin or None,
+                        "duree_service": duree_service
+                    })
+                    indexer_position("client", client_id, [lat, lon])
+                    marquer_modifie("clients", client_id)
                     save_data()
                     st.success(f"Client {nom} enregistré avec ID: {client_id}")
                 else:
@@ -553,9 +787,43 @@ elif page == "Clients":
     
     with tab2:
         if st.session_state.clients:
-            clients_df = pd.DataFrame.from_dict(st.session_state.clients, orient='index')
+            clients_df = pd.DataFrame.from_dict(vers_json(st.session_state.clients), orient='index')
             st.dataframe(clients_df[['nom', 'telephone', 'solde', 'adresse']], use_container_width=True)
             
+            # Modification de la position et des horaires de livraison d'un client
+            client_a_deplacer = st.selectbox(
+                "Sélectionner un client à modifier (position, horaires)",
+                options=list(st.session_state.clients.keys()),
+                format_func=lambda x: f"{st.session_state.clients[x]['nom']} - {st.session_state.clients[x]['telephone']}",
+                key="position_client_select"
+            )
+            
+            if client_a_deplacer:
+                client = st.session_state.clients[client_a_deplacer]
+                with st.form(f"position_client_{client_a_deplacer}"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        lat = st.number_input("Latitude", value=float(client["position"][0]), format="%.6f")
+                    with col2:
+                        lon = st.number_input("Longitude", value=float(client["position"][1]), format="%.6f")
+                    
+                    fenetre_debut, fenetre_fin, duree_service = saisir_horaires(client, f"_{client_a_deplacer}")
+                    
+                    if st.form_submit_button("📍 Enregistrer"):
+                        if not horaires_valides(fenetre_debut, fenetre_fin):
+                            st.error("Fenêtre horaire invalide (format HH:MM, début avant fin)")
+                        else:
+                            if list(client["position"]) != [lat, lon]:
+                                invalider_distances(client["position"])
+                                client["position"] = [lat, lon]
+                                indexer_position("client", client_a_deplacer, [lat, lon])
+                            client["fenetre_debut"] = fenetre_debut or None
+                            client["fenetre_fin"] = fenetre_fin or None
+                            client["duree_service"] = duree_service
+                            marquer_modifie("clients", client_a_deplacer)
+                            save_data()
+                            st.success(f"Client {client['nom']} modifié!")
+            
             # Suppression de clients
             client_a_supprimer = st.selectbox(
                 "Sélectionner un client à supprimer",
@@ -567,11 +835,17 @@ elif page == "Clients":
             if st.button("🗑️ Supprimer le client", key="delete_client_btn"):
                 if client_a_supprimer:
                     nom_client = st.session_state.clients[client_a_supprimer]['nom']
+                    invalider_distances(st.session_state.clients[client_a_supprimer].get('position'))
+                    indexer_position("client", client_a_supprimer, None)
                     del st.session_state.clients[client_a_supprimer]
                     
                     # Supprimer aussi les commandes associées à ce client
-                    st.session_state.commandes = [cmd for cmd in st.session_state.commandes if cmd['client_id'] != client_a_supprimer]
+                    commandes_supprimees = [cmd['id'] for cmd in st.session_state.commandes if cmd['client_id'] == client_a_supprimer]
+                    st.session_state.commandes[:] = [cmd for cmd in st.session_state.commandes if cmd['client_id'] != client_a_supprimer]
                     
+                    marquer_modifie("clients", client_a_supprimer)
+                    for commande_id in commandes_supprimees:
+                        marquer_modifie("commandes", commande_id)
                     save_data()
                     st.success(f"Client {nom_client} supprimé avec succès!")
                     st.rerun()
@@ -694,7 +968,7 @@ elif page == "Commandes":
                     elif not st.session_state.panier:
                         st.error("Le panier est vide. Veuillez ajouter des produits.")
                     else:
-                        commande_id = f"CMD{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                        commande_id = nouvel_identifiant("CMD")
                         
                         nouvelle_commande = {
                             "id": commande_id,
@@ -709,8 +983,9 @@ elif page == "Commandes":
                             "magasin_source": st.session_state.selected_magasin
                         }
                         
-                        st.session_state.commandes.append(nouvelle_commande)
+                        st.session_state.commandes.append(enregistrement("commandes", nouvelle_commande))
                         st.session_state.panier = []
+                        marquer_modifie("commandes", commande_id)
                         save_data()
                         st.success(f"Commande #{commande_id} enregistrée pour {st.session_state.clients[client_id]['nom']}")
     
@@ -733,6 +1008,7 @@ elif page == "Commandes":
                     with col2:
                         if st.button(f"🗑️ Supprimer", key=f"del_cmd_{i}"):
                             st.session_state.commandes.pop(i)
+                            marquer_modifie("commandes", cmd['id'])
                             save_data()
                             st.success("Commande supprimée!")
                             st.rerun()
@@ -740,7 +1016,13 @@ elif page == "Commandes":
             st.info("Aucune commande enregistrée")
 
 elif page == "Itinéraire":
+    import streamlit.components.v1 as components
+    import itineraire as routage
+    import plans
+    from zones import SEUIL_ZONES
+    
     st.header("🗺️ Planification de l'Itinéraire")
+    precalcul_plans()
     
     date_livraison = st.date_input("Date pour l'itinéraire", 
                                   value=datetime.now().date() + timedelta(days=1))
@@ -751,54 +1033,246 @@ elif page == "Itinéraire":
     if not magasins_disponibles:
         st.warning("Aucun magasin source configuré. Veuillez d'abord ajouter des magasins.")
     else:
-        magasin_id = st.selectbox(
-            "Magasin source",
-            options=magasins_disponibles,
-            format_func=lambda x: st.session_state.magasins_source[x]['nom'],
-            key="itineraire_magasin"
+        # Tournée combinée : toutes les commandes du jour, retraits dans chaque magasin concerné
+        mode_combine = st.checkbox("Tournée combinée (tous les magasins en une seule tournée)", key="itineraire_combine")
+        
+        if mode_combine:
+            magasin_id = None
+        else:
+            magasin_id = st.selectbox(
+                "Magasin source",
+                options=magasins_disponibles,
+                format_func=lambda x: st.session_state.magasins_source[x]['nom'],
+                key="itineraire_magasin"
+            )
+        
+        # Dernière tournée retenue pour ce jour et ce magasin
+        cle_tournee = RegistreTournees.cle(date_livraison.strftime('%Y-%m-%d'), magasin_id)
+        
+        # Par la route si un réseau routier local est configuré
+        precisions = list(routage.PRECISIONS)[::-1]
+        if reseau_routier() is not None:
+            precisions.insert(0, routage.PRECISION_ROUTE)
+        precision = st.radio(
+            "Calcul de la distance totale",
+            options=precisions,
+            format_func=lambda x: {"route": "Par la route (réseau local)", "geodesique": "Exact (géodésique)",
+                                   "haversine": "Rapide (haversine)"}[x],
+            horizontal=True,
+            key="itineraire_precision"
         )
         
-        commandes_du_jour = [cmd for cmd in st.session_state.commandes 
-                            if cmd['date_livraison_prevue'] == date_livraison.strftime('%Y-%m-%d')
-                            and cmd['statut'] in ['en_attente', 'partiellement_livre']
-                            and cmd.get('magasin_source', 'depot_central') == magasin_id]
+        # Flotte : nombre de véhicules, capacité de chacun (0 = illimitée) et heure de départ ;
+        # la tournée combinée se fait avec un seul véhicule. Un découpage en zones
+        # géographiques (charges équilibrées) donne une tournée par zone.
+        col1, col2, col3, col4 = st.columns(4)
+        with col4:
+            nombre_zones = st.number_input("Zones géographiques (0 = aucune)", min_value=0, max_value=20, value=0, step=1,
+                                           key="itineraire_zones", disabled=mode_combine)
+            nombre_zones = 0 if mode_combine else int(nombre_zones)
+        with col1:
+            nombre_vehicules = st.number_input("Nombre de véhicules", min_value=1, max_value=20, value=1, step=1,
+                                               key="itineraire_vehicules", disabled=mode_combine or nombre_zones > 0)
+        with col2:
+            capacite = st.number_input("Capacité par véhicule (0 = illimitée)", min_value=0.0, value=0.0, step=10.0,
+                                       key="itineraire_capacite", disabled=mode_combine or nombre_zones > 0)
+        with col3:
+            heure_depart = st.time_input("Heure de départ", value=datetime.strptime(plans.DEPART_DEFAUT, "%H:%M").time(),
+                                         key="itineraire_depart")
+        
+        # Mise à jour incrémentale : proposée seulement si les commandes ont changé depuis la tournée retenue
+        # (mêmes paramètres) ; les arrêts prévus gardent leur ordre, les livrés leur place
+        incremental = False
+        if plans.mise_a_jour_possible(donnees_partagees(), registre_tournees(), date_livraison.strftime('%Y-%m-%d'),
+                                      magasin_id, vehicules=int(nombre_vehicules), capacite=capacite or None,
+                                      depart=horaires.minutes(heure_depart), zones=nombre_zones):
+            incremental = st.checkbox("Garder l'ordre des arrêts déjà prévus (mise à jour incrémentale)", value=True,
+                                      key="itineraire_incremental")
         
-        if not commandes_du_jour:
+        try:
+            plan, commandes_du_jour, tournee_retenue = trouver_meilleur_itineraire(
+                date_livraison.strftime('%Y-%m-%d'), magasin_id, int(nombre_vehicules), capacite or None,
+                horaires.minutes(heure_depart), incremental, nombre_zones)
+        except Exception as e:
+            plan, commandes_du_jour = None, None
+            st.error(f"Erreur lors de la génération de l'itinéraire: {str(e)}")
+            st.info("Vérifiez que tous les clients ont des coordonnées GPS valides")
+        
+        if commandes_du_jour == []:
             st.info("Aucune commande à livrer pour cette date depuis ce magasin")
-        else:
+        elif plan is not None:
             try:
-                positions = trouver_meilleur_itineraire(commandes_du_jour, magasin_id)
-                carte, distance_totale = creer_carte_itineraire(positions, st.session_state.magasins_source[magasin_id]['nom'])
+                registre_tournees().enregistrer(cle_tournee, tournee_retenue)
+                tous_clients = st.checkbox("Afficher tous les clients sur la carte", key="itineraire_tous_clients")
+                carte, distances = creer_carte_itineraire(plan, precision, tous_clients)
+                distance_totale = sum(distances)
+                distance_gloutonne = sum(plans.distances_vehicules(plan, precision, cache_distances(), "tournee_gloutonne"))
                 
                 st.subheader("Circuit de livraison optimisé")
-                st.metric("Distance totale estimée", f"{distance_totale:.2f} km")
-                folium_static(carte, width=1000, height=600)
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("Distance totale estimée", f"{distance_totale:.2f} km")
+                with col2:
+                    st.metric("Km économisés", f"{distance_gloutonne - distance_totale:.2f} km",
+                              delta=f"{distance_gloutonne:.2f} km en tournées gloutonnes", delta_color="off")
+                
+                if len(plan["vehicules"]) > 1:
+                    colonnes = st.columns(len(plan["vehicules"]))
+                    for numero, (colonne, vehicule, distance) in enumerate(zip(colonnes, plan["vehicules"], distances), 1):
+                        with colonne:
+                            st.metric(f"Véhicule {numero}", f"{distance:.2f} km",
+                                      delta=f"{len(vehicule['clients_ids'])} clients - charge {vehicule['charge']:g}",
+                                      delta_color="off")
+                
+                nombre_arrets = len(routage.index_clients(plan))
+                if not mode_combine and not plan["zones"] and nombre_arrets >= SEUIL_ZONES:
+                    st.info(f"{nombre_arrets} arrêts : un découpage en zones géographiques donnerait des tournées "
+                            f"plus courtes à calculer et à effectuer")
+                
+                methodes = {vehicule["methode"] for vehicule in plan["vehicules"]}
+                st.caption(" / ".join({
+                    "exacte": "Tournée optimale exacte (Held-Karp)",
+                    "heuristique": "Tournée améliorée par 2-opt / Or-opt",
+                    "gloutonne": "Tournée gloutonne (plus proche voisin)",
+                    "incrementale": "Tournée mise à jour (ordre des arrêts prévus conservé)"
+                }[methode] for methode in sorted(methodes)))
+                
+                if plan["non_affectes"]:
+                    st.warning("Clients non affectés (capacité ou nombre de véhicules insuffisant): " +
+                               ", ".join(get_client_name(client_id) for client_id in plan["non_affectes"]))
+                if plan["hors_fenetre"]:
+                    st.error("⚠️ Livraisons impossibles dans la fenêtre horaire: " +
+                             ", ".join(get_client_name(client_id) for client_id in plan["hors_fenetre"]))
+                components.html(carte, width=1000, height=600)
+                
+                # Heures d'arrivée prévues à chaque arrêt
+                st.subheader("Horaires prévus")
+                for numero, vehicule in enumerate(plan["vehicules"], 1):
+                    arrets = []
+                    for point, horaire in zip(vehicule["tournee"][1:], vehicule["horaires"][1:]):
+                        client_id = plan["clients_ids"][point]
+                        if client_id is None:
+                            nom = st.session_state.magasins_source[plan["magasins_ids"][point] or "maison"]["nom"]
+                            fenetre = ""
+                        else:
+                            client = st.session_state.clients[client_id]
+                            nom = client['nom']
+                            fenetre = f"{client.get('fenetre_debut') or '...'} - {client.get('fenetre_fin') or '...'}" if client.get('fenetre_debut') or client.get('fenetre_fin') else ""
+                        if horaire["retard"] > 0:
+                            etat = f"⚠️ Retard {horaire['retard']:.0f} min"
+                        elif horaire["attente"] > 0:
+                            etat = f"Attente {horaire['attente']:.0f} min"
+                        else:
+                            etat = "✅"
+                        arrets.append({
+                            "Arrêt": nom,
+                            "Arrivée prévue": horaires.format_heure(horaire["arrivee"]),
+                            "Fenêtre": fenetre,
+                            "État": etat
+                        })
+                    if len(plan["vehicules"]) > 1:
+                        st.write(f"**Véhicule {numero}**")
+                    st.dataframe(arrets, use_container_width=True, hide_index=True)
                 
                 st.subheader("Détail des livraisons")
+                vehicule_du_client = {client_id: numero for numero, vehicule in enumerate(plan["vehicules"], 1)
+                                      for client_id in vehicule["clients_ids"]}
                 for i, cmd in enumerate(commandes_du_jour, 1):
                     client_name = get_client_name(cmd['client_id'])
                     produits_str = ", ".join([f"{p['quantite']} {p['morceau']}" for p in cmd['produits']])
+                    if len(plan["vehicules"]) > 1 and cmd['client_id'] in vehicule_du_client:
+                        produits_str += f" (véhicule {vehicule_du_client[cmd['client_id']]})"
+                    if cmd['statut'] == 'livree':
+                        produits_str += " - ✅ livrée"
                     st.write(f"{i}. {client_name} - {produits_str}")
                 
                 # Option pour marquer comme prêt pour livraison
                 if st.button("✅ Préparer pour livraison"):
                     for cmd in commandes_du_jour:
+                        if cmd['statut'] not in ('en_attente', 'partiellement_livre'):
+                            continue
                         cmd['statut'] = 'en_cours'
+                        marquer_modifie("commandes", cmd['id'])
                     save_data()
                     st.success("Commandes marquées comme prêtes pour livraison!")
                     
             except Exception as e:
                 st.error(f"Erreur lors de la génération de l'itinéraire: {str(e)}")
                 st.info("Vérifiez que tous les clients ont des coordonnées GPS valides")
+    
+    # Recherche de proximité : livraisons opportunistes, choix du magasin le plus proche
+    with st.expander("📍 Clients à proximité"):
+        origine = st.radio("Autour de", ["Magasin", "Client", "Coordonnées"], horizontal=True, key="proximite_origine")
+        if origine == "Magasin":
+            magasin_centre = st.selectbox(
+                "Magasin",
+                options=list(st.session_state.magasins_source.keys()),
+                format_func=lambda x: st.session_state.magasins_source[x]['nom'],
+                key="proximite_magasin"
+            )
+            centre = st.session_state.magasins_source[magasin_centre]["position"]
+        elif origine == "Client" and st.session_state.clients:
+            client_centre = st.selectbox(
+                "Client",
+                options=list(st.session_state.clients.keys()),
+                format_func=lambda x: f"{st.session_state.clients[x]['nom']} - {st.session_state.clients[x]['telephone']}",
+                key="proximite_client"
+            )
+            centre = st.session_state.clients[client_centre].get("position")
+        elif origine == "Coordonnées":
+            col1, col2 = st.columns(2)
+            with col1:
+                lat = st.number_input("Latitude", value=31.609110, format="%.6f", key="proximite_lat")
+            with col2:
+                lon = st.number_input("Longitude", value=-7.968425, format="%.6f", key="proximite_lon")
+            centre = [lat, lon]
+        else:
+            centre = None
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            recherche = st.radio("Recherche", ["Rayon", "Plus proches"], horizontal=True, key="proximite_recherche")
+        with col2:
+            if recherche == "Rayon":
+                rayon = st.number_input("Rayon (km)", min_value=0.1, value=2.0, step=0.5, key="proximite_rayon")
+            else:
+                nombre = st.number_input("Nombre de clients", min_value=1, max_value=100, value=5, step=1,
+                                         key="proximite_nombre")
+        
+        if centre:
+            index = index_positions().index()
+            # Le client de départ n'est pas son propre voisin
+            exclu = ("client", client_centre) if origine == "Client" else None
+            est_client = lambda cle: cle[0] == "client" and cle != exclu
+            if recherche == "Rayon":
+                voisins = index.dans_rayon(centre, rayon, filtre=est_client)
+            else:
+                voisins = index.plus_proches(centre, int(nombre), filtre=est_client)
+            
+            if voisins:
+                st.dataframe([{
+                    "Client": st.session_state.clients[client_id]['nom'],
+                    "Téléphone": st.session_state.clients[client_id]['telephone'],
+                    "Distance (km)": round(distance, 2)
+                } for (_, client_id), distance in voisins if client_id in st.session_state.clients],
+                    use_container_width=True, hide_index=True)
+            else:
+                st.info("Aucun client dans cette zone")
+            
+            autre_magasin = lambda cle: cle[0] == "magasin" and not (origine == "Magasin" and cle[1] == magasin_centre)
+            magasins_proches = index.plus_proches(centre, 1, filtre=autre_magasin)
+            if magasins_proches:
+                (_, magasin_proche), distance = magasins_proches[0]
+                st.caption(f"Magasin le plus proche : {st.session_state.magasins_source[magasin_proche]['nom']} "
+                           f"({distance:.2f} km)")
 
 elif page == "Livraisons":
     st.header("📦 Livraisons du Jour")
     
     date_livraison = st.date_input("Date de livraison", value=datetime.now().date())
     
-    commandes_a_livrer = [cmd for cmd in st.session_state.commandes 
-                         if cmd['date_livraison_prevue'] == date_livraison.strftime('%Y-%m-%d')
-                         and cmd['statut'] in ['en_cours', 'partiellement_livre']]
+    commandes_a_livrer = rechercher_commandes(date_livraison=date_livraison.strftime('%Y-%m-%d'),
+                                              statuts=['en_cours', 'partiellement_livre'])
     
     if commandes_a_livrer:
         for commande in commandes_a_livrer:
@@ -851,8 +1325,8 @@ elif page == "Livraisons":
                             commande['statut'] = 'annulee'
                         
                         # Enregistrer dans l'historique des livraisons
-                        livraison_id = f"LIV{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        st.session_state.livraisons.append({
+                        livraison_id = nouvel_identifiant("LIV")
+                        st.session_state.livraisons.append(enregistrement("livraisons", {
                             "id": livraison_id,
                             "commande_id": commande['id'],
                             "client_id": commande['client_id'],
@@ -860,7 +1334,7 @@ elif page == "Livraisons":
                             "quantites_livrees": quantites_livrees,
                             "montant_paye": montant_paye,
                             "statut": commande['statut']
-                        })
+                        }))
                         
                         # Mettre à jour le solde client
                         total_a_payer = sum(q * p['prix_vente'] for q, p in zip(quantites_livrees, commande['produits']))
@@ -869,15 +1343,20 @@ elif page == "Livraisons":
                         
                         # Enregistrer dans la trésorerie
                         if montant_paye > 0:
-                            st.session_state.tresorerie.append({
+                            st.session_state.tresorerie.append(enregistrement("tresorerie", {
                                 "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                                 "type": "encaissement",
                                 "montant": montant_paye,
                                 "description": f"Paiement livraison {commande['id']}",
                                 "client_id": commande['client_id'],
                                 "commande_id": commande['id']
-                            })
+                            }))
                         
+                        marquer_modifie("commandes", commande['id'])
+                        marquer_modifie("livraisons", livraison_id)
+                        marquer_modifie("clients", commande['client_id'])
+                        if montant_paye > 0:
+                            marquer_modifie("tresorerie", len(st.session_state.tresorerie) - 1)
                         save_data()
                         
                         # Générer le bon de livraison PDF
@@ -905,6 +1384,8 @@ elif page == "Livraisons":
 
 
 elif page == "Trésorerie":
+    import pandas as pd
+    
     st.header("💰 Gestion de la Trésorerie")
     
     tab1, tab2, tab3 = st.tabs(["Solde Clients", "Mouvements", "Nouvelle Dépense"])
@@ -937,13 +1418,15 @@ elif page == "Trésorerie":
                 submitted = st.form_submit_button("💵 Enregistrer le paiement")
                 if submitted:
                     st.session_state.clients[client_id]['solde'] -= montant
-                    st.session_state.tresorerie.append({
+                    st.session_state.tresorerie.append(enregistrement("tresorerie", {
                         "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                         "type": "encaissement",
                         "montant": montant,
                         "description": f"Règlement solde client",
                         "client_id": client_id
-                    })
+                    }))
+                    marquer_modifie("clients", client_id)
+                    marquer_modifie("tresorerie", len(st.session_state.tresorerie) - 1)
                     save_data()
                     st.success(f"Paiement de {montant} DH enregistré pour {st.session_state.clients[client_id]['nom']}")
         else:
@@ -951,18 +1434,20 @@ elif page == "Trésorerie":
     
     with tab2:
         st.subheader("Mouvements de trésorerie")
-        if st.session_state.tresorerie:
-            df_tresorerie = pd.DataFrame(st.session_state.tresorerie)
+        # Filtres
+        col1, col2 = st.columns(2)
+        with col1:
+            date_debut = st.date_input("Date début", value=datetime.now().date() - timedelta(days=30))
+        with col2:
+            date_fin = st.date_input("Date fin", value=datetime.now().date())
+        
+        # Mouvements en ligne et archives des mois de la période
+        mouvements = archives.avec_archives("tresorerie", st.session_state.tresorerie, date_debut, date_fin)
+        if mouvements:
+            df_tresorerie = pd.DataFrame(vers_json(mouvements)).drop(columns=[CHAMP_VERSION], errors='ignore')
             df_tresorerie['date'] = pd.to_datetime(df_tresorerie['date'])
             df_tresorerie = df_tresorerie.sort_values('date', ascending=False)
             
-            # Filtres
-            col1, col2 = st.columns(2)
-            with col1:
-                date_debut = st.date_input("Date début", value=datetime.now().date() - timedelta(days=30))
-            with col2:
-                date_fin = st.date_input("Date fin", value=datetime.now().date())
-            
             df_filtre = df_tresorerie[
                 (df_tresorerie['date'].dt.date >= date_debut) & 
                 (df_tresorerie['date'].dt.date <= date_fin)
@@ -991,19 +1476,22 @@ elif page == "Trésorerie":
             
             submitted = st.form_submit_button("💸 Enregistrer la dépense")
             if submitted:
-                st.session_state.tresorerie.append({
+                st.session_state.tresorerie.append(enregistrement("tresorerie", {
                     "date": date_depense.strftime('%Y-%m-%d %H:%M:%S'),
                     "type": "depense",
                     "montant": montant,
                     "description": description
-                })
+                }))
+                marquer_modifie("tresorerie", len(st.session_state.tresorerie) - 1)
                 save_data()
                 st.success("Dépense enregistrée!")
 
 elif page == "Rapports":
+    import pandas as pd
+    
     st.header("📊 Rapports et Statistiques")
     
-    tab1, tab2, tab3 = st.tabs(["Ventes", "Performance", "Stocks"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Ventes", "Performance", "Stocks", "Archives"])
     
     with tab1:
         st.subheader("Rapport des Ventes")
@@ -1015,8 +1503,9 @@ elif page == "Rapports":
         with col2:
             date_fin = st.date_input("Date fin", value=datetime.now().date())
         
-        # Filtrer les commandes livrées
-        commandes_livrees = [cmd for cmd in st.session_state.commandes 
+        # Filtrer les commandes livrées (en ligne et archives des mois de la période)
+        commandes_periode = archives.avec_archives("commandes", st.session_state.commandes, date_debut, date_fin)
+        commandes_livrees = [cmd for cmd in commandes_periode 
                            if cmd['statut'] in ['livree', 'partiellement_livre']
                            and datetime.strptime(cmd.get('date_livraison_reelle', cmd['date_commande']), '%Y-%m-%d %H:%M:%S').date() >= date_debut
                            and datetime.strptime(cmd.get('date_livraison_reelle', cmd['date_commande']), '%Y-%m-%d %H:%M:%S').date() <= date_fin]
@@ -1057,7 +1546,7 @@ elif page == "Rapports":
             
             df_clients = pd.DataFrame([
                 {
-                    'Client': st.session_state.clients[client_id]['nom'],
+                    'Client': get_client_name(client_id),
                     'CA Total': montant
                 }
                 for client_id, montant in clients_activite.items()
@@ -1073,12 +1562,15 @@ elif page == "Rapports":
     with tab2:
         st.subheader("Performance de Livraison")
         
-        # Statistiques de livraison
-        total_commandes = len(st.session_state.commandes)
-        livrees_complet = len([cmd for cmd in st.session_state.commandes if cmd['statut'] == 'livree'])
-        livrees_partiel = len([cmd for cmd in st.session_state.commandes if cmd['statut'] == 'partiellement_livre'])
-        en_attente = len([cmd for cmd in st.session_state.commandes if cmd['statut'] == 'en_attente'])
-        annulees = len([cmd for cmd in st.session_state.commandes if cmd['statut'] == 'annulee'])
+        # Statistiques de livraison (commandes en ligne et archivées)
+        comptes_statut = donnees_partagees().compter_commandes_par_statut()
+        for statut, nombre in archives.compter_archives_par_statut().items():
+            comptes_statut[statut] = comptes_statut.get(statut, 0) + nombre
+        total_commandes = sum(comptes_statut.values())
+        livrees_complet = comptes_statut.get('livree', 0)
+        livrees_partiel = comptes_statut.get('partiellement_livre', 0)
+        en_attente = comptes_statut.get('en_attente', 0)
+        annulees = comptes_statut.get('annulee', 0)
         
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("📦 Total Commandes", total_commandes)
@@ -1095,9 +1587,8 @@ elif page == "Rapports":
         st.subheader("Gestion des Stocks (Simulation)")
         
         # Simulation de stock basée sur les commandes à venir
-        commandes_futures = [cmd for cmd in st.session_state.commandes 
-                           if cmd['statut'] in ['en_attente', 'en_cours']
-                           and datetime.strptime(cmd['date_livraison_prevue'], '%Y-%m-%d').date() >= datetime.now().date()]
+        commandes_futures = rechercher_commandes(statuts=['en_attente', 'en_cours'],
+                                                 date_min=datetime.now().strftime('%Y-%m-%d'))
         
         if commandes_futures:
             besoins_stock = {}
@@ -1115,12 +1606,42 @@ elif page == "Rapports":
             st.dataframe(df_besoins, use_container_width=True)
         else:
             st.info("Aucune commande nécessitant du stock")
+    
+    with tab4:
+        st.subheader("Archives mensuelles")
+        st.write("Les commandes closes (livrées ou annulées), les livraisons et les mouvements de trésorerie "
+                 "des mois antérieurs sont déplacés dans des archives mensuelles, lues uniquement "
+                 "par les rapports et recherches qui couvrent ces mois.")
+        
+        index_archives = archives.lire_index()
+        resume_archives = [
+            {"Collection": nom, "Mois": mois, "Enregistrements": resume["nombre"]}
+            for nom in archives.COLLECTIONS_ARCHIVEES
+            for mois, resume in sorted(index_archives.get(nom, {}).items())
+        ]
+        if resume_archives:
+            st.dataframe(pd.DataFrame(resume_archives), use_container_width=True)
+        else:
+            st.info("Aucune archive")
+        
+        mois_a_garder = st.number_input("Mois à garder en ligne (mois courant compris)", min_value=1, value=2)
+        if st.button("🗄️ Archiver les mois clos"):
+            archives_faites = archives.archiver(donnees_partagees(), mois_a_garder)
+            st.success("Archivage terminé: " + ", ".join(f"{nombre} {nom}" for nom, nombre in archives_faites.items()))
+            st.rerun()
 
 elif page == "Recherche":
     st.header("🔍 Recherche Avancée")
     
     search_term = st.text_input("Rechercher (nom client, téléphone, produit...)")
     
+    # Période couverte dans les archives (les commandes en ligne sont toujours recherchées)
+    col1, col2 = st.columns(2)
+    with col1:
+        date_debut = st.date_input("Archives depuis", value=datetime.now().date() - timedelta(days=90))
+    with col2:
+        date_fin = st.date_input("Archives jusqu'au", value=datetime.now().date())
+    
     if search_term:
         # Recherche dans les clients
         clients_trouves = []
@@ -1131,8 +1652,11 @@ elif page == "Recherche":
                 clients_trouves.append(client_id)
         
         # Recherche dans les commandes
+        commandes_periode = archives.avec_archives("commandes", st.session_state.commandes, date_debut, date_fin)
+        commandes_archivees = [cmd for cmd in commandes_periode[len(st.session_state.commandes):]
+                               if date_debut.strftime('%Y-%m-%d') <= archives.date_reference("commandes", cmd)[:10] <= date_fin.strftime('%Y-%m-%d')]
         commandes_trouvees = []
-        for cmd in st.session_state.commandes:
+        for cmd in st.session_state.commandes + commandes_archivees:
             # Par produit
             for prod in cmd['produits']:
                 if search_term.lower() in prod['morceau'].lower():
@@ -1170,10 +1694,33 @@ elif page == "Recherche":
 st.sidebar.markdown("---")
 st.sidebar.info("**Système de gestion des livraisons** v2.0\n\nDéveloppé pour optimiser les livraisons automobile")
 
-# Sauvegarde automatique périodique
-if 'last_save' not in st.session_state:
-    st.session_state.last_save = datetime.now()
+donnees = donnees_partagees()
+if donnees.derniere_sauvegarde:
+    sauvegarde = donnees.derniere_sauvegarde
+    details = ", ".join(f"{nom}: {octets} o" for nom, octets in sauvegarde["octets"].items())
+    st.sidebar.caption(f"💾 Dernière sauvegarde ({sauvegarde['date']}): {sum(sauvegarde['octets'].values())} octets écrits ({details})")
+if donnees.ecriture_differee and donnees.ecriture_differee.derniere_erreur:
+    st.sidebar.error(f"Erreur de sauvegarde: {donnees.ecriture_differee.derniere_erreur}")
+for conflit in donnees.conflits[-3:]:
+    st.sidebar.warning(f"⚠️ {conflit['date']} - {conflit['collection']} {conflit['cle']} modifié en même temps sur un autre poste : "
+                       f"modification annulée ({', '.join(conflit['annulees'])}), la version déjà enregistrée a été conservée")
+
+precalcul = etat_precalcul()["precalcul"]
+if precalcul is not None and precalcul.dernier_calcul:
+    st.sidebar.caption(f"🗺️ Tournées de demain précalculées à {precalcul.dernier_calcul}")
+if precalcul is not None and precalcul.derniere_erreur:
+    st.sidebar.error(f"Erreur de précalcul des tournées: {precalcul.derniere_erreur}")
+
+# Sauvegarde à la demande (les modifications sont sinon écrites en arrière-plan)
+if st.sidebar.button("💾 Sauvegarder maintenant"):
+    donnees.sauvegarder()
+    st.sidebar.success("Données sauvegardées")
 
-if (datetime.now() - st.session_state.last_save).seconds > 300:  # Sauvegarde toutes les 5 minutes
-    save_data()
-    st.session_state.last_save = datetime.now()
\ No newline at end of file
+# Mesure du temps d'exécution (le premier passage du processus correspond au démarrage à froid)
+mesures = mesures_demarrage()
+duree_ms = (time.perf_counter() - _debut_execution) * 1000
+mesures["derniere_execution"] = {"page": page, "duree_ms": duree_ms}
+if mesures["demarrage_a_froid"] is None:
+    mesures["demarrage_a_froid"] = {"page": page, "duree_ms": duree_ms}
+st.sidebar.caption(f"⏱️ Démarrage à froid: {mesures['demarrage_a_froid']['duree_ms']:.0f} ms "
+                   f"({mesures['demarrage_a_froid']['page']}) · Cette page: {duree_ms:.0f} ms")
@@ -0,0 +1,206 @@
+import json
+import os
+from collections import Counter
+from datetime import date
+from functools import lru_cache
+
+from stockage import VerrouFichier, ecrire_json, signature_fichier
+
+# Archives froides : un fichier JSON par collection et par mois
+DOSSIER_ARCHIVES = "archives"
+FICHIER_INDEX = os.path.join(DOSSIER_ARCHIVES, "index.json")
+COLLECTIONS_ARCHIVEES = ("commandes", "livraisons", "tresorerie")
+STATUTS_CLOS = ("livree", "annulee")
+
+
+def date_reference(nom, enregistrement):
+    """Date (AAAA-MM-JJ ...) qui détermine le mois d'archivage d'un enregistrement"""
+    if nom == "commandes":
+        return enregistrement.get('date_livraison_reelle', enregistrement['date_commande'])
+    if nom == "livraisons":
+        return enregistrement['date_livraison']
+    return enregistrement['date']
+
+
+def cle_mouvement(mouvement):
+    """Clé stable d'un mouvement de trésorerie (qui n'a pas d'identifiant) : date, type, montant et référence"""
+    if mouvement.get('id') is not None:
+        return mouvement['id']
+    return json.dumps([mouvement.get('date'), mouvement.get('type'), mouvement.get('montant'),
+                       mouvement.get('commande_id'), mouvement.get('client_id'), mouvement.get('description')],
+                      default=str)
+
+
+def sans_doublons(nom, enregistrements, deja_presents):
+    """Enregistrements absents de `deja_presents`
+
+    Les mouvements de trésorerie sont comparés par clé stable, en
+    multiensemble : deux mouvements identiques ne s'annulent qu'une fois.
+    """
+    if nom != "tresorerie":
+        ids = {e['id'] for e in deja_presents}
+        return [e for e in enregistrements if e['id'] not in ids]
+    restants = Counter(cle_mouvement(e) for e in deja_presents)
+    resultat = []
+    for e in enregistrements:
+        cle = cle_mouvement(e)
+        if restants[cle] > 0:
+            restants[cle] -= 1
+        else:
+            resultat.append(e)
+    return resultat
+
+
+def mois_de(date_texte):
+    return date_texte[:7]
+
+
+def mois_limite(mois_a_garder, aujourd_hui=None):
+    """Premier mois conservé en ligne lorsqu'on garde `mois_a_garder` mois (mois courant compris)"""
+    aujourd_hui = aujourd_hui or date.today()
+    total = aujourd_hui.year * 12 + aujourd_hui.month - 1 - (mois_a_garder - 1)
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+
+def chemin_partition(nom, mois):
+    return os.path.join(DOSSIER_ARCHIVES, f"{nom}_{mois}.json")
+
+
+def lire_index():
+    try:
+        with open(FICHIER_INDEX, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {nom: {} for nom in COLLECTIONS_ARCHIVEES}
+
+
+@lru_cache(maxsize=64)
+def _lire_partition(chemin, signature):
+    # La signature (date de modification, taille) fait partie de la clé du cache
+    with open(chemin, 'r') as f:
+        return json.load(f)
+
+
+def lire_partition(nom, mois):
+    chemin = chemin_partition(nom, mois)
+    signature = signature_fichier(chemin)
+    if signature is None:
+        return []
+    return _lire_partition(chemin, signature)
+
+
+def partitions(nom, date_debut=None, date_fin=None):
+    """Mois archivés d'une collection qui recoupent la période [date_debut, date_fin]"""
+    mois = sorted(lire_index().get(nom, {}))
+    if date_debut is not None:
+        mois = [m for m in mois if m >= date_debut.strftime('%Y-%m')]
+    if date_fin is not None:
+        mois = [m for m in mois if m <= date_fin.strftime('%Y-%m')]
+    return mois
+
+
+def charger_archives(nom, date_debut=None, date_fin=None):
+    """Enregistrements archivés des seules partitions qui recoupent la période"""
+    enregistrements = []
+    for mois in partitions(nom, date_debut, date_fin):
+        enregistrements.extend(lire_partition(nom, mois))
+    return enregistrements
+
+
+def avec_archives(nom, en_ligne, date_debut=None, date_fin=None):
+    """Collection en ligne complétée par les archives de la période
+
+    Un enregistrement présent des deux côtés (archivage interrompu avant
+    la sauvegarde des données en ligne) n'est compté qu'une fois.
+    """
+    archives = charger_archives(nom, date_debut, date_fin)
+    if not archives:
+        return en_ligne
+    return list(en_ligne) + sans_doublons(nom, archives, en_ligne)
+
+
+def compter_archives_par_statut():
+    """Nombre de commandes archivées par statut, d'après l'index"""
+    comptes = {}
+    for resume in lire_index().get("commandes", {}).values():
+        for statut, nombre in resume["statuts"].items():
+            comptes[statut] = comptes.get(statut, 0) + nombre
+    return comptes
+
+
+def a_archiver(nom, enregistrement, limite):
+    if nom == "commandes" and enregistrement['statut'] not in STATUTS_CLOS:
+        return False
+    return mois_de(date_reference(nom, enregistrement)) < limite
+
+
+def archiver(donnees, mois_a_garder=2):
+    """Déplacer vers les archives mensuelles les enregistrements antérieurs à la limite
+
+    Seules les commandes closes (livrées ou annulées) sont archivées ; les
+    livraisons et mouvements de trésorerie le sont selon leur date. Les
+    partitions sont écrites avant de retirer les enregistrements des
+    données en ligne. Retourne {collection: nombre d'enregistrements archivés}.
+    """
+    limite = mois_limite(mois_a_garder)
+    selection = {}
+    for nom in COLLECTIONS_ARCHIVEES:
+        selection[nom] = [e for e in donnees[nom] if a_archiver(nom, e, limite)]
+
+    os.makedirs(DOSSIER_ARCHIVES, exist_ok=True)
+    with VerrouFichier(donnees.stockage.chemin_verrou):
+        index = lire_index()
+        for nom, enregistrements in selection.items():
+            par_mois = {}
+            for enregistrement in enregistrements:
+                par_mois.setdefault(mois_de(date_reference(nom, enregistrement)), []).append(enregistrement)
+            for mois, nouveaux in par_mois.items():
+                # Un archivage interrompu a pu déjà écrire une partie des enregistrements
+                partition = sans_doublons(nom, lire_partition(nom, mois), nouveaux)
+                partition.extend(nouveaux)
+                ecrire_json(chemin_partition(nom, mois), partition)
+                resume = {"nombre": len(partition)}
+                if nom == "commandes":
+                    resume["statuts"] = {}
+                    for e in partition:
+                        resume["statuts"][e['statut']] = resume["statuts"].get(e['statut'], 0) + 1
+                index.setdefault(nom, {})[mois] = resume
+        ecrire_json(FICHIER_INDEX, index)
+
+    # Retrait des données en ligne
+    if selection["tresorerie"]:
+        retirer_tresorerie(donnees, selection["tresorerie"])
+    with donnees.verrou:
+        for nom, enregistrements in selection.items():
+            if not enregistrements or nom == "tresorerie":
+                continue
+            archives = {id(e) for e in enregistrements}
+            donnees[nom][:] = [e for e in donnees[nom] if id(e) not in archives]
+            for e in enregistrements:
+                donnees.marquer(nom, e['id'])
+    donnees.sauvegarder()
+    return {nom: len(enregistrements) for nom, enregistrements in selection.items()}
+
+
+def retirer_tresorerie(donnees, archives):
+    """Retirer les mouvements archivés de la trésorerie en ligne, par fusion avec le contenu sur disque
+
+    Les positions changeant, la trésorerie est réécrite entièrement, mais
+    à partir du contenu sur disque (qui peut contenir les mouvements d'un
+    autre processus) complété des mouvements pas encore écrits, sous le
+    verrou de fichier : aucun mouvement n'est perdu.
+    """
+    with donnees.verrou_ecriture, VerrouFichier(donnees.stockage.chemin_verrou):
+        externe = donnees.stockage.signature() != donnees.signature
+        sur_disque = donnees.stockage.charger("tresorerie", [])
+        if donnees.modele:
+            sur_disque = donnees.modele("tresorerie", sur_disque)
+        with donnees.verrou:
+            en_ligne = sans_doublons("tresorerie", sur_disque, archives)
+            # Mouvements ajoutés en mémoire et pas encore écrits (ni archivés)
+            en_ligne.extend(sans_doublons("tresorerie", donnees["tresorerie"], sur_disque + archives))
+            donnees.stockage.ecrire("tresorerie", en_ligne)
+            donnees["tresorerie"][:] = en_ligne
+            donnees.modifications.vider("tresorerie")
+            if not externe:
+                donnees.signature = donnees.stockage.signature()
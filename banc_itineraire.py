@@ -0,0 +1,289 @@
+# Banc d'essai du calcul d'itinéraire : clients synthétiques autour de la maison et du
+# dépôt central (uniformes ou en quartiers, de 5 à 500 arrêts), planifiés avec plusieurs
+# réglages ; temps, distances calculées et lues et longueur des tournées vont dans un
+# fichier JSON. Avec --reference, échec en cas de régression par rapport à un rapport précédent :
+#   python banc_itineraire.py --sortie banc_itineraire.json
+#   python banc_itineraire.py --reference banc_itineraire.json --sortie nouveau.json
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import itineraire as routage
+from zones import SEUIL_ZONES
+
+MAISON = (31.362120, -7.961128)
+DEPOT_CENTRAL = (31.609110, -7.968425)
+
+# Magasins de la tournée combinée (réglage "multi_magasins")
+MAGASINS = [("depot_central", DEPOT_CENTRAL), ("magasin_ouest", (31.52, -8.06))]
+
+# Zone de livraison autour du dépôt (lat, lon min et max)
+ZONE_LIVRAISON = ((31.45, -8.10), (31.70, -7.85))
+
+TAILLES = (5, 10, 20, 50, 100, 200, 500)
+DISPOSITIONS = ("uniforme", "quartiers")
+
+# Clients par tournée pour les réglages "flotte" et "zones"
+CLIENTS_PAR_TOURNEE = 40
+
+# Départ (minutes depuis minuit) des réglages avec horaires
+DEPART = 8 * 60
+
+# Régressions : tournées plus longues de plus de 2 %, calcul plus de 2 fois plus lent (au-delà de 50 ms)
+TOLERANCE_LONGUEUR = 0.02
+FACTEUR_TEMPS = 2.0
+MARGE_TEMPS = 0.05
+
+
+def generer_clients(disposition, n, graine=0):
+    """Clients [(client_id, (lat, lon))] et charges {client_id: charge} reproductibles
+
+    "uniforme" répartit les clients dans toute la zone de livraison ;
+    "quartiers" les regroupe autour de quelques centres (~1 km d'écart type).
+    """
+    rng = np.random.default_rng([graine, n, DISPOSITIONS.index(disposition)])
+    bas, haut = np.array(ZONE_LIVRAISON[0]), np.array(ZONE_LIVRAISON[1])
+    if disposition == "uniforme":
+        positions = bas + (haut - bas) * rng.random((n, 2))
+    else:
+        centres = bas + (haut - bas) * rng.random((max(2, n // 25), 2))
+        positions = centres[rng.integers(len(centres), size=n)] + rng.normal(0, 0.01, (n, 2))
+    clients = [(f"B{i:03d}", (float(lat), float(lon))) for i, (lat, lon) in enumerate(positions)]
+    charges = {client_id: int(charge) for (client_id, _), charge in zip(clients, rng.integers(1, 10, size=n))}
+    return clients, charges
+
+
+def generer_fenetres(clients, graine=0):
+    """Fenêtres horaires reproductibles {client_id: (ouverture, fermeture)} : un client sur deux, 2 h entre 8 h et 18 h"""
+    rng = np.random.default_rng([graine, len(clients)])
+    ouvertures = rng.integers(8, 16, size=len(clients)) * 60
+    return {client_id: (int(ouverture), int(ouverture) + 120)
+            for (client_id, _), ouverture in zip(clients[::2], ouvertures[::2])}
+
+
+def plan_precedent(clients):
+    """Ordres de passage, tournées et clients livrés d'un plan glouton (reproductible) fait avant les 10 % de commandes arrivées en dernier"""
+    anciens = clients[:len(clients) - len(clients) // 10]
+    plan = routage.trouver_meilleur_itineraire(MAISON, DEPOT_CENTRAL, anciens, budget=0, magasin_id="depot_central")
+    ordres = [[routage.cle_point(plan, point) for point in vehicule["tournee"][1:-1]] for vehicule in plan["vehicules"]]
+    gloutonnes = [[routage.cle_point(plan, point) for point in vehicule["tournee_gloutonne"][1:-1]]
+                  for vehicule in plan["vehicules"]]
+    return ordres, gloutonnes, ordres[0][1:1 + len(clients) // 10]
+
+
+def reglages(clients, charges, fenetres):
+    """Réglages à comparer pour ce jeu de clients
+
+    Les réglages avec des "dependances" sont calculés par
+    `planifier_multi_magasins`, les autres par `trouver_meilleur_itineraire`.
+    """
+    n = len(clients)
+    tournees = max(2, math.ceil(n / CLIENTS_PAR_TOURNEE))
+    choix = {
+        "defaut": {},
+        "gloutonne": {"budget": 0, "seuil_exact": -1},
+        "heuristique": {"seuil_exact": -1},
+    }
+    if n <= routage.SEUIL_EXACT:
+        choix["exacte"] = {"seuil_exact": n}
+    if n >= 2 * CLIENTS_PAR_TOURNEE:
+        capacite = sum(charges.values()) / tournees * 1.1
+        choix["flotte"] = {"charges": charges, "vehicules": tournees, "capacite": capacite}
+    if n >= SEUIL_ZONES:
+        choix["zones"] = {"charges": charges, "zones": tournees}
+    choix["horaires"] = {"depart": DEPART, "fenetres": fenetres}
+    choix["multi_magasins"] = {"dependances": {client_id: {MAGASINS[i % len(MAGASINS)][0]}
+                                               for i, (client_id, _) in enumerate(clients)}}
+    if n >= 10:
+        ordres, gloutonnes, fixes = plan_precedent(clients)
+        choix["incrementale"] = {"magasin_id": "depot_central", "ordres_precedents": ordres,
+                                 "gloutonnes_precedentes": gloutonnes, "fixes": fixes}
+    return choix
+
+
+class Compteur:
+    def __init__(self):
+        self.lectures = 0
+
+
+class LigneComptee(list):
+    """Ligne de matrice (liste) dont chaque lecture est comptée"""
+
+    def __init__(self, valeurs, compteur):
+        super().__init__(valeurs)
+        self.compteur = compteur
+
+    def __getitem__(self, cle):
+        self.compteur.lectures += 1
+        return super().__getitem__(cle)
+
+
+class MatriceComptee(np.ndarray):
+    """Matrice des distances comptant les valeurs lues (indexation et tolist)
+
+    Les sous-matrices extraites restent comptées ; les résultats de calculs
+    sur les valeurs lues sont des tableaux ordinaires.
+    """
+
+    def __new__(cls, matrice, compteur):
+        objet = np.asarray(matrice).view(cls)
+        objet.compteur = compteur
+        return objet
+
+    def __array_finalize__(self, objet):
+        self.compteur = getattr(objet, "compteur", None)
+
+    def __getitem__(self, cle):
+        resultat = super().__getitem__(cle)
+        if self.compteur is not None:
+            self.compteur.lectures += int(np.size(resultat))
+        if isinstance(resultat, MatriceComptee) and resultat.ndim < 2:
+            return resultat.view(np.ndarray)
+        return resultat
+
+    def __array_ufunc__(self, ufunc, methode, *entrees, **options):
+        entrees = [np.asarray(x) if isinstance(x, MatriceComptee) else x for x in entrees]
+        return getattr(ufunc, methode)(*entrees, **options)
+
+    def tolist(self):
+        return [LigneComptee(ligne, self.compteur) for ligne in np.asarray(self).tolist()]
+
+
+class DistancesComptees:
+    """Fournisseur de matrice (même interface qu'un réseau routier) qui compte les distances
+
+    Les distances sont celles de la matrice haversine habituelle.
+    """
+
+    nom = "banc"
+
+    def __init__(self):
+        self.calculees = 0
+        self.compteur = Compteur()
+
+    def matrice(self, points, cache=None):
+        n = len(points)
+        self.calculees += n * (n - 1) // 2
+        return MatriceComptee(routage.matrice_distances(points), self.compteur)
+
+
+def mesurer(clients, parametres, budget, executeur=None):
+    """Temps, distances calculées et lues, longueur et méthodes d'un calcul d'itinéraire
+
+    Les lectures sont comptées pendant le calcul chronométré, sur la
+    matrice comptée (qui le ralentit un peu, de la même façon d'un
+    rapport à l'autre). Celles des processus d'un `executeur` ne
+    remontent pas : le nombre de lectures vaut alors None.
+    """
+    parametres = {"budget": budget, **parametres}
+    distances = DistancesComptees()
+    debut = time.perf_counter()
+    if "dependances" in parametres:
+        plan = routage.planifier_multi_magasins(MAISON, MAGASINS, clients, reseau=distances, **parametres)
+    else:
+        plan = routage.trouver_meilleur_itineraire(MAISON, DEPOT_CENTRAL, clients, reseau=distances,
+                                                   executeur=executeur, **parametres)
+    duree = time.perf_counter() - debut
+
+    return {
+        "temps_s": round(duree, 4),
+        "distances_calculees": distances.calculees,
+        "lectures_distances": distances.compteur.lectures if executeur is None else None,
+        "longueur_km": round(sum(routage.distance_itineraire(vehicule, "haversine") for vehicule in plan["vehicules"]), 3),
+        "longueur_gloutonne_km": round(sum(routage.distance_itineraire(vehicule, "haversine", tournee="tournee_gloutonne")
+                                           for vehicule in plan["vehicules"]), 3),
+        "tournees": len(plan["vehicules"]),
+        "methodes": sorted({vehicule["methode"] for vehicule in plan["vehicules"]}),
+        "non_affectes": len(plan["non_affectes"]),
+    }
+
+
+def executer(tailles=TAILLES, dispositions=DISPOSITIONS, budget=routage.BUDGET_DEFAUT, graine=0, afficher=print,
+             executeur=None):
+    resultats = []
+    afficher(f"{'disposition':<11} {'arrêts':>6} {'réglage':<14} {'temps (s)':>9} {'calculées':>10} "
+             f"{'lectures':>11} {'km':>9} {'km glouton':>10}")
+    for disposition in dispositions:
+        for n in tailles:
+            clients, charges = generer_clients(disposition, n, graine)
+            for nom, parametres in reglages(clients, charges, generer_fenetres(clients, graine)).items():
+                mesure = mesurer(clients, parametres, budget, executeur)
+                resultats.append({"disposition": disposition, "arrets": n, "reglage": nom, **mesure})
+                lectures = mesure['lectures_distances']
+                afficher(f"{disposition:<11} {n:>6} {nom:<14} {mesure['temps_s']:>9.3f} "
+                         f"{mesure['distances_calculees']:>10} {'-' if lectures is None else lectures:>11} "
+                         f"{mesure['longueur_km']:>9.2f} {mesure['longueur_gloutonne_km']:>10.2f}")
+    return {
+        "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "budget_s": budget,
+        "graine": graine,
+        "resultats": resultats,
+    }
+
+
+def comparer(rapport, reference, tolerance_longueur=TOLERANCE_LONGUEUR, facteur_temps=FACTEUR_TEMPS):
+    """Régressions par rapport à un rapport de référence : liste de messages"""
+    def cle(resultat):
+        return resultat["disposition"], resultat["arrets"], resultat["reglage"]
+
+    anciens = {cle(resultat): resultat for resultat in reference["resultats"]}
+    regressions = []
+    for resultat in rapport["resultats"]:
+        ancien = anciens.get(cle(resultat))
+        if ancien is None:
+            continue
+        cas = "{} / {} arrêts / {}".format(*cle(resultat))
+        if resultat["longueur_km"] > ancien["longueur_km"] * (1 + tolerance_longueur):
+            regressions.append(f"{cas} : {resultat['longueur_km']:.2f} km au lieu de {ancien['longueur_km']:.2f} km")
+        if resultat["temps_s"] > ancien["temps_s"] * facteur_temps + MARGE_TEMPS:
+            regressions.append(f"{cas} : {resultat['temps_s']:.3f} s au lieu de {ancien['temps_s']:.3f} s")
+        if resultat["non_affectes"] > ancien["non_affectes"]:
+            regressions.append(f"{cas} : {resultat['non_affectes']} clients non affectés au lieu de {ancien['non_affectes']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parseur = argparse.ArgumentParser(description="Banc d'essai du calcul d'itinéraire")
+    parseur.add_argument("--tailles", type=int, nargs="+", default=list(TAILLES))
+    parseur.add_argument("--dispositions", nargs="+", choices=DISPOSITIONS, default=list(DISPOSITIONS))
+    parseur.add_argument("--budget", type=float, default=routage.BUDGET_DEFAUT,
+                         help="temps maximal (s) d'amélioration par calcul")
+    parseur.add_argument("--graine", type=int, default=0)
+    parseur.add_argument("--processus", type=int, default=1,
+                         help="processus optimisant les tournées d'une flotte en parallèle (0 : un par cœur ; "
+                              "les lectures de distances ne sont alors pas comptées)")
+    parseur.add_argument("--sortie", default="banc_itineraire.json")
+    parseur.add_argument("--reference", help="rapport précédent auquel comparer les résultats")
+    arguments = parseur.parse_args()
+
+    executeur = routage.creer_executeur(arguments.processus) if arguments.processus != 1 else None
+    try:
+        rapport = executer(arguments.tailles, arguments.dispositions, arguments.budget, arguments.graine,
+                           executeur=executeur)
+    finally:
+        if executeur is not None:
+            executeur.shutdown()
+    reference = None
+    if arguments.reference:
+        # Lue avant l'écriture, le rapport pouvant remplacer sa référence
+        with open(arguments.reference, 'r') as f:
+            reference = json.load(f)
+    with open(arguments.sortie, 'w') as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés dans {arguments.sortie}")
+    if reference is not None:
+        regressions = comparer(rapport, reference)
+        for regression in regressions:
+            print(f"RÉGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("Aucune régression")
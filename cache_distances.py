@@ -0,0 +1,141 @@
+import json
+import threading
+from collections import OrderedDict
+
+from stockage import VerrouFichier, ecrire_json
+
+# Décimales conservées dans la clé (5 décimales ~ 1 m)
+DECIMALES = 5
+
+
+def cle_position(position):
+    return f"{position[0]:.{DECIMALES}f},{position[1]:.{DECIMALES}f}"
+
+
+def cle_paire(precision, a, b):
+    """Clé d'une paire de positions, identique dans les deux sens"""
+    a, b = sorted((cle_position(a), cle_position(b)))
+    return f"{precision}|{a}|{b}"
+
+
+class CacheDistances:
+    """Cache LRU borné des distances (km) entre paires de coordonnées, conservé sur disque
+
+    Les clés sont les coordonnées arrondies de la paire et le mode de
+    calcul (géodésique, route avec l'identité du graphe routier) : une
+    distance reste valable d'un jour et d'une session à l'autre tant que
+    les positions ne bougent pas. Les distances haversine, plus rapides à
+    recalculer qu'à relire, ne sont pas mises en cache. Au-delà de
+    `capacite` paires (plusieurs journées de 500 arrêts par la route), les
+    moins récemment utilisées sont retirées. `enregistrer()` fusionne avec
+    le fichier, sous verrou, ce que les autres processus y ont ajouté
+    depuis le chargement, et n'écrit que si le cache a changé.
+    """
+
+    CHEMIN_DEFAUT = "distances.json"
+    CAPACITE_DEFAUT = 400000
+
+    def __init__(self, chemin=CHEMIN_DEFAUT, capacite=CAPACITE_DEFAUT):
+        self.chemin = chemin
+        self.chemin_verrou = chemin + ".lock"
+        self.capacite = capacite
+        self.verrou = threading.RLock()
+        self.distances = OrderedDict(self._lire())
+        self._indexer_tout()
+        self.nouvelles = set()
+        self.positions_invalidees = set()
+        self.succes = 0
+        self.echecs = 0
+        self._limiter()
+
+    def _lire(self):
+        try:
+            with open(self.chemin, 'r') as f:
+                distances = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # Paires haversine d'anciennes versions, qui ne sont plus mises en cache
+        return {paire: distance for paire, distance in distances.items() if not paire.startswith("haversine|")}
+
+    def _indexer_tout(self):
+        # Paires de chaque position : `invalider` ne parcourt pas tout le cache
+        self.paires_par_position = {}
+        for paire in self.distances:
+            self._indexer(paire)
+
+    def _indexer(self, paire):
+        for position in paire.split('|')[1:]:
+            self.paires_par_position.setdefault(position, set()).add(paire)
+
+    def _desindexer(self, paire):
+        for position in paire.split('|')[1:]:
+            paires = self.paires_par_position.get(position)
+            if paires is not None:
+                paires.discard(paire)
+                if not paires:
+                    del self.paires_par_position[position]
+
+    def _limiter(self):
+        while len(self.distances) > self.capacite:
+            cle, _ = self.distances.popitem(last=False)
+            self._desindexer(cle)
+            self.nouvelles.discard(cle)
+
+    def __len__(self):
+        return len(self.distances)
+
+    def lire(self, precision, a, b):
+        """Distance en cache, ou None"""
+        cle = cle_paire(precision, a, b)
+        with self.verrou:
+            distance = self.distances.get(cle)
+            if distance is None:
+                self.echecs += 1
+                return None
+            self.distances.move_to_end(cle)
+            self.succes += 1
+            return distance
+
+    def ajouter(self, precision, a, b, distance):
+        cle = cle_paire(precision, a, b)
+        with self.verrou:
+            if cle not in self.distances:
+                self._indexer(cle)
+            self.distances[cle] = float(distance)
+            self.distances.move_to_end(cle)
+            self.nouvelles.add(cle)
+            self._limiter()
+
+    def invalider(self, position):
+        """Oublier toutes les distances depuis ou vers une position (déplacée ou supprimée)"""
+        if position is None:
+            return
+        cle = cle_position(position)
+        with self.verrou:
+            for paire in list(self.paires_par_position.get(cle, ())):
+                del self.distances[paire]
+                self._desindexer(paire)
+                self.nouvelles.discard(paire)
+            self.positions_invalidees.add(cle)
+
+    def enregistrer(self):
+        """Écrire le cache sur disque s'il a changé ; retourne le nombre de paires conservées"""
+        with self.verrou:
+            if not self.nouvelles and not self.positions_invalidees:
+                return len(self.distances)
+            with VerrouFichier(self.chemin_verrou):
+                disque = OrderedDict(
+                    (paire, distance) for paire, distance in self._lire().items()
+                    if not self.positions_invalidees.intersection(paire.split('|')[1:])
+                )
+                # Les paires utilisées ici sont les plus récentes
+                for paire, distance in self.distances.items():
+                    disque[paire] = distance
+                    disque.move_to_end(paire)
+                self.distances = disque
+                self._indexer_tout()
+                self._limiter()
+                ecrire_json(self.chemin, self.distances, compact=True)
+            self.nouvelles.clear()
+            self.positions_invalidees.clear()
+            return len(self.distances)
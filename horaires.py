@@ -0,0 +1,172 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Vitesse moyenne (km/h) selon l'heure de la journée : (heure de début, vitesse)
+PROFIL_VITESSE_DEFAUT = ((0, 50), (7, 30), (9, 40), (12, 30), (14, 40), (17, 25), (19, 40), (21, 50))
+
+# Durée (minutes) d'une livraison chez un client sans durée renseignée
+SERVICE_DEFAUT = 10
+
+# Pénalité (km équivalents) par minute de retard sur une fenêtre horaire
+PENALITE_RETARD = 1.0
+
+# Baisse minimale du coût pour accepter un mouvement
+EPSILON_COUT = 1e-9
+
+
+def minutes(heure):
+    """"HH:MM" (ou datetime.time) -> minutes depuis minuit ; None si absent"""
+    if heure is None or heure == "":
+        return None
+    if not isinstance(heure, str):
+        return heure.hour * 60 + heure.minute
+    h, m = heure.split(":")[:2]
+    return int(h) * 60 + int(m)
+
+
+def format_heure(minute):
+    minute = int(round(minute))
+    return f"{minute // 60 % 24:02d}:{minute % 60:02d}"
+
+
+class ProfilVitesse:
+    """Vitesse moyenne par tranche horaire"""
+
+    def __init__(self, profil=PROFIL_VITESSE_DEFAUT):
+        profil = sorted(profil)
+        self.debuts = [heure * 60 for heure, _ in profil]
+        self.vitesses = [vitesse for _, vitesse in profil]
+
+    def vitesse(self, minute):
+        return self.vitesses[max(bisect_right(self.debuts, minute % 1440) - 1, 0)]
+
+    def vitesses_a(self, minutes):
+        """Vitesse à chacune des `minutes` (tableau numpy)"""
+        rangs = np.searchsorted(self.debuts, np.asarray(minutes) % 1440, side='right') - 1
+        return np.asarray(self.vitesses)[np.maximum(rangs, 0)]
+
+    def duree_trajet(self, distance, minute):
+        """Durée (minutes) d'un trajet de `distance` km commencé à `minute`"""
+        return distance / self.vitesse(minute) * 60
+
+
+class Contraintes:
+    """Fenêtres horaires et durées de service des points d'une tournée
+
+    `ouvertures`, `fermetures` et `services` sont indexés comme la matrice
+    des distances ; un point sans fenêtre a les bornes -inf / +inf.
+    """
+
+    def __init__(self, ouvertures, fermetures, services, depart, profil=None):
+        self.ouvertures = ouvertures
+        self.fermetures = fermetures
+        self.services = services
+        self.depart = depart
+        self.profil = profil or ProfilVitesse()
+
+    @property
+    def actives(self):
+        return any(f != float("inf") for f in self.fermetures) or any(o != float("-inf") for o in self.ouvertures)
+
+    def horaires(self, tournee, distances):
+        """Arrivée, attente et retard (minutes) à chaque point de la tournée"""
+        t = self.depart
+        resultat = [{"arrivee": t, "attente": 0.0, "retard": 0.0}]
+        for a, b in zip(tournee, tournee[1:]):
+            t += self.profil.duree_trajet(distances[a][b], t)
+            arrivee = t
+            t = max(t, self.ouvertures[b])
+            retard = max(0.0, t - self.fermetures[b])
+            resultat.append({"arrivee": arrivee, "attente": t - arrivee, "retard": retard})
+            t += self.services[b]
+        return resultat
+
+    def retard_total(self, tournee, distances):
+        t = self.depart
+        retard = 0.0
+        profil, ouvertures, fermetures, services = self.profil, self.ouvertures, self.fermetures, self.services
+        for a, b in zip(tournee, tournee[1:]):
+            t += profil.duree_trajet(distances[a][b], t)
+            if t < ouvertures[b]:
+                t = ouvertures[b]
+            if t > fermetures[b]:
+                retard += t - fermetures[b]
+            t += services[b]
+        return retard
+
+    def cout(self, tournee, distances):
+        longueur = sum(distances[a][b] for a, b in zip(tournee, tournee[1:]))
+        return longueur + PENALITE_RETARD * self.retard_total(tournee, distances)
+
+
+class Calendrier:
+    """Horaires d'une tournée, pour évaluer un mouvement sans tout recalculer
+
+    `departs[x]` est l'heure de départ du point de rang x (après attente
+    et service) et `retards[x]` le retard cumulé jusqu'à ce rang. Une
+    tournée modifiée entre les rangs i et j reprend au départ du rang
+    i - 1 ; après j, dès qu'elle repart d'un point à la même heure que la
+    tournée d'origine, la suite est identique et n'est pas recalculée.
+    """
+
+    def __init__(self, contraintes, tournee, distances):
+        self.contraintes = contraintes
+        self.distances = distances
+        self.recalculer(tournee)
+
+    def recalculer(self, tournee):
+        c = self.contraintes
+        self.tournee = [int(point) for point in tournee]
+        t, retard = c.depart, 0.0
+        self.departs, self.retards = [t], [retard]
+        for a, b in zip(self.tournee, self.tournee[1:]):
+            t += c.profil.duree_trajet(self.distances[a][b], t)
+            if t < c.ouvertures[b]:
+                t = c.ouvertures[b]
+            if t > c.fermetures[b]:
+                retard += t - c.fermetures[b]
+            t += c.services[b]
+            self.departs.append(t)
+            self.retards.append(retard)
+
+    @property
+    def retard(self):
+        return self.retards[-1]
+
+    def retard_candidat(self, candidat, i, j, plafond=float("inf")):
+        """Retard total de `candidat`, qui ne diffère de la tournée qu'entre les rangs i et j
+
+        Retourne None dès que le retard dépasse `plafond`.
+        """
+        c = self.contraintes
+        t, retard = self.departs[i - 1], self.retards[i - 1]
+        for x in range(i, len(candidat)):
+            a, b = int(candidat[x - 1]), int(candidat[x])
+            t += c.profil.duree_trajet(self.distances[a][b], t)
+            if t < c.ouvertures[b]:
+                t = c.ouvertures[b]
+            if t > c.fermetures[b]:
+                retard += t - c.fermetures[b]
+                if retard > plafond:
+                    return None
+            t += c.services[b]
+            if x > j and abs(t - self.departs[x]) < 1e-9:
+                return retard + self.retards[-1] - self.retards[x]
+        return retard
+
+    def accepter(self, candidat, i, j, gain):
+        """Vrai (et calendrier mis à jour) si `candidat`, plus court de `gain` km, coûte moins que la tournée
+
+        Le coût est celui de `Contraintes.cout` : distance plus pénalité de
+        retard. Utilisé comme vérification des mouvements vectorisés de
+        `itineraire`, qui ne calculent que le gain en distance.
+        """
+        plafond = self.retard + (gain - EPSILON_COUT) / PENALITE_RETARD
+        if plafond <= 0:
+            return False
+        retard = self.retard_candidat(candidat, i, j, plafond)
+        if retard is None or retard >= plafond:
+            return False
+        self.recalculer(candidat)
+        return True
@@ -0,0 +1,44 @@
+import json
+import threading
+from datetime import datetime
+
+from stockage import VerrouFichier, ecrire_json
+
+
+class AllocateurIdentifiants:
+    """Allocation d'identifiants uniques et croissants (CMD, CL, LIV...)
+
+    Un identifiant est le préfixe suivi de la date-heure (AAAAMMJJHHMMSS) et
+    d'un compteur sur trois chiffres, par exemple CMD20250118101530002.
+    Le dernier numéro attribué par préfixe est conservé dans un fichier,
+    sous verrou partagé entre processus : deux commandes créées dans la même
+    seconde, par deux postes ou lors d'une saisie en masse, reçoivent des
+    identifiants distincts, y compris après un redémarrage ou si l'horloge
+    recule.
+    """
+
+    CHEMIN_DEFAUT = "identifiants.json"
+
+    def __init__(self, chemin=CHEMIN_DEFAUT):
+        self.chemin = chemin
+        self.chemin_verrou = chemin + ".lock"
+        self.verrou = threading.Lock()
+
+    def _lire(self):
+        try:
+            with open(self.chemin, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def reserver(self, prefixe, nombre):
+        """Réserver un bloc de `nombre` identifiants consécutifs"""
+        with self.verrou, VerrouFichier(self.chemin_verrou):
+            derniers = self._lire()
+            debut = max(derniers.get(prefixe, 0) + 1, int(datetime.now().strftime('%Y%m%d%H%M%S')) * 1000)
+            derniers[prefixe] = debut + nombre - 1
+            ecrire_json(self.chemin, derniers)
+        return [f"{prefixe}{numero}" for numero in range(debut, debut + nombre)]
+
+    def suivant(self, prefixe):
+        return self.reserver(prefixe, 1)[0]
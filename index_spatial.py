@@ -0,0 +1,171 @@
+import math
+import threading
+
+import numpy as np
+
+from itineraire import distances_paires
+
+# Longueur (km) d'un degré de latitude
+KM_PAR_DEGRE = 111.32
+
+
+class IndexSpatial:
+    """Index par grille des positions (clients, magasins) pour les requêtes de proximité
+
+    Le plan est découpé en cellules d'environ `taille_cellule` km de côté ;
+    une requête ne mesure que les positions des cellules voisines du point
+    au lieu de parcourir toutes les positions. Les clés sont libres, par
+    exemple ("client", client_id) ou ("magasin", magasin_id).
+    """
+
+    def __init__(self, taille_cellule=2.0, latitude_reference=31.5):
+        self.taille_cellule = taille_cellule
+        self.pas_lat = taille_cellule / KM_PAR_DEGRE
+        # Les cellules gardent au moins `taille_cellule` km en longitude jusqu'à ±60° de la référence
+        self.pas_lon = taille_cellule / (KM_PAR_DEGRE * max(math.cos(math.radians(abs(latitude_reference) + 5)), 0.1))
+        self.cellules = {}
+        self.positions = {}
+        self.verrou = threading.RLock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, cle):
+        return cle in self.positions
+
+    def _cellule(self, position):
+        return (math.floor(position[0] / self.pas_lat), math.floor(position[1] / self.pas_lon))
+
+    def ajouter(self, cle, position):
+        """Ajouter ou déplacer une position"""
+        position = (float(position[0]), float(position[1]))
+        with self.verrou:
+            self.retirer(cle)
+            self.positions[cle] = position
+            self.cellules.setdefault(self._cellule(position), set()).add(cle)
+
+    def retirer(self, cle):
+        with self.verrou:
+            position = self.positions.pop(cle, None)
+            if position is None:
+                return
+            cellule = self._cellule(position)
+            self.cellules[cellule].discard(cle)
+            if not self.cellules[cellule]:
+                del self.cellules[cellule]
+
+    def _anneau(self, centre, rang):
+        """Cellules à exactement `rang` cellules du centre"""
+        i, j = centre
+        if rang == 0:
+            return [centre]
+        cellules = [(i + di, j + dj) for di in (-rang, rang) for dj in range(-rang, rang + 1)]
+        cellules += [(i + di, j + dj) for dj in (-rang, rang) for di in range(-rang + 1, rang)]
+        return cellules
+
+    def _mesurer(self, position, cles, filtre):
+        cles = [cle for cle in cles if filtre is None or filtre(cle)]
+        if not cles:
+            return []
+        distances = distances_paires([position] * len(cles), [self.positions[cle] for cle in cles])
+        return list(zip(cles, distances.tolist()))
+
+    def dans_rayon(self, position, rayon, filtre=None):
+        """Positions à moins de `rayon` km, de la plus proche à la plus éloignée : [(cle, km)]"""
+        centre = self._cellule(position)
+        rangs = int(math.ceil(rayon / self.taille_cellule))
+        candidats = []
+        with self.verrou:
+            for rang in range(rangs + 1):
+                for cellule in self._anneau(centre, rang):
+                    candidats.extend(self.cellules.get(cellule, ()))
+            resultats = [(cle, d) for cle, d in self._mesurer(position, candidats, filtre) if d <= rayon]
+        return sorted(resultats, key=lambda r: r[1])
+
+    def plus_proches(self, position, k=5, filtre=None):
+        """Les `k` positions les plus proches : [(cle, km)]
+
+        Les anneaux de cellules sont parcourus du centre vers l'extérieur
+        jusqu'à ce qu'aucune cellule non visitée ne puisse contenir une
+        position plus proche que la k-ième trouvée.
+        """
+        with self.verrou:
+            if not self.positions or k <= 0:
+                return []
+            centre = self._cellule(position)
+            vus = []
+            rang = 0
+            rang_max = max(max(abs(i - centre[0]), abs(j - centre[1])) for i, j in self.cellules)
+            while rang <= rang_max:
+                for cellule in self._anneau(centre, rang):
+                    vus.extend(self._mesurer(position, self.cellules.get(cellule, ()), filtre))
+                # Hors des anneaux parcourus, une position est à plus de `rang` cellules
+                if len(vus) >= k and sorted(d for _, d in vus)[k - 1] <= rang * self.taille_cellule:
+                    break
+                rang += 1
+        return sorted(vus, key=lambda r: r[1])[:k]
+
+    @classmethod
+    def depuis_donnees(cls, clients, magasins_source, **options):
+        """Index des clients et des magasins (hors maison) ayant une position"""
+        index = cls(**options)
+        for client_id, client in clients.items():
+            if client.get('position'):
+                index.ajouter(("client", client_id), client['position'])
+        for magasin_id, magasin in magasins_source.items():
+            if magasin.get('type') == 'magasin' and magasin.get('position'):
+                index.ajouter(("magasin", magasin_id), magasin['position'])
+        return index
+
+
+class IndexDonnees:
+    """Index spatial des clients et magasins des données partagées
+
+    Les pages le tiennent à jour à chaque création, modification ou
+    suppression ; si les collections ont été rechargées (modification par
+    un autre processus), il est reconstruit au prochain accès.
+    """
+
+    def __init__(self, donnees, **options):
+        self.donnees = donnees
+        self.options = options
+        self.verrou = threading.Lock()
+        self.collections = None
+        self._index = None
+
+    def index(self):
+        clients, magasins_source = self.donnees["clients"], self.donnees["magasins_source"]
+        with self.verrou:
+            if self.collections is None or self.collections[0] is not clients or self.collections[1] is not magasins_source:
+                self._index = IndexSpatial.depuis_donnees(clients, magasins_source, **self.options)
+                self.collections = (clients, magasins_source)
+            return self._index
+
+    def indexer(self, genre, cle, position):
+        """Ajouter ou déplacer un client ("client") ou un magasin ("magasin") ; sans position, le retirer"""
+        if position:
+            self.index().ajouter((genre, cle), position)
+        else:
+            self.index().retirer((genre, cle))
+
+
+if __name__ == "__main__":
+    # Vérification contre un parcours complet : python index_spatial.py
+    import time
+
+    rng = np.random.default_rng(0)
+    index = IndexSpatial()
+    positions = {i: (31.3 + 0.6 * rng.random(), -8.3 + 0.6 * rng.random()) for i in range(20000)}
+    for cle, position in positions.items():
+        index.ajouter(cle, position)
+    centre = (31.609110, -7.968425)
+    debut = time.perf_counter()
+    proches = index.plus_proches(centre, 10)
+    rayon = index.dans_rayon(centre, 3)
+    duree = time.perf_counter() - debut
+    toutes = distances_paires([centre] * len(positions), list(positions.values()))
+    ordre = np.argsort(toutes)
+    assert [cle for cle, _ in proches] == [int(i) for i in ordre[:10]]
+    assert len(rayon) == int((toutes <= 3).sum())
+    print(f"{len(index)} positions : 10 plus proches et rayon 3 km en {duree * 1000:.1f} ms "
+          f"({len(rayon)} dans le rayon, identiques au parcours complet)")
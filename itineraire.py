@@ -0,0 +1,957 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cache_distances import cle_position
+from horaires import SERVICE_DEFAUT, Calendrier, Contraintes
+from zones import decouper_zones
+
+# Rayon moyen de la Terre (km)
+RAYON_TERRE_KM = 6371.0088
+
+PRECISIONS = ("haversine", "geodesique")
+
+# Distances par la route (reseau_routier.py), lues dans la matrice du plan
+PRECISION_ROUTE = "route"
+
+# Temps maximal (secondes) consacré à l'amélioration de la tournée gloutonne
+BUDGET_DEFAUT = 1.0
+
+# Nombre maximal de clients pour lequel la tournée optimale exacte (Held-Karp) est calculée
+SEUIL_EXACT = 12
+
+# Gain minimal (km) pour accepter un mouvement, évite de boucler sur les arrondis
+EPSILON = 1e-9
+
+# Mouvements vérifiés au plus par position lorsqu'un critère autre que la distance décide (fenêtres horaires)
+ESSAIS = 3
+
+# Nombre minimal de clients pour optimiser les tournées de plusieurs véhicules en parallèle
+SEUIL_PARALLELE = 40
+
+
+def matrice_distances(positions, precision="haversine", cache=None):
+    """Matrice n x n des distances (km) entre toutes les positions (lat, lon)
+
+    "haversine" calcule toute la matrice en une passe vectorisée (sphère),
+    sans cache ; "geodesique" utilise la distance exacte sur l'ellipsoïde
+    (geopy), plus lente, à réserver aux petits ensembles ou au total
+    affiché. Avec un `cache` (CacheDistances), seules les paires
+    géodésiques absentes sont calculées.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Précision inconnue: {precision}")
+    if cache is not None and precision != "haversine":
+        return _matrice_avec_cache(positions, precision, cache)
+    coords = np.radians(np.asarray(positions, dtype=float).reshape(-1, 2))
+    if precision == "geodesique":
+        from geopy.distance import geodesic
+
+        n = len(coords)
+        matrice = np.zeros((n, n))
+        for i in range(n):
+            for j in range(i + 1, n):
+                matrice[i, j] = matrice[j, i] = geodesic(positions[i], positions[j]).km
+        return matrice
+    lat = coords[:, 0][:, None]
+    lon = coords[:, 1][:, None]
+    a = np.sin((lat - lat.T) / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin((lon - lon.T) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_paires(a, b, precision="haversine"):
+    """Distances (km) entre a[k] et b[k] pour chaque k"""
+    if precision == "geodesique":
+        from geopy.distance import geodesic
+
+        return np.array([geodesic(p, q).km for p, q in zip(a, b)])
+    a = np.radians(np.asarray(a, dtype=float).reshape(-1, 2))
+    b = np.radians(np.asarray(b, dtype=float).reshape(-1, 2))
+    h = np.sin((b[:, 0] - a[:, 0]) / 2) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin((b[:, 1] - a[:, 1]) / 2) ** 2
+    return 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _matrice_avec_cache(positions, precision, cache):
+    n = len(positions)
+    matrice = np.zeros((n, n))
+    manquantes = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            distance = cache.lire(precision, positions[i], positions[j])
+            if distance is None:
+                manquantes.append((i, j))
+            else:
+                matrice[i, j] = matrice[j, i] = distance
+    if manquantes:
+        a = [positions[i] for i, _ in manquantes]
+        b = [positions[j] for _, j in manquantes]
+        for (i, j), distance in zip(manquantes, distances_paires(a, b, precision)):
+            matrice[i, j] = matrice[j, i] = distance
+            cache.ajouter(precision, positions[i], positions[j], distance)
+    return matrice
+
+
+def matrice_plan(points, cache=None, reseau=None):
+    """Matrice d'optimisation : par la route avec un `reseau` (ReseauRoutier), sinon haversine (sans cache)"""
+    if reseau is not None:
+        return reseau.matrice(points, cache), PRECISION_ROUTE
+    return matrice_distances(points), "haversine"
+
+
+def longueur_tournee(tournee, matrice):
+    """Longueur (km) d'une tournée donnée par ses indices dans la matrice"""
+    tournee = np.asarray(tournee)
+    return float(matrice[tournee[:-1], tournee[1:]].sum())
+
+
+def distance_geodesique(positions, cache=None):
+    """Longueur exacte (km) d'un trajet passant par les positions dans l'ordre"""
+    from geopy.distance import geodesic
+
+    total = 0
+    for i in range(len(positions) - 1):
+        distance = cache.lire("geodesique", positions[i], positions[i + 1]) if cache is not None else None
+        if distance is None:
+            distance = geodesic(positions[i], positions[i + 1]).km
+            if cache is not None:
+                cache.ajouter("geodesique", positions[i], positions[i + 1], distance)
+        total += distance
+    return total
+
+
+def plus_proche_voisin(matrice, depart=0, premier=None, dependances=None):
+    """Tournée gloutonne : toujours aller au point le plus proche non visité
+
+    Part de `depart`, passe d'abord par `premier` (le magasin) s'il est
+    donné, et revient à `depart`. Avec `dependances` ({point: points à
+    visiter avant}), seuls les points dont les prérequis sont déjà
+    visités sont candidats.
+    """
+    tournee = [depart]
+    restants = [i for i in range(len(matrice)) if i != depart and i != premier]
+    if premier is not None:
+        tournee.append(premier)
+    visites = set(tournee)
+    while restants:
+        candidats = restants
+        if dependances:
+            candidats = [i for i in restants if visites.issuperset(dependances.get(i, ()))] or restants
+        suivant = candidats[int(np.argmin(matrice[tournee[-1], candidats]))]
+        restants.remove(suivant)
+        tournee.append(suivant)
+        visites.add(suivant)
+    tournee.append(depart)
+    return tournee
+
+
+def respecte_precedences(tournee, dependances):
+    """Vrai si chaque point de la tournée vient après tous ses prérequis"""
+    rang = {point: i for i, point in enumerate(tournee[:-1])}
+    return all(rang[prerequis] < rang[point]
+               for point, prerequis_du_point in dependances.items() if point in rang
+               for prerequis in prerequis_du_point)
+
+
+def paires_precedences(dependances):
+    """Tableaux (prérequis, point) des `dependances`, pour les mouvements vectorisés ; None sans dépendance"""
+    paires = [(prerequis, point) for point, prerequis_du_point in (dependances or {}).items()
+              for prerequis in prerequis_du_point]
+    if not paires:
+        return None
+    return np.array(paires).T
+
+
+def rangs_precedences(tournee, paires):
+    """Rangs dans la tournée du prérequis et du point de chaque paire"""
+    rang = np.zeros(max(int(tournee.max()), int(paires.max())) + 1, dtype=int)
+    rang[tournee[:-1]] = np.arange(len(tournee) - 1)
+    return rang[paires[0]], rang[paires[1]]
+
+
+def _prerequis_max(tournee, paires):
+    # Pour chaque rang, le rang du dernier prérequis du point qui s'y trouve (-1 sans prérequis)
+    avant, apres = rangs_precedences(tournee, paires)
+    prerequis_max = np.full(len(tournee), -1)
+    np.maximum.at(prerequis_max, apres, avant)
+    return prerequis_max
+
+
+def _essayer(gains, construire, verifier, limite, exhaustif=False):
+    # Meilleur candidat accepté par `verifier` parmi les ESSAIS meilleurs gains ; sans `verifier`, le meilleur.
+    # En mode exhaustif, tous les candidats sont vérifiés, même ceux qui rallongent la tournée
+    if verifier is None:
+        meilleur = int(np.argmax(gains))
+        return construire(meilleur) if gains[meilleur] > EPSILON else None
+    ordre = np.argsort(-gains)
+    if not exhaustif:
+        ordre = ordre[:ESSAIS]
+        ordre = ordre[gains[ordre] > EPSILON]
+    for meilleur in ordre[np.isfinite(gains[ordre])]:
+        if time.perf_counter() > limite:
+            break
+        candidat, i, j = construire(int(meilleur))
+        if verifier(candidat, i, j, float(gains[meilleur])):
+            return candidat, i, j
+    return None
+
+
+def deux_opt(tournee, matrice, debut, limite, paires=None, verifier=None):
+    """Un passage 2-opt : inverser les segments qui raccourcissent la tournée
+
+    Seuls les points à partir de l'indice `debut` (après la maison et le
+    magasin) et avant le retour final bougent. Avec les `paires` de
+    `paires_precedences`, un segment qui contient un point et l'un de ses
+    prérequis n'est pas inversé. `verifier(candidat, i, j, gain)`, s'il
+    est donné, accepte ou refuse chacun des meilleurs mouvements (rangs i
+    à j modifiés, `gain` km). Retourne True si la tournée a été modifiée.
+    """
+    ameliore = False
+    fin = len(tournee) - 1
+    if paires is not None:
+        prerequis_max = _prerequis_max(tournee, paires)
+    for i in range(debut, fin - 1):
+        if time.perf_counter() > limite:
+            break
+        a, b = tournee[i - 1], tournee[i]
+        # Inversion de tournee[i..j] pour tous les j à la fois
+        j = np.arange(i + 1, fin)
+        c, e = tournee[j], tournee[j + 1]
+        gains = matrice[a, b] + matrice[c, e] - matrice[a, c] - matrice[b, e]
+        if paires is not None:
+            # Un point de tournee[i + 1..j] dont un prérequis est à partir du rang i
+            gains[np.maximum.accumulate(prerequis_max[i + 1:fin]) >= i] = -np.inf
+
+        def inverser(meilleur, i=i, j=j):
+            candidat = tournee.copy()
+            candidat[i:j[meilleur] + 1] = candidat[i:j[meilleur] + 1][::-1]
+            return candidat, i, int(j[meilleur])
+
+        retenu = _essayer(gains, inverser, verifier, limite)
+        if retenu is not None:
+            tournee[:] = retenu[0]
+            ameliore = True
+            if paires is not None:
+                prerequis_max = _prerequis_max(tournee, paires)
+    return ameliore
+
+
+def or_opt(tournee, matrice, debut, limite, longueurs=(1, 2, 3), paires=None, verifier=None, exhaustif=False):
+    """Un passage Or-opt : déplacer des segments de 1 à 3 points ailleurs dans la tournée
+
+    Le segment peut être réinséré dans un sens ou dans l'autre. Avec les
+    `paires` de `paires_precedences`, il n'est déplacé ni avant un de ses
+    prérequis, ni après un point qui en dépend, ni inversé s'il contient
+    une dépendance. `verifier` : voir `deux_opt` ; avec `exhaustif`, il
+    juge tous les déplacements, y compris ceux qui rallongent la tournée.
+    Retourne True si la tournée a été modifiée.
+    """
+    ameliore = False
+    if paires is not None:
+        avant, apres = rangs_precedences(tournee, paires)
+    for longueur in longueurs:
+        i = debut
+        while i + longueur < len(tournee):
+            if time.perf_counter() > limite:
+                return ameliore
+            p, s0, s1, q = tournee[i - 1], tournee[i], tournee[i + longueur - 1], tournee[i + longueur]
+            retrait = matrice[p, s0] + matrice[s1, q] - matrice[p, q]
+            # Arêtes (k, k+1) de la tournée hors segment, à partir du point fixe précédant `debut`
+            k = np.arange(debut - 1, len(tournee) - 1)
+            k = k[(k < i - 1) | (k > i + longueur - 1)]
+            a, b = tournee[k], tournee[k + 1]
+            base = matrice[a, b]
+            direct = matrice[a, s0] + matrice[s1, b] - base
+            inverse = matrice[a, s1] + matrice[s0, b] - base
+            if paires is not None:
+                fin_segment = i + longueur
+                dans_segment = (apres >= i) & (apres < fin_segment)
+                entrants = dans_segment & (avant < i)
+                sortants = (avant >= i) & (avant < fin_segment) & (apres >= fin_segment)
+                borne_basse = avant[entrants].max() if entrants.any() else -1
+                borne_haute = apres[sortants].min() if sortants.any() else len(tournee)
+                interdits = (k < borne_basse) | (k >= borne_haute)
+                direct[interdits] = np.inf
+                inverse[interdits] = np.inf
+                if (dans_segment & (avant >= i)).any():
+                    inverse[:] = np.inf
+            gains = retrait - np.minimum(direct, inverse)
+
+            def deplacer(meilleur, i=i, longueur=longueur, k=k, direct=direct, inverse=inverse):
+                segment = tournee[i:i + longueur].copy()
+                if inverse[meilleur] < direct[meilleur]:
+                    segment = segment[::-1]
+                position = k[meilleur]
+                reste = np.concatenate([tournee[:i], tournee[i + longueur:]])
+                if position > i:
+                    premier, dernier = i, int(position)
+                    position -= longueur
+                else:
+                    premier, dernier = int(position) + 1, i + longueur - 1
+                return np.concatenate([reste[:position + 1], segment, reste[position + 1:]]), premier, dernier
+
+            retenu = _essayer(gains, deplacer, verifier, limite, exhaustif) if len(k) else None
+            if retenu is not None:
+                tournee[:] = retenu[0]
+                ameliore = True
+                if paires is not None:
+                    avant, apres = rangs_precedences(tournee, paires)
+            else:
+                i += 1
+    return ameliore
+
+
+def ameliorer_tournee(tournee, matrice, debut=1, budget=BUDGET_DEFAUT, dependances=None):
+    """Améliorer une tournée par 2-opt puis Or-opt jusqu'à stabilité ou fin du budget
+
+    Les `debut` premiers points (maison, magasin) et le retour final restent
+    en place. La matrice doit être symétrique. Avec des `dependances`
+    ({point: points à visiter avant}), respectées par la tournée de
+    départ, aucun mouvement ne les enfreint.
+    """
+    tournee = np.array(tournee)
+    paires = paires_precedences(dependances)
+    limite = time.perf_counter() + budget
+    while time.perf_counter() < limite:
+        ameliore = deux_opt(tournee, matrice, debut, limite, paires)
+        ameliore = or_opt(tournee, matrice, debut, limite, paires=paires) or ameliore
+        if not ameliore:
+            break
+    return [int(i) for i in tournee]
+
+
+def avancer_retards(tournee, matrice, calendrier, debut, limite, paires=None):
+    """Réinsérer plus tôt chaque point livré en retard, là où le coût total baisse
+
+    L'heure d'arrivée au point depuis chaque emplacement antérieur est
+    estimée d'un coup (départ du point précédent, trajet à la vitesse de
+    l'heure) : les emplacements où il arriverait à temps sont vérifiés
+    d'abord, par gain de distance décroissant. Un point n'est pas avancé
+    avant l'un de ses prérequis (`paires`). Retourne True si la tournée a
+    été modifiée.
+    """
+    contraintes = calendrier.contraintes
+    ameliore = False
+    x = debut
+    while x < len(tournee) - 1:
+        if time.perf_counter() > limite:
+            break
+        if calendrier.retards[x] <= calendrier.retards[x - 1]:
+            x += 1
+            continue
+        point = tournee[x]
+        # Arêtes (k, k+1) avant le point
+        k = np.arange(debut - 1, x - 1)
+        if paires is not None:
+            avant, apres = rangs_precedences(tournee, paires)
+            k = k[k >= avant[apres == x].max(initial=-1)]
+        a, b = tournee[k], tournee[k + 1]
+        departs = np.asarray(calendrier.departs)[k]
+        arrivees = departs + matrice[a, point] / contraintes.profil.vitesses_a(departs) * 60
+        p, q = tournee[x - 1], tournee[x + 1]
+        gains = (matrice[p, point] + matrice[point, q] - matrice[p, q]
+                 - (matrice[a, point] + matrice[point, b] - matrice[a, b]))
+        for meilleur in np.lexsort((-gains, arrivees > contraintes.fermetures[point]))[:ESSAIS]:
+            position = int(k[meilleur])
+            candidat = np.concatenate([tournee[:position + 1], [point], tournee[position + 1:x], tournee[x + 1:]])
+            if calendrier.accepter(candidat, position + 1, x, float(gains[meilleur])):
+                tournee[:] = candidat
+                ameliore = True
+                break
+        x += 1
+    return ameliore
+
+
+def ordre_par_echeance(tournee, contraintes, debut=1, dependances=None):
+    """Tournée qui livre les points par heure de fermeture croissante (puis d'ouverture)
+
+    Les `debut` premiers points et le retour final restent en place ; un
+    point ne passe qu'après ses prérequis.
+    """
+    restants = sorted(tournee[debut:-1], key=lambda i: (contraintes.fermetures[i], contraintes.ouvertures[i]))
+    ordre = list(tournee[:debut])
+    visites = set(ordre)
+    while restants:
+        suivant = next((i for i in restants if visites.issuperset((dependances or {}).get(i, ()))), restants[0])
+        restants.remove(suivant)
+        ordre.append(suivant)
+        visites.add(suivant)
+    return ordre + [tournee[-1]]
+
+
+def respecter_fenetres(tournee, matrice, contraintes, debut=1, budget=BUDGET_DEFAUT, dependances=None):
+    """Réordonner une tournée pour limiter les retards sur les fenêtres horaires
+
+    En partant de la tournée la plus courte, les points en retard sont
+    avancés (`avancer_retards`) puis 2-opt et Or-opt raccourcissent la
+    tournée, tant que le coût distance + pénalité de retard baisse et sans
+    enfreindre les `dependances`. Les mouvements sont classés par gain de
+    distance vectorisé ; seuls les meilleurs sont vérifiés sur les
+    horaires, de façon incrémentale (`horaires.Calendrier`).
+    """
+    if not contraintes.actives:
+        return list(tournee)
+    distances = matrice.tolist()
+    echeances = ordre_par_echeance(tournee, contraintes, debut, dependances)
+    if contraintes.cout(echeances, distances) < contraintes.cout(tournee, distances):
+        tournee = echeances
+    tournee = np.array(tournee)
+    calendrier = Calendrier(contraintes, tournee, distances)
+    paires = paires_precedences(dependances)
+    limite = time.perf_counter() + budget
+    while time.perf_counter() < limite:
+        ameliore = avancer_retards(tournee, matrice, calendrier, debut, limite, paires)
+        ameliore = deux_opt(tournee, matrice, debut, limite, paires, calendrier.accepter) or ameliore
+        ameliore = or_opt(tournee, matrice, debut, limite, paires=paires, verifier=calendrier.accepter) or ameliore
+        if not ameliore and calendrier.retard > 0:
+            # Plus aucun mouvement prometteur en distance : tous les déplacements sont jugés sur le coût
+            ameliore = or_opt(tournee, matrice, debut, limite, paires=paires, verifier=calendrier.accepter,
+                              exhaustif=True)
+        if not ameliore:
+            break
+    return [int(i) for i in tournee]
+
+
+def held_karp(matrice, depart=0, premier=None, dependances=None):
+    """Tournée optimale exacte par programmation dynamique sur les sous-ensembles (Held-Karp)
+
+    Mêmes contraintes que `plus_proche_voisin` : départ et retour à
+    `depart`, passage d'abord par `premier` s'il est donné, prérequis de
+    `dependances` visités avant chaque point. Coût en O(2^n * n^2) pour
+    n clients : à réserver aux petites tournées.
+    """
+    source = depart if premier is None else premier
+    clients = np.array([i for i in range(len(matrice)) if i != depart and i != premier])
+    n = len(clients)
+    if n == 0:
+        return [depart] + ([premier] if premier is not None else []) + [depart]
+    d = matrice[np.ix_(clients, clients)]
+    # couts[masque, j] : plus court chemin depuis `source` visitant les clients
+    # du masque et se terminant par le client j ; precedents pour la reconstruction
+    couts = np.full((1 << n, n), np.inf)
+    precedents = np.full((1 << n, n), -1, dtype=np.int64)
+    bits = 1 << np.arange(n)
+    # Masque des prérequis de chaque client (0 sans dépendance)
+    position = {int(c): k for k, c in enumerate(clients)}
+    prerequis = np.array([sum(1 << position[p] for p in (dependances or {}).get(int(c), ()) if p in position)
+                          for c in clients], dtype=np.int64)
+    couts[bits, np.arange(n)] = np.where(prerequis == 0, matrice[source, clients], np.inf)
+    for masque in range(1, 1 << n):
+        presents = np.nonzero(masque & bits)[0]
+        if len(presents) < 2:
+            continue
+        # Pour chaque j du masque : meilleur k du masque sans j, puis k -> j
+        candidats = couts[masque ^ bits[presents]][:, presents] + d[np.ix_(presents, presents)].T
+        meilleurs = np.argmin(candidats, axis=1)
+        couts[masque, presents] = candidats[np.arange(len(presents)), meilleurs]
+        precedents[masque, presents] = presents[meilleurs]
+        # Un client dont les prérequis ne sont pas tous dans le masque ne peut pas finir ce chemin
+        couts[masque, presents[(prerequis[presents] & ~masque) != 0]] = np.inf
+    complet = (1 << n) - 1
+    j = int(np.argmin(couts[complet] + matrice[clients, depart]))
+    chemin = []
+    masque = complet
+    while j != -1:
+        chemin.append(int(clients[j]))
+        j, masque = int(precedents[masque, j]), masque ^ (1 << j)
+    return [depart] + ([premier] if premier is not None else []) + chemin[::-1] + [depart]
+
+
+def construire_points(maison, magasin, clients):
+    """Points de la tournée : maison (0), magasin (1, facultatif) puis les clients
+
+    `clients` est une liste de (client_id, position). Retourne la liste des
+    positions et la liste des identifiants client correspondants (None pour
+    la maison et le magasin).
+    """
+    points = [tuple(maison)]
+    ids = [None]
+    if magasin is not None:
+        points.append(tuple(magasin))
+        ids.append(None)
+    for client_id, position in clients:
+        points.append(tuple(position))
+        ids.append(client_id)
+    return points, ids
+
+
+def optimiser_tournee(matrice, clients, premier=None, budget=BUDGET_DEFAUT, seuil_exact=SEUIL_EXACT):
+    """Tournée maison (0) -> premier -> clients -> maison sur un sous-ensemble de points
+
+    Jusqu'à `seuil_exact` clients, la tournée optimale est calculée
+    exactement (Held-Karp). Au-delà, la tournée gloutonne (plus proche
+    voisin) est améliorée par 2-opt et Or-opt pendant au plus `budget`
+    secondes. Retourne la tournée gloutonne, la tournée retenue (indices
+    dans `matrice`) et la méthode employée.
+    """
+    sous_ensemble = [0] + ([premier] if premier is not None else []) + list(clients)
+    sous_matrice = matrice[np.ix_(sous_ensemble, sous_ensemble)]
+    sous_premier = 1 if premier is not None else None
+    gloutonne = plus_proche_voisin(sous_matrice, depart=0, premier=sous_premier)
+    if len(clients) <= seuil_exact:
+        methode = "exacte"
+        tournee = held_karp(sous_matrice, depart=0, premier=sous_premier)
+    elif budget > 0:
+        methode = "heuristique"
+        tournee = ameliorer_tournee(gloutonne, sous_matrice, debut=len(sous_ensemble) - len(clients), budget=budget)
+    else:
+        methode = "gloutonne"
+        tournee = gloutonne
+    return [sous_ensemble[i] for i in gloutonne], [sous_ensemble[i] for i in tournee], methode
+
+
+def optimiser_route(matrice, route, premier=None, budget=BUDGET_DEFAUT, seuil_exact=SEUIL_EXACT, contraintes=None):
+    """Tournée d'un véhicule : distance (voir `optimiser_tournee`) puis fenêtres horaires
+
+    Avec des fenêtres horaires actives, le budget est partagé moitié pour
+    la distance, moitié pour les fenêtres.
+    """
+    actives = contraintes is not None and contraintes.actives
+    gloutonne, tournee, methode = optimiser_tournee(matrice, route, premier, budget / (2 if actives else 1), seuil_exact)
+    if contraintes is not None:
+        tournee = respecter_fenetres(tournee, matrice, contraintes, debut=1 if premier is None else 2,
+                                     budget=budget / 2)
+    return gloutonne, tournee, methode
+
+
+def creer_executeur(processus=None):
+    """Pool de processus pour `optimiser_routes`, à créer une fois et garder pour tout le programme
+
+    Les processus sont démarrés par "spawn" plutôt que par copie (fork)
+    d'un programme qui peut avoir d'autres threads en cours.
+    """
+    return ProcessPoolExecutor(max_workers=processus or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def _arguments_route_isolee(matrice, route, premier, budget, seuil_exact, contraintes):
+    # Pour un autre processus : seules la sous-matrice et les contraintes de la route sont transmises
+    sous_ensemble = [0] + ([premier] if premier is not None else []) + list(route)
+    sous_contraintes = None
+    if contraintes is not None:
+        sous_contraintes = Contraintes([contraintes.ouvertures[i] for i in sous_ensemble],
+                                       [contraintes.fermetures[i] for i in sous_ensemble],
+                                       [contraintes.services[i] for i in sous_ensemble],
+                                       contraintes.depart, contraintes.profil)
+    return sous_ensemble, (matrice[np.ix_(sous_ensemble, sous_ensemble)],
+                           list(range(len(sous_ensemble) - len(route), len(sous_ensemble))),
+                           1 if premier is not None else None, budget, seuil_exact, sous_contraintes)
+
+
+def optimiser_routes(matrice, routes, premier=None, budget=BUDGET_DEFAUT, seuil_exact=SEUIL_EXACT, contraintes=None,
+                     executeur=None):
+    """(gloutonne, tournée, méthode) de chaque route, en parallèle sur les processus d'un `executeur`
+
+    Le `budget` est le temps total : réparti entre les routes, il est
+    multiplié par le nombre de processus qui les optimisent en même temps.
+    Sans `executeur` (voir `creer_executeur`), en dessous de
+    SEUIL_PARALLELE clients ou sur une seule route, tout se fait dans le
+    processus courant.
+    """
+    processus = min(len(routes), os.cpu_count() or 1) if executeur is not None else 1
+    if processus <= 1 or sum(len(route) for route in routes) < SEUIL_PARALLELE:
+        return [optimiser_route(matrice, route, premier, budget / max(len(routes), 1), seuil_exact, contraintes)
+                for route in routes]
+    budget_route = budget * processus / len(routes)
+    taches = [_arguments_route_isolee(matrice, route, premier, budget_route, seuil_exact, contraintes)
+              for route in routes]
+    try:
+        resultats = list(executeur.map(optimiser_route, *zip(*(arguments for _, arguments in taches))))
+    except (OSError, RuntimeError):
+        # Processus indisponibles (environnement restreint) : calcul dans le processus courant
+        return [optimiser_route(matrice, route, premier, budget / len(routes), seuil_exact, contraintes)
+                for route in routes]
+    return [([sous_ensemble[i] for i in gloutonne], [sous_ensemble[i] for i in tournee], methode)
+            for (sous_ensemble, _), (gloutonne, tournee, methode) in zip(taches, resultats)]
+
+
+def clarke_wright(matrice, clients, charges, vehicules, capacite=None, source=0):
+    """Répartition des clients en tournées par la méthode des économies (Clarke-Wright)
+
+    Chaque tournée part de `source` (le magasin) et revient à la maison
+    (0). Deux tournées sont fusionnées, par ordre d'économie décroissant,
+    tant que la charge reste dans la `capacite` ; les fusions sans
+    économie ne sont faites que s'il reste plus de tournées que de
+    véhicules. Retourne les tournées retenues (ordre de fusion) et les
+    clients qui n'ont pu être affectés à aucun véhicule.
+    """
+    non_affectes = [i for i in clients if capacite is not None and charges[i] > capacite]
+    clients = [i for i in clients if i not in non_affectes]
+    routes = {i: [i] for i in clients}
+    route_de = {i: i for i in clients}
+    charge = {i: charges[i] for i in clients}
+    if len(clients) > 1:
+        c = np.array(clients)
+        fin, debut = np.meshgrid(c, c, indexing='ij')
+        distinctes = fin != debut
+        fin, debut = fin[distinctes], debut[distinctes]
+        # Économie à enchaîner une tournée finissant par `fin` et une commençant par `debut`
+        economies = matrice[fin, 0] + matrice[source, debut] - matrice[fin, debut]
+        for k in np.argsort(-economies, kind='stable'):
+            if economies[k] <= 0 and len(routes) <= vehicules:
+                break
+            i, j = int(fin[k]), int(debut[k])
+            ri, rj = route_de[i], route_de[j]
+            if ri == rj or routes[ri][-1] != i or routes[rj][0] != j:
+                continue
+            if capacite is not None and charge[ri] + charge[rj] > capacite:
+                continue
+            routes[ri].extend(routes[rj])
+            charge[ri] += charge.pop(rj)
+            for client in routes.pop(rj):
+                route_de[client] = ri
+    # Les tournées en trop (flotte insuffisante) sont les moins chargées
+    retenues = sorted(routes.values(), key=lambda r: charge[route_de[r[0]]], reverse=True)
+    for route in retenues[vehicules:]:
+        non_affectes.extend(route)
+    return retenues[:vehicules], non_affectes
+
+
+def cle_point(plan, point):
+    """Identifiant stable d'un point du plan : client, magasin ou maison"""
+    return plan["clients_ids"][point] or plan["magasins_ids"][point] or "maison"
+
+
+def index_clients(plan):
+    """Point du plan de chaque client : {client_id: indice}"""
+    return {client_id: i for i, client_id in enumerate(plan["clients_ids"]) if client_id is not None}
+
+
+def regrouper_arrets(plan, indices):
+    """Arrêts clients parmi les points `indices`, dans l'ordre de passage
+
+    Les clients à la même adresse (coordonnées arrondies comme dans le
+    cache des distances) forment un seul arrêt. Retourne une liste de
+    (position, [client_id, ...]).
+    """
+    arrets = {}
+    for i in indices:
+        client_id = plan["clients_ids"][i]
+        if client_id is not None:
+            position = plan["points"][i]
+            arrets.setdefault(cle_position(position), (position, []))[1].append(client_id)
+    return list(arrets.values())
+
+
+def inserer_au_moindre_cout(tournee, point, matrice, apres=0):
+    """Meilleure insertion de `point` dans la tournée, après l'indice `apres`
+
+    Retourne l'indice d'insertion et le surcoût (km) correspondant.
+    """
+    t = np.asarray(tournee)
+    k = np.arange(apres, len(t) - 1)
+    surcouts = matrice[t[k], point] + matrice[point, t[k + 1]] - matrice[t[k], t[k + 1]]
+    meilleur = int(np.argmin(surcouts))
+    return int(k[meilleur]) + 1, float(surcouts[meilleur])
+
+
+def mettre_a_jour_tournees(matrice, cles, ordres, fixes=(), premier=None, precedences=None, charges=None, capacite=None):
+    """Reprendre les tournées précédentes au lieu de tout recalculer
+
+    `ordres` donne, par véhicule, les clés des points dans l'ordre de
+    passage précédent (sans la maison) et `cles` la clé de chaque point
+    actuel. Les points disparus (commandes annulées ou reportées) sont
+    retirés, les points `fixes` (déjà livrés) gardent leur place et rien
+    n'est inséré avant eux ; les nouveaux points sont insérés un par un à
+    l'endroit le moins coûteux, dans la capacité et après leurs
+    prérequis. Une tournée dont les arrêts conservés dépassent la
+    capacité (commandes modifiées) rend ses derniers arrêts non livrés,
+    réinsérés comme les nouveaux. L'ordre des autres arrêts ne change
+    pas. Retourne les tournées (indices) et les points qui n'ont pu être
+    insérés.
+    """
+    precedences = precedences or {}
+    charges = charges or {}
+    indice = {cle: i for i, cle in enumerate(cles)}
+    fixes = {indice[cle] for cle in fixes if cle in indice}
+    tournees = []
+    for ordre in ordres or [[]]:
+        tournee = [0] + [indice[cle] for cle in ordre if cle in indice and indice[cle] != 0] + [0]
+        if premier is not None and premier not in tournee:
+            tournee.insert(1, premier)
+        tournees.append(tournee)
+    places = {point for tournee in tournees for point in tournee}
+
+    # Un point non livré placé avant l'un de ses prérequis est réinséré
+    a_reinserer = []
+    for tournee in tournees:
+        rang = {point: i for i, point in enumerate(tournee[:-1])}
+        for point in list(tournee[1:-1]):
+            if point not in fixes and any(p not in rang or rang[p] > rang[point] for p in precedences.get(point, ())):
+                tournee.remove(point)
+                rang = {q: i for i, q in enumerate(tournee[:-1])}
+                a_reinserer.append(point)
+
+    charge = [sum(charges.get(i, 0) for i in tournee) for tournee in tournees]
+    if capacite is not None:
+        for v, tournee in enumerate(tournees):
+            for point in reversed(tournee[1:-1]):
+                if charge[v] <= capacite:
+                    break
+                if point not in fixes and charges.get(point, 0) > 0:
+                    tournee.remove(point)
+                    charge[v] -= charges[point]
+                    a_reinserer.append(point)
+    nouveaux = a_reinserer + [i for i in range(1, len(cles)) if i not in places]
+    # Les magasins (prérequis) d'abord, pour que leurs clients puissent s'insérer après
+    requis = {p for prerequis in precedences.values() for p in prerequis}
+    nouveaux.sort(key=lambda i: i not in requis)
+
+    non_affectes = []
+    for point in nouveaux:
+        meilleur = None
+        for v, tournee in enumerate(tournees):
+            if capacite is not None and charge[v] + charges.get(point, 0) > capacite:
+                continue
+            rang = {q: i for i, q in enumerate(tournee[:-1])}
+            if any(p not in rang for p in precedences.get(point, ())):
+                continue
+            apres = max([i for i, q in enumerate(tournee[:-1]) if q in fixes or q == premier] +
+                        [rang[p] for p in precedences.get(point, ())] + [0])
+            position, surcout = inserer_au_moindre_cout(tournee, point, matrice, apres)
+            if meilleur is None or surcout < meilleur[0]:
+                meilleur = (surcout, v, position)
+        if meilleur is None:
+            non_affectes.append(point)
+            continue
+        _, v, position = meilleur
+        tournees[v].insert(position, point)
+        charge[v] += charges.get(point, 0)
+    return tournees, non_affectes
+
+
+def preparer_contraintes(ids, depart, fenetres=None, services=None, profil=None):
+    """Contraintes horaires des points (None sans heure de départ)"""
+    if depart is None:
+        return None
+    fenetres, services = fenetres or {}, services or {}
+    bornes = [fenetres.get(client_id) or (None, None) for client_id in ids]
+    return Contraintes(
+        ouvertures=[float("-inf") if o is None else o for o, _ in bornes],
+        fermetures=[float("inf") if f is None else f for _, f in bornes],
+        services=[0 if client_id is None else services.get(client_id, SERVICE_DEFAUT) for client_id in ids],
+        depart=depart,
+        profil=profil,
+    )
+
+
+def ajouter_horaires(plan, vehicule, tournee, contraintes):
+    """Horaires du véhicule et clients livrés hors fenêtre"""
+    ids = plan["clients_ids"]
+    vehicule["horaires"] = contraintes.horaires(tournee, plan["matrice"].tolist())
+    vehicule["hors_fenetre"] = [ids[i] for i, h in zip(tournee, vehicule["horaires"]) if h["retard"] > 0]
+    plan["hors_fenetre"].extend(vehicule["hors_fenetre"])
+
+
+def trouver_meilleur_itineraire(maison, magasin, clients, cache=None, budget=BUDGET_DEFAUT, seuil_exact=SEUIL_EXACT,
+                                charges=None, vehicules=1, capacite=None, depart=None, fenetres=None, services=None,
+                                profil=None, magasin_id=None, ordres_precedents=None, fixes=(), reseau=None, zones=0,
+                                executeur=None, gloutonnes_precedentes=None):
+    """Itinéraires optimisés maison -> magasin -> clients -> maison, un par véhicule
+
+    Les clients sont répartis entre `vehicules` véhicules de `capacite`
+    donnée selon leurs `charges` ({client_id: charge} ; sans capacité, un
+    seul véhicule suffit), puis chaque tournée est optimisée (voir
+    `optimiser_tournee`, le budget est partagé entre véhicules). Retourne
+    un dictionnaire avec les points, les identifiants client de chaque
+    point, la matrice des distances, les clients non affectés et, par
+    véhicule, sa charge, sa tournée gloutonne, sa tournée retenue, la
+    méthode employée et les positions dans l'ordre de passage. Pour un
+    seul véhicule, ces clés sont aussi au premier niveau.
+
+    Avec une heure de `depart` (minutes depuis minuit), chaque tournée est
+    ensuite réordonnée pour respecter au mieux les `fenetres` horaires
+    ({client_id: (ouverture, fermeture)} en minutes, bornes facultatives)
+    compte tenu des durées de `services` et du profil de vitesse ; chaque
+    véhicule reçoit alors ses horaires (arrivée, attente, retard par
+    point de la tournée) et la liste des clients livrés hors fenêtre.
+
+    Avec les `ordres_precedents` (clés des points par véhicule), les
+    tournées sont mises à jour sans recalcul (voir `mettre_a_jour_tournees`) ;
+    les `gloutonnes_precedentes` (tournées gloutonnes du plan d'origine,
+    mises à jour de la même façon) restent alors la référence des km
+    économisés. Avec un `reseau` routier, la matrice est celle des distances par la
+    route (la clé "precision" du plan vaut alors "route").
+
+    Avec `zones` > 0, les clients sont d'abord découpés en autant de zones
+    géographiques de charges équilibrées (voir zones.py), chacune devenant
+    une tournée dans la `capacite` ; les clients qui ne tiennent dans
+    aucune zone sont non affectés et la clé "zones" du plan est vraie. Avec un
+    `executeur` (pool de processus), les tournées de plusieurs véhicules
+    sont optimisées en parallèle (`optimiser_routes`).
+    """
+    points, ids = construire_points(maison, magasin, clients)
+    matrice, precision = matrice_plan(points, cache, reseau)
+    premier = 1 if magasin is not None else None
+    indices_clients = list(range(len(points) - len(clients), len(points)))
+    charges_points = {i: (charges or {}).get(ids[i], 0) for i in indices_clients}
+    magasins_ids = [magasin_id if i == premier else None for i in range(len(points))]
+    if ordres_precedents is not None:
+        cles = [ids[i] or magasins_ids[i] or "maison" for i in range(len(points))]
+        routes, non_affectes = mettre_a_jour_tournees(matrice, cles, ordres_precedents, fixes, premier,
+                                                      charges=charges_points, capacite=capacite)
+    elif zones:
+        etiquettes = decouper_zones([points[i] for i in indices_clients], [charges_points[i] for i in indices_clients],
+                                    zones, centre=points[0 if premier is None else premier], capacite=capacite)
+        routes = [[i for i, zone in zip(indices_clients, etiquettes) if zone == z] for z in range(zones)]
+        routes = [route for route in routes if route] or [[]]
+        non_affectes = [i for i, zone in zip(indices_clients, etiquettes) if zone < 0]
+    elif capacite is None:
+        routes, non_affectes = [indices_clients], []
+    else:
+        routes, non_affectes = clarke_wright(matrice, indices_clients, charges_points, vehicules, capacite,
+                                             source=0 if premier is None else premier)
+    contraintes = preparer_contraintes(ids, depart, fenetres, services, profil)
+    plan = {
+        "points": points,
+        "clients_ids": ids,
+        "magasins_ids": magasins_ids,
+        "matrice": matrice,
+        "precision": precision,
+        "zones": bool(zones),
+        "non_affectes": [ids[i] for i in non_affectes],
+        "hors_fenetre": [],
+        "vehicules": [],
+    }
+    if ordres_precedents is not None:
+        # Les tournées mises à jour sont conservées telles quelles
+        gloutonnes = routes
+        if gloutonnes_precedentes is not None and len(gloutonnes_precedentes) == len(routes):
+            gloutonnes, _ = mettre_a_jour_tournees(matrice, cles, gloutonnes_precedentes, fixes, premier,
+                                                   charges=charges_points, capacite=capacite)
+        resultats = [(gloutonne, route, "incrementale") for gloutonne, route in zip(gloutonnes, routes)]
+    else:
+        resultats = optimiser_routes(matrice, routes, premier, budget, seuil_exact, contraintes, executeur)
+    for gloutonne, tournee, methode in resultats:
+        vehicule = {
+            "points": points,
+            "matrice": matrice,
+            "precision": precision,
+            "charge": sum(charges_points.get(i, 0) for i in tournee),
+            "tournee_gloutonne": gloutonne,
+            "methode": methode,
+        }
+        if contraintes is not None:
+            ajouter_horaires(plan, vehicule, tournee, contraintes)
+        vehicule.update({
+            "clients_ids": [ids[i] for i in tournee if ids[i] is not None],
+            "tournee": tournee,
+            "positions": [points[i] for i in tournee],
+        })
+        plan["vehicules"].append(vehicule)
+    if len(plan["vehicules"]) == 1:
+        plan.update({cle: plan["vehicules"][0][cle] for cle in ("tournee_gloutonne", "tournee", "methode", "positions")})
+    return plan
+
+
+def planifier_multi_magasins(maison, magasins, clients, dependances, cache=None, budget=BUDGET_DEFAUT,
+                             seuil_exact=SEUIL_EXACT, depart=None, fenetres=None, services=None, profil=None,
+                             ordres_precedents=None, fixes=(), reseau=None, gloutonnes_precedentes=None):
+    """Tournée unique maison -> retraits dans plusieurs magasins et livraisons -> maison
+
+    `magasins` est une liste de (magasin_id, position) et `dependances`
+    associe à chaque client les magasins où retirer ses commandes : chaque
+    retrait a lieu avant les livraisons qui en dépendent, les magasins et
+    les clients pouvant sinon s'intercaler librement. Même méthode que
+    `optimiser_tournee` (Held-Karp avec précédences pour les petites
+    tournées, sinon glouton puis 2-opt et Or-opt sous précédences), puis
+    fenêtres horaires si une heure de `depart` est donnée. Retourne un
+    plan de même forme que `trouver_meilleur_itineraire`, à un véhicule.
+    Avec les `ordres_precedents`, la tournée est mise à jour sans recalcul
+    (et la tournée gloutonne d'origine avec les `gloutonnes_precedentes`).
+    """
+    points = [tuple(maison)] + [tuple(position) for _, position in magasins] + [tuple(position) for _, position in clients]
+    ids = [None] * (1 + len(magasins)) + [client_id for client_id, _ in clients]
+    magasins_ids = [None] + [magasin_id for magasin_id, _ in magasins] + [None] * len(clients)
+    matrice, precision = matrice_plan(points, cache, reseau)
+    rang_magasin = {magasin_id: i for i, magasin_id in enumerate(magasins_ids) if magasin_id is not None}
+    precedences = {}
+    for i, client_id in enumerate(ids):
+        if client_id is not None:
+            precedences[i] = {rang_magasin[m] for m in dependances.get(client_id, ()) if m in rang_magasin}
+    contraintes = preparer_contraintes(ids, depart, fenetres, services, profil)
+    actives = contraintes is not None and contraintes.actives
+    budget_distance = budget / (2 if actives else 1)
+
+    non_affectes = []
+    if ordres_precedents is not None:
+        cles = [ids[i] or magasins_ids[i] or "maison" for i in range(len(points))]
+        (tournee,), non_affectes = mettre_a_jour_tournees(matrice, cles, ordres_precedents[:1], fixes,
+                                                          precedences=precedences)
+        gloutonne, methode = tournee, "incrementale"
+        if gloutonnes_precedentes:
+            (gloutonne,), _ = mettre_a_jour_tournees(matrice, cles, gloutonnes_precedentes[:1], fixes,
+                                                     precedences=precedences)
+    else:
+        gloutonne = plus_proche_voisin(matrice, depart=0, dependances=precedences)
+        if len(points) - 1 <= seuil_exact:
+            methode = "exacte"
+            tournee = held_karp(matrice, depart=0, dependances=precedences)
+        elif budget_distance > 0:
+            methode = "heuristique"
+            tournee = ameliorer_tournee(gloutonne, matrice, debut=1, budget=budget_distance, dependances=precedences)
+        else:
+            methode = "gloutonne"
+            tournee = gloutonne
+
+    plan = {
+        "points": points,
+        "clients_ids": ids,
+        "magasins_ids": magasins_ids,
+        "matrice": matrice,
+        "precision": precision,
+        "zones": False,
+        "non_affectes": [ids[i] for i in non_affectes if ids[i] is not None],
+        "hors_fenetre": [],
+        "vehicules": [],
+    }
+    vehicule = {"points": points, "matrice": matrice, "precision": precision, "charge": 0, "tournee_gloutonne": gloutonne, "methode": methode}
+    if contraintes is not None:
+        if methode != "incrementale":
+            tournee = respecter_fenetres(tournee, matrice, contraintes, debut=1, budget=budget / 2,
+                                         dependances=precedences)
+        ajouter_horaires(plan, vehicule, tournee, contraintes)
+    vehicule.update({
+        "clients_ids": [ids[i] for i in tournee if ids[i] is not None],
+        "tournee": tournee,
+        "positions": [points[i] for i in tournee],
+    })
+    plan["vehicules"].append(vehicule)
+    plan.update({cle: vehicule[cle] for cle in ("tournee_gloutonne", "tournee", "methode", "positions")})
+    return plan
+
+
+def distance_itineraire(itineraire, precision="geodesique", cache=None, tournee="tournee"):
+    """Distance totale (km) d'un itinéraire, exacte ou d'après la matrice du plan
+
+    "haversine" et "route" se lisent dans la matrice (celle d'un plan
+    calculé sur le réseau routier pour "route") ; pour un plan calculé par
+    la route, "haversine" est recalculée sur les points. `tournee="tournee_gloutonne"`
+    donne la distance de la tournée avant amélioration.
+    """
+    indices = itineraire[tournee]
+    if precision == "geodesique":
+        return distance_geodesique([itineraire["points"][i] for i in indices], cache)
+    if precision == "haversine" and itineraire.get("precision", "haversine") != "haversine":
+        # Matrice calculée par la route : haversine recalculée sur les points, trajet par trajet
+        positions = [itineraire["points"][i] for i in indices]
+        return float(distances_paires(positions[:-1], positions[1:]).sum()) if len(positions) > 1 else 0.0
+    return longueur_tournee(indices, itineraire["matrice"])
+
+
+if __name__ == "__main__":
+    # Temps de calcul selon le nombre de clients : python itineraire.py
+    rng = np.random.default_rng(0)
+    maison, magasin = (31.362120, -7.961128), (31.609110, -7.968425)
+    print(f"{'clients':>7} {'exacte (s)':>11} {'km':>8} {'heuristique (s)':>16} {'km':>8}")
+    for n in range(2, 16):
+        clients = [(i, (31.45 + 0.25 * rng.random(), -8.10 + 0.25 * rng.random())) for i in range(n)]
+        resultats = []
+        for seuil in (n, -1):
+            debut = time.perf_counter()
+            itineraire = trouver_meilleur_itineraire(maison, magasin, clients, seuil_exact=seuil)
+            resultats.append((time.perf_counter() - debut, distance_itineraire(itineraire, "haversine")))
+        (t_exact, km_exact), (t_heur, km_heur) = resultats
+        print(f"{n:>7} {t_exact:>11.4f} {km_exact:>8.2f} {t_heur:>16.4f} {km_heur:>8.2f}")
@@ -0,0 +1,183 @@
+import sys
+from collections.abc import MutableMapping
+
+
+class Enregistrement(MutableMapping):
+    """Enregistrement compact (__slots__) manipulable comme un dictionnaire
+
+    Les champs connus sont stockés dans des slots, les autres dans
+    `_extras`. Un slot non renseigné correspond à une clé absente du JSON.
+    Les champs de `INTERNES` sont internés (sys.intern) : les types de
+    viande, morceaux ou statuts répétés sur des milliers de lignes ne sont
+    alors stockés qu'une fois.
+    """
+
+    __slots__ = ("_extras",)
+    CHAMPS = ()
+    INTERNES = ()
+
+    def __init__(self, donnees=None):
+        self._extras = None
+        for cle, valeur in (donnees or {}).items():
+            self[cle] = valeur
+
+    @classmethod
+    def depuis_dict(cls, donnees):
+        return cls(donnees)
+
+    def vers_dict(self):
+        return {cle: vers_json(valeur) for cle, valeur in self.items()}
+
+    def __getitem__(self, cle):
+        if cle in self.CHAMPS:
+            try:
+                return getattr(self, cle)
+            except AttributeError:
+                raise KeyError(cle) from None
+        if self._extras is None:
+            raise KeyError(cle)
+        return self._extras[cle]
+
+    def __setitem__(self, cle, valeur):
+        if cle in self.INTERNES and isinstance(valeur, str):
+            valeur = sys.intern(valeur)
+        if cle in self.CHAMPS:
+            setattr(self, cle, valeur)
+        else:
+            if self._extras is None:
+                self._extras = {}
+            self._extras[cle] = valeur
+
+    def __delitem__(self, cle):
+        if cle in self.CHAMPS:
+            try:
+                delattr(self, cle)
+            except AttributeError:
+                raise KeyError(cle) from None
+        elif self._extras is not None and cle in self._extras:
+            del self._extras[cle]
+        else:
+            raise KeyError(cle)
+
+    def __iter__(self):
+        for champ in self.CHAMPS:
+            if hasattr(self, champ):
+                yield champ
+        if self._extras:
+            yield from self._extras
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.vers_dict()!r})"
+
+
+class LigneCommande(Enregistrement):
+    __slots__ = ("type_viande", "morceau", "quantite", "prix_vente", "prix_achat", "quantite_livree")
+    CHAMPS = __slots__
+    INTERNES = ("type_viande", "morceau")
+
+
+class Commande(Enregistrement):
+    __slots__ = ("id", "client_id", "date_commande", "date_livraison_prevue", "produits", "statut", "notes",
+                 "total_commande", "cout_achat", "magasin_source", "montant_paye", "date_livraison_reelle", "_version")
+    CHAMPS = __slots__
+    INTERNES = ("client_id", "date_livraison_prevue", "statut", "magasin_source")
+
+    def __setitem__(self, cle, valeur):
+        if cle == "produits":
+            valeur = [LigneCommande(p) if isinstance(p, dict) else p for p in valeur]
+        super().__setitem__(cle, valeur)
+
+
+class Client(Enregistrement):
+    __slots__ = ("nom", "telephone", "email", "adresse", "position", "solde", "date_creation", "fenetre_debut",
+                 "fenetre_fin", "duree_service", "_version")
+    CHAMPS = __slots__
+
+
+class Livraison(Enregistrement):
+    __slots__ = ("id", "commande_id", "client_id", "date_livraison", "quantites_livrees", "montant_paye", "statut",
+                 "_version")
+    CHAMPS = __slots__
+    INTERNES = ("client_id", "statut")
+
+
+class Mouvement(Enregistrement):
+    __slots__ = ("date", "type", "montant", "description", "client_id", "commande_id", "_version")
+    CHAMPS = __slots__
+    INTERNES = ("type", "client_id")
+
+
+# Type d'enregistrement de chaque collection convertie
+MODELES = {
+    "clients": Client,
+    "commandes": Commande,
+    "livraisons": Livraison,
+    "tresorerie": Mouvement,
+}
+
+
+def depuis_json(nom, donnees):
+    """Convertir une collection au format JSON en enregistrements compacts"""
+    modele = MODELES.get(nom)
+    if modele is None:
+        return donnees
+    if isinstance(donnees, dict):
+        return {cle: modele.depuis_dict(valeur) for cle, valeur in donnees.items()}
+    return [modele.depuis_dict(valeur) for valeur in donnees]
+
+
+def vers_json(valeur):
+    """Convertir des enregistrements (éventuellement imbriqués) vers le schéma JSON d'origine"""
+    if isinstance(valeur, Enregistrement):
+        return valeur.vers_dict()
+    if isinstance(valeur, list):
+        return [vers_json(v) for v in valeur]
+    if isinstance(valeur, dict):
+        return {cle: vers_json(v) for cle, v in valeur.items()}
+    return valeur
+
+
+def en_json(objet):
+    """Fonction `default` de json.dumps pour sérialiser les enregistrements"""
+    if isinstance(objet, Enregistrement):
+        return objet.vers_dict()
+    raise TypeError(f"Objet non sérialisable: {type(objet).__name__}")
+
+
+def mesurer_memoire(charger):
+    """Mémoire (octets) allouée par `charger()` et conservée par son résultat"""
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    avant = tracemalloc.take_snapshot()
+    resultat = charger()
+    apres = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    octets = sum(stat.size_diff for stat in apres.compare_to(avant, 'filename'))
+    return resultat, octets
+
+
+if __name__ == "__main__":
+    # Rapport mémoire : python modeles.py (dans le dossier des fichiers JSON)
+    import json
+
+    from stockage import FICHIERS
+
+    for nom in MODELES:
+        try:
+            with open(FICHIERS[nom], 'r') as f:
+                texte = f.read()
+        except FileNotFoundError:
+            print(f"{nom}: fichier absent")
+            continue
+        dictionnaires, octets_dict = mesurer_memoire(lambda: json.loads(texte))
+        _, octets_compact = mesurer_memoire(lambda: depuis_json(nom, json.loads(texte)))
+        assert vers_json(depuis_json(nom, dictionnaires)) == dictionnaires
+        gain = 100 * (1 - octets_compact / octets_dict) if octets_dict else 0
+        print(f"{nom}: {len(dictionnaires)} enregistrements, dictionnaires {octets_dict / 1024:.0f} Ko "
+              f"-> compact {octets_compact / 1024:.0f} Ko ({gain:.0f}% de moins)")
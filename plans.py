@@ -0,0 +1,352 @@
+import atexit
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import horaires
+import itineraire as routage
+
+# Commandes à planifier ; en mise à jour incrémentale s'y ajoutent celles déjà en route ou livrées
+STATUTS_A_PLANIFIER = ['en_attente', 'partiellement_livre']
+STATUTS_INCREMENTAL = ['en_cours', 'livree']
+
+# Paramètres par défaut de la page Itinéraire, repris par le précalcul
+DEPART_DEFAUT = "08:00"
+
+# Protège l'ajout de distances aux plans partagés (précalcul et sessions)
+_verrou_distances = threading.Lock()
+
+
+def charge_commande(commande):
+    """Quantité restant à livrer pour une commande"""
+    return sum(p['quantite'] - p.get('quantite_livree', 0) for p in commande['produits'])
+
+
+def clients_a_livrer(commandes_du_jour, clients_connus):
+    """Clients (avec position) des commandes, leurs charges, horaires et magasins de retrait"""
+    clients = []
+    charges = {}
+    fenetres = {}
+    services = {}
+    magasins = {}
+
+    for cmd in commandes_du_jour:
+        if cmd['client_id'] in clients_connus:
+            client = clients_connus[cmd['client_id']]
+            if 'position' in client:
+                if cmd['client_id'] not in charges:
+                    clients.append((cmd['client_id'], client['position']))
+                    fenetres[cmd['client_id']] = (horaires.minutes(client.get('fenetre_debut')),
+                                                  horaires.minutes(client.get('fenetre_fin')))
+                    services[cmd['client_id']] = client.get('duree_service', horaires.SERVICE_DEFAUT)
+                charges[cmd['client_id']] = charges.get(cmd['client_id'], 0) + charge_commande(cmd)
+                magasins.setdefault(cmd['client_id'], set()).add(cmd.get('magasin_source', 'depot_central'))
+    return clients, charges, fenetres, services, magasins
+
+
+def commandes_a_planifier(donnees, date_livraison, magasin_id=None, ordres_precedents=None):
+    """Commandes du jour à placer dans la tournée et clients déjà livrés (fixes)
+
+    Sans `ordres_precedents`, seules les commandes en attente ou
+    partiellement livrées sont planifiées. En mise à jour incrémentale,
+    les commandes en route et livrées comptent aussi : un client déjà
+    prévu dont toutes les commandes du jour sont livrées garde sa place.
+    """
+    statuts = STATUTS_A_PLANIFIER + (STATUTS_INCREMENTAL if ordres_precedents is not None else [])
+    commandes = donnees.rechercher_commandes(date_livraison=date_livraison, statuts=statuts, magasin_id=magasin_id)
+    if ordres_precedents is None:
+        return commandes, set()
+    deja_prevus = {cle for ordre in ordres_precedents for cle in ordre}
+    statuts_clients = {}
+    for cmd in commandes:
+        statuts_clients.setdefault(cmd['client_id'], set()).add(cmd['statut'])
+    fixes = {client_id for client_id, statuts_client in statuts_clients.items()
+             if statuts_client == {'livree'} and client_id in deja_prevus}
+    return [cmd for cmd in commandes if cmd['statut'] != 'livree' or cmd['client_id'] in fixes], fixes
+
+
+def planifier(magasins_source, clients_connus, commandes_du_jour, magasin_id=None, vehicules=1, capacite=None,
+              depart=None, ordres_precedents=None, fixes=(), cache=None, budget=routage.BUDGET_DEFAUT, reseau=None,
+              zones=0, gloutonnes_precedentes=None, executeur=None):
+    """Plan de tournée(s) des commandes du jour (voir itineraire.py)
+
+    Avec un `magasin_id`, retrait dans ce magasin puis livraisons, réparties
+    entre les véhicules ; sans, tournée combinée passant par tous les
+    magasins des commandes, chaque retrait avant ses livraisons. Avec un
+    `reseau` routier (reseau_routier.py), les distances sont par la route.
+    Avec `zones` > 0 (un seul magasin), les clients sont découpés en zones
+    géographiques, une tournée par zone. Avec un `executeur` (pool de
+    processus), les tournées des véhicules ou des zones sont optimisées en
+    parallèle.
+    """
+    clients, charges, fenetres, services, dependances = clients_a_livrer(commandes_du_jour, clients_connus)
+    maison = magasins_source["maison"]["position"]
+    if magasin_id is None:
+        magasins_ids = sorted({m for ids in dependances.values() for m in ids if m in magasins_source})
+        magasins = [(m, magasins_source[m]["position"]) for m in magasins_ids]
+        return routage.planifier_multi_magasins(maison, magasins, clients, dependances, cache=cache, budget=budget,
+                                                depart=depart, fenetres=fenetres, services=services,
+                                                ordres_precedents=ordres_precedents, fixes=fixes, reseau=reseau,
+                                                gloutonnes_precedentes=gloutonnes_precedentes)
+    # Magasin source (retiré en premier), départ et retour à la maison
+    magasin = magasins_source[magasin_id]["position"] if magasin_id in magasins_source else None
+    return routage.trouver_meilleur_itineraire(maison, magasin, clients, cache=cache, budget=budget,
+                                               charges=charges, vehicules=vehicules, capacite=capacite,
+                                               depart=depart, fenetres=fenetres, services=services,
+                                               magasin_id=magasin_id, ordres_precedents=ordres_precedents, fixes=fixes,
+                                               reseau=reseau, zones=zones, gloutonnes_precedentes=gloutonnes_precedentes,
+                                               executeur=executeur)
+
+
+def cle_plan(date_livraison, magasin_id, commandes_du_jour, magasins_source, clients_connus, **parametres):
+    """Clé d'un plan : date, magasin et empreinte des commandes, positions, horaires et paramètres"""
+    commandes = sorted(
+        (cmd['id'], cmd['statut'], cmd['client_id'], cmd.get('magasin_source', 'depot_central'), charge_commande(cmd))
+        for cmd in commandes_du_jour
+    )
+    clients = {}
+    for cmd in commandes_du_jour:
+        client = clients_connus.get(cmd['client_id'])
+        if client is not None:
+            clients[cmd['client_id']] = (client.get('position'), client.get('fenetre_debut'),
+                                         client.get('fenetre_fin'), client.get('duree_service'))
+    magasins = {m: magasin.get('position') for m, magasin in list(magasins_source.items())}
+    contenu = json.dumps([commandes, clients, magasins, parametres], sort_keys=True, default=str)
+    return f"{date_livraison}|{magasin_id or 'combine'}|{hashlib.sha1(contenu.encode('utf-8')).hexdigest()}"
+
+
+def parametres_tournee(magasin_id, vehicules=1, capacite=None, depart=None, zones=0):
+    """Paramètres du découpage des tournées : s'ils changent, les tournées sont redécoupées"""
+    if magasin_id is None:
+        # La tournée combinée se fait avec un seul véhicule, sans capacité ni zones
+        return {"vehicules": 1, "capacite": None, "depart": depart, "zones": 0}
+    return {"vehicules": vehicules, "capacite": capacite, "depart": depart, "zones": zones}
+
+
+def etat_du_jour(donnees, date_livraison, magasin_id=None):
+    """Commandes du jour à livrer ou en cours ([id, statut] triés) et horaires de leurs clients"""
+    commandes = donnees.rechercher_commandes(date_livraison=date_livraison,
+                                             statuts=STATUTS_A_PLANIFIER + STATUTS_INCREMENTAL, magasin_id=magasin_id)
+    clients_connus = donnees["clients"]
+    fenetres = {}
+    for cmd in commandes:
+        client = clients_connus.get(cmd['client_id'])
+        if client is not None:
+            fenetres[cmd['client_id']] = [client.get('fenetre_debut'), client.get('fenetre_fin'),
+                                          client.get('duree_service')]
+    return sorted([cmd['id'], cmd['statut']] for cmd in commandes), fenetres
+
+
+def reference_incrementale(retenue, commandes, fenetres, parametres):
+    """Tournée retenue à mettre à jour, ou None s'il faut tout recalculer
+
+    La mise à jour incrémentale ne sert que si les commandes du jour (ou
+    leurs statuts) ont changé depuis la tournée retenue, avec les mêmes
+    paramètres et les mêmes horaires pour les clients communs ; sinon les
+    tournées sont redécoupées. Si la tournée retenue est elle-même une
+    mise à jour et que rien n'a changé depuis, sa base est reprise : le
+    même plan est retrouvé.
+    """
+    if retenue is None or retenue.get("parametres") != parametres:
+        return None
+    if retenue["commandes"] == commandes:
+        retenue = retenue.get("base")
+        if retenue is None or retenue["commandes"] == commandes:
+            return None
+    if any(retenue["fenetres"].get(client_id, horaires_client) != horaires_client
+           for client_id, horaires_client in fenetres.items()):
+        return None
+    return retenue
+
+
+def mise_a_jour_possible(donnees, registre, date_livraison, magasin_id=None, **parametres):
+    """Vrai si les commandes ont changé depuis la tournée retenue, qui peut alors être mise à jour"""
+    retenue = registre.lire(registre.cle(date_livraison, magasin_id))
+    return reference_incrementale(retenue, *etat_du_jour(donnees, date_livraison, magasin_id),
+                                  parametres_tournee(magasin_id, **parametres)) is not None
+
+
+def ordres_du_plan(plan, tournee="tournee"):
+    """Clés des arrêts de chaque véhicule, dans l'ordre de passage (sans la maison)"""
+    return [[routage.cle_point(plan, point) for point in vehicule[tournee][1:-1]] for vehicule in plan["vehicules"]]
+
+
+def tournee_retenue(plan, commandes, fenetres, parametres, reference=None):
+    """Enregistrement du registre des tournées (tournees.py) pour un plan affiché"""
+    retenue = {
+        "ordres": ordres_du_plan(plan),
+        "gloutonnes": ordres_du_plan(plan, "tournee_gloutonne"),
+        "commandes": commandes,
+        "fenetres": fenetres,
+        "parametres": parametres,
+    }
+    if reference is not None:
+        retenue["base"] = {cle: valeur for cle, valeur in reference.items() if cle != "base"}
+    return retenue
+
+
+def cle_carte(plan, precision, **contenu):
+    """Empreinte d'une carte : tournées du plan, distances affichées et autres éléments dessinés"""
+    tournees = [vehicule["tournee"] for vehicule in plan["vehicules"]]
+    distances = plan.get("distances", {}).get((precision, "tournee"))
+    empreinte = json.dumps([plan["points"], plan["clients_ids"], plan["magasins_ids"], plan["non_affectes"], tournees,
+                            plan.get("zones"), distances, contenu], sort_keys=True, default=str)
+    return hashlib.sha1(empreinte.encode('utf-8')).hexdigest()
+
+
+def distances_vehicules(plan, precision="geodesique", cache=None, tournee="tournee"):
+    """Distance (km) de chaque tournée du plan, calculée une fois par précision puis conservée dans le plan
+
+    Le plan pouvant être lu par d'autres sessions, le dictionnaire des
+    distances est remplacé (sous verrou) plutôt que modifié sur place.
+    """
+    cle = (precision, tournee)
+    distances = plan.get("distances", {})
+    if cle in distances:
+        return distances[cle]
+    valeurs = [routage.distance_itineraire(vehicule, precision, cache=cache, tournee=tournee)
+               for vehicule in plan["vehicules"]]
+    with _verrou_distances:
+        distances = plan.get("distances", {})
+        if cle not in distances:
+            plan["distances"] = {**distances, cle: valeurs}
+        return plan["distances"][cle]
+
+
+class CacheCalculs:
+    """Résultats déjà calculés (plans de tournée, cartes), par clé, en LRU borné"""
+
+    def __init__(self, capacite=64):
+        self.capacite = capacite
+        self.resultats = OrderedDict()
+        self.verrou = threading.Lock()
+        self.calculs = {}
+
+    def __contains__(self, cle):
+        return cle in self.resultats
+
+    def obtenir(self, cle, calcul):
+        """Résultat en cache, sinon `calcul()` ; deux demandes simultanées ne calculent qu'une fois"""
+        with self.verrou:
+            if cle in self.resultats:
+                self.resultats.move_to_end(cle)
+                return self.resultats[cle]
+            evenement = self.calculs.get(cle)
+            if evenement is None:
+                self.calculs[cle] = threading.Event()
+        if evenement is not None:
+            # Déjà en cours de calcul (précalcul ou autre session) : attendre le résultat
+            evenement.wait()
+            with self.verrou:
+                if cle in self.resultats:
+                    return self.resultats[cle]
+            return self.obtenir(cle, calcul)
+        try:
+            resultat = calcul()
+            with self.verrou:
+                self.resultats[cle] = resultat
+                while len(self.resultats) > self.capacite:
+                    self.resultats.popitem(last=False)
+            return resultat
+        finally:
+            with self.verrou:
+                self.calculs.pop(cle).set()
+
+
+def plan_du_jour(donnees, plans, registre, date_livraison, magasin_id=None, vehicules=1, capacite=None, depart=None,
+                 incremental=True, cache=None, budget=routage.BUDGET_DEFAUT, reseau=None, zones=0, executeur=None):
+    """Plan de la page Itinéraire, pris dans le cache des plans ou calculé
+
+    Avec `incremental`, la dernière tournée retenue pour ce jour et ce
+    magasin est mise à jour si les commandes ont changé depuis (voir
+    `reference_incrementale`). Retourne le plan, les commandes planifiées
+    et l'enregistrement à conserver dans le registre des tournées si le
+    plan est affiché.
+    """
+    parametres = parametres_tournee(magasin_id, vehicules, capacite, depart, zones)
+    commandes, fenetres = etat_du_jour(donnees, date_livraison, magasin_id)
+    reference = None
+    if incremental:
+        reference = reference_incrementale(registre.lire(registre.cle(date_livraison, magasin_id)),
+                                           commandes, fenetres, parametres)
+    ordres_precedents = reference["ordres"] if reference is not None else None
+    gloutonnes_precedentes = reference.get("gloutonnes") if reference is not None else None
+    commandes_du_jour, fixes = commandes_a_planifier(donnees, date_livraison, magasin_id, ordres_precedents)
+    if not commandes_du_jour:
+        return None, commandes_du_jour, None
+    magasins_source, clients_connus = donnees["magasins_source"], donnees["clients"]
+    cle = cle_plan(date_livraison, magasin_id, commandes_du_jour, magasins_source, clients_connus,
+                   vehicules=vehicules, capacite=capacite, depart=depart, ordres=ordres_precedents,
+                   gloutonnes=gloutonnes_precedentes, fixes=sorted(fixes), budget=budget,
+                   reseau=reseau.nom if reseau is not None else None, zones=zones)
+    plan = plans.obtenir(cle, lambda: planifier(magasins_source, clients_connus, commandes_du_jour, magasin_id,
+                                                vehicules, capacite, depart, ordres_precedents, fixes, cache, budget,
+                                                reseau, zones, gloutonnes_precedentes, executeur))
+    return plan, commandes_du_jour, tournee_retenue(plan, commandes, fenetres, parametres, reference)
+
+
+class PrecalculPlans(threading.Thread):
+    """Thread d'arrière-plan qui précalcule les tournées du lendemain
+
+    Une demande (commandes modifiées) déclenche, après `delai` secondes
+    d'anti-rebond, le calcul des plans de chaque magasin pour le lendemain
+    avec les paramètres par défaut de la page Itinéraire, ainsi que leur
+    distance exacte : la page s'ouvre alors sans calcul.
+    """
+
+    def __init__(self, donnees, plans, registre, cache=None, budget=routage.BUDGET_DEFAUT, delai=2.0, reseau=None,
+                 executeur=None):
+        super().__init__(name="precalcul-plans", daemon=True)
+        self.donnees = donnees
+        self.plans = plans
+        self.registre = registre
+        self.cache = cache
+        self.budget = budget
+        self.delai = delai
+        self.reseau = reseau
+        self.executeur = executeur
+        self.demande = threading.Event()
+        self.arret = threading.Event()
+        self.derniere_erreur = None
+        self.dernier_calcul = None
+        atexit.register(self.arreter)
+
+    def demander(self):
+        self.demande.set()
+
+    def precalculer(self):
+        demain = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+        magasins_source = self.donnees["magasins_source"]
+        magasins = [m for m, magasin in list(magasins_source.items()) if magasin.get('type') == 'magasin']
+        for magasin_id in magasins:
+            plan, _, _ = plan_du_jour(self.donnees, self.plans, self.registre, demain, magasin_id,
+                                      depart=horaires.minutes(DEPART_DEFAUT), cache=self.cache, budget=self.budget,
+                                      reseau=self.reseau, executeur=self.executeur)
+            if plan is not None:
+                distances_vehicules(plan, "geodesique", self.cache)
+                distances_vehicules(plan, "geodesique", self.cache, tournee="tournee_gloutonne")
+        if self.cache is not None:
+            self.cache.enregistrer()
+        self.dernier_calcul = datetime.now().strftime('%H:%M:%S')
+
+    def run(self):
+        while not self.arret.is_set():
+            self.demande.wait()
+            # Anti-rebond : attendre que les modifications rapprochées s'accumulent
+            self.arret.wait(self.delai)
+            if self.arret.is_set():
+                break
+            self.demande.clear()
+            try:
+                self.precalculer()
+                self.derniere_erreur = None
+            except Exception as e:
+                self.derniere_erreur = f"{datetime.now().strftime('%H:%M:%S')} - {e}"
+
+    def arreter(self, timeout=5):
+        self.arret.set()
+        self.demande.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,264 @@
+import hashlib
+import heapq
+import json
+import os
+
+import numpy as np
+
+from cache_distances import cle_position
+from index_spatial import IndexSpatial
+from itineraire import PRECISION_ROUTE, distances_paires
+
+
+def lire_graphe(chemin):
+    """Nœuds [(lat, lon)] et arêtes [(a, b, km, sens_unique)] d'un fichier de graphe routier
+
+    Deux formats sont acceptés :
+    - JSON {"noeuds": [[lat, lon], ...], "aretes": [[a, b], [a, b, km], [a, b, km, sens_unique], ...]},
+      la longueur étant calculée si elle est absente ;
+    - GeoJSON de lignes (LineString / MultiLineString en [lon, lat]), par exemple un
+      extrait OSM exporté avec `ogr2ogr -f GeoJSON routes.geojson extrait.osm.pbf lines` :
+      seules les lignes ayant une propriété "highway" sont gardées s'il y en a, les
+      points partagés deviennent des intersections et "oneway" = "yes" un sens unique.
+    """
+    with open(chemin, 'r', encoding='utf-8') as f:
+        contenu = json.load(f)
+    if "noeuds" in contenu:
+        noeuds = [tuple(noeud) for noeud in contenu["noeuds"]]
+        aretes = [(int(a[0]), int(a[1]), a[2] if len(a) > 2 else None, bool(a[3]) if len(a) > 3 else False)
+                  for a in contenu["aretes"]]
+        return noeuds, aretes
+
+    if contenu.get("type") != "FeatureCollection":
+        raise ValueError(f"Format de graphe routier inconnu: {chemin}")
+    lignes = []
+    for element in contenu["features"]:
+        geometrie = element.get("geometry") or {}
+        proprietes = element.get("properties") or {}
+        if geometrie.get("type") == "LineString":
+            lignes.append((geometrie["coordinates"], proprietes))
+        elif geometrie.get("type") == "MultiLineString":
+            lignes.extend((coordonnees, proprietes) for coordonnees in geometrie["coordinates"])
+    if any("highway" in proprietes for _, proprietes in lignes):
+        lignes = [(coordonnees, proprietes) for coordonnees, proprietes in lignes if proprietes.get("highway")]
+    noeuds = []
+    rangs = {}
+    aretes = []
+    for coordonnees, proprietes in lignes:
+        sens_unique = str(proprietes.get("oneway", "no")).lower() in ("yes", "true", "1")
+        precedent = None
+        for lon, lat in (c[:2] for c in coordonnees):
+            cle = cle_position((lat, lon))
+            if cle not in rangs:
+                rangs[cle] = len(noeuds)
+                noeuds.append((lat, lon))
+            if precedent is not None and precedent != rangs[cle]:
+                aretes.append((precedent, rangs[cle], None, sens_unique))
+            precedent = rangs[cle]
+    return noeuds, aretes
+
+
+class ReseauRoutier:
+    """Graphe routier local pour des distances par la route, sans connexion
+
+    Chaque arrêt est accroché au nœud le plus proche de la composante
+    principale du graphe (le trajet d'accès est compté à vol d'oiseau),
+    puis les plus courts chemins de chaque arrêt vers tous les autres sont
+    calculés par Dijkstra : en une passe par scipy s'il est installé,
+    sinon en Python, chaque recherche s'arrêtant une fois tous les arrêts
+    atteints. Les sens uniques rendent les distances asymétriques ; comme
+    2-opt inverse des portions de tournée, la matrice d'optimisation
+    retient la moyenne des deux sens.
+    """
+
+    def __init__(self, noeuds, aretes, nom=""):
+        self.nom = nom
+        # Précision des distances en cache : un autre graphe (ou le même fichier modifié) ne les réutilise pas
+        self.precision_cache = f"{PRECISION_ROUTE}:{hashlib.sha1(nom.encode('utf-8')).hexdigest()[:12]}"
+        self.noeuds = np.asarray(noeuds, dtype=float).reshape(-1, 2)
+        n = len(self.noeuds)
+        origines = np.array([a for a, _, _, _ in aretes], dtype=int)
+        destinations = np.array([b for _, b, _, _ in aretes], dtype=int)
+        longueurs = np.array([np.nan if km is None else km for _, _, km, _ in aretes], dtype=float)
+        manquantes = np.isnan(longueurs)
+        if manquantes.any():
+            longueurs[manquantes] = distances_paires(self.noeuds[origines[manquantes]],
+                                                     self.noeuds[destinations[manquantes]])
+        doubles = np.array([not sens_unique for _, _, _, sens_unique in aretes], dtype=bool)
+        self.origines = np.concatenate([origines, destinations[doubles]])
+        self.destinations = np.concatenate([destinations, origines[doubles]])
+        self.longueurs = np.concatenate([longueurs, longueurs[doubles]])
+        self.voisins = [[] for _ in range(n)]
+        for a, b, km in zip(self.origines.tolist(), self.destinations.tolist(), self.longueurs.tolist()):
+            self.voisins[a].append((b, km))
+        self._csr = None
+        # Seuls les nœuds de la plus grande composante servent de points d'accroche
+        self.accroches = IndexSpatial(taille_cellule=0.5, latitude_reference=float(self.noeuds[:, 0].mean()) if n else 31.5)
+        for noeud in self._composante_principale():
+            self.accroches.ajouter(noeud, self.noeuds[noeud])
+
+    @classmethod
+    def charger(cls, chemin):
+        noeuds, aretes = lire_graphe(chemin)
+        return cls(noeuds, aretes, nom=f"{os.path.abspath(chemin)}|{os.path.getmtime(chemin)}")
+
+    def __len__(self):
+        return len(self.noeuds)
+
+    def _composante_principale(self):
+        # Composantes du graphe sans tenir compte du sens de circulation
+        non_oriente = [[] for _ in range(len(self.noeuds))]
+        for a, b in zip(self.origines.tolist(), self.destinations.tolist()):
+            non_oriente[a].append(b)
+            non_oriente[b].append(a)
+        composante = [-1] * len(self.noeuds)
+        meilleure, taille_meilleure = -1, 0
+        for depart in range(len(self.noeuds)):
+            if composante[depart] >= 0:
+                continue
+            composante[depart] = depart
+            pile, taille = [depart], 0
+            while pile:
+                noeud = pile.pop()
+                taille += 1
+                for voisin in non_oriente[noeud]:
+                    if composante[voisin] < 0:
+                        composante[voisin] = depart
+                        pile.append(voisin)
+            if taille > taille_meilleure:
+                meilleure, taille_meilleure = depart, taille
+        return [noeud for noeud, c in enumerate(composante) if c == meilleure]
+
+    def accrocher(self, position):
+        """Nœud le plus proche d'une position et distance (km) d'accès"""
+        (noeud, acces), = self.accroches.plus_proches(position, 1)
+        return noeud, acces
+
+    def _dijkstra(self, source, cibles=(), predecesseurs=False):
+        """Distances (km) depuis `source` ; arrêt dès que toutes les `cibles` sont atteintes"""
+        distances = {source: 0.0}
+        precedents = {source: None}
+        restantes = set(cibles) - {source}
+        file = [(0.0, source)]
+        fixes = set()
+        while file:
+            distance, noeud = heapq.heappop(file)
+            if noeud in fixes:
+                continue
+            fixes.add(noeud)
+            restantes.discard(noeud)
+            if cibles and not restantes:
+                break
+            for voisin, km in self.voisins[noeud]:
+                nouvelle = distance + km
+                if nouvelle < distances.get(voisin, float("inf")):
+                    distances[voisin] = nouvelle
+                    precedents[voisin] = noeud
+                    heapq.heappush(file, (nouvelle, voisin))
+        return (distances, precedents) if predecesseurs else distances
+
+    def _plus_courts_chemins(self, sources, cibles):
+        """Matrice len(sources) x len(cibles) des plus courtes distances entre nœuds"""
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:
+            resultat = np.empty((len(sources), len(cibles)))
+            for i, source in enumerate(sources):
+                distances = self._dijkstra(source, cibles)
+                resultat[i] = [distances.get(cible, np.inf) for cible in cibles]
+            return resultat
+        if self._csr is None:
+            n = len(self.noeuds)
+            # Arêtes parallèles : csr_matrix les additionnerait, seule la plus courte est gardée
+            ordre = np.lexsort((self.longueurs, self.destinations, self.origines))
+            paires = np.stack([self.origines[ordre], self.destinations[ordre]], axis=1)
+            premieres = np.ones(len(ordre), dtype=bool)
+            premieres[1:] = (paires[1:] != paires[:-1]).any(axis=1)
+            ordre = ordre[premieres]
+            self._csr = csr_matrix((self.longueurs[ordre], (self.origines[ordre], self.destinations[ordre])),
+                                   shape=(n, n))
+        return dijkstra(self._csr, directed=True, indices=sources)[:, cibles]
+
+    def matrice(self, positions, cache=None):
+        """Matrice n x n symétrique des distances (km) par la route entre les positions
+
+        Avec un `cache` (CacheDistances, précision "route" suivie de l'empreinte
+        du graphe), seuls les arrêts ayant une paire absente du cache
+        relancent une recherche.
+        """
+        n = len(positions)
+        matrice = np.zeros((n, n))
+        manquantes = []
+        for i in range(n):
+            for j in range(i + 1, n):
+                distance = cache.lire(self.precision_cache, positions[i], positions[j]) if cache is not None else None
+                if distance is None:
+                    manquantes.append((i, j))
+                else:
+                    matrice[i, j] = matrice[j, i] = distance
+        if not manquantes:
+            return matrice
+        accroches = [self.accrocher(position) for position in positions]
+        noeuds = [noeud for noeud, _ in accroches]
+        acces = np.array([km for _, km in accroches])
+        sources = sorted({i for paire in manquantes for i in paire})
+        routes = self._plus_courts_chemins([noeuds[i] for i in sources], noeuds)
+        rang = {i: k for k, i in enumerate(sources)}
+        for i, j in manquantes:
+            # Moyenne des deux sens, plus les trajets d'accès aux nœuds
+            distance = (routes[rang[i], j] + routes[rang[j], i]) / 2 + acces[i] + acces[j]
+            matrice[i, j] = matrice[j, i] = distance
+            if cache is not None:
+                cache.ajouter(self.precision_cache, positions[i], positions[j], distance)
+        return matrice
+
+    def chemin(self, a, b):
+        """Positions successives du trajet par la route de `a` à `b`"""
+        depart, _ = self.accrocher(a)
+        arrivee, _ = self.accrocher(b)
+        _, precedents = self._dijkstra(depart, [arrivee], predecesseurs=True)
+        if arrivee not in precedents:
+            return [tuple(a), tuple(b)]
+        noeuds = []
+        noeud = arrivee
+        while noeud is not None:
+            noeuds.append(noeud)
+            noeud = precedents[noeud]
+        return [tuple(a)] + [tuple(self.noeuds[noeud].tolist()) for noeud in reversed(noeuds)] + [tuple(b)]
+
+    def trace(self, positions):
+        """Tracé par la route d'un trajet passant par les positions dans l'ordre"""
+        trace = [tuple(positions[0])] if positions else []
+        for a, b in zip(positions, positions[1:]):
+            trace.extend(self.chemin(a, b)[1:])
+        return trace
+
+
+if __name__ == "__main__":
+    # Grille de rues synthétique autour du dépôt : python reseau_routier.py [graphe.json|graphe.geojson]
+    import sys
+    import time
+
+    from itineraire import matrice_distances
+
+    if len(sys.argv) > 1:
+        reseau = ReseauRoutier.charger(sys.argv[1])
+    else:
+        cote = 150
+        lat0, lon0, pas = 31.55, -8.05, 0.0012
+        noeuds = [(lat0 + i * pas, lon0 + j * pas) for i in range(cote) for j in range(cote)]
+        aretes = [(i * cote + j, i * cote + j + 1, None, i % 7 == 3) for i in range(cote) for j in range(cote - 1)]
+        aretes += [(i * cote + j, (i + 1) * cote + j, None, False) for i in range(cote - 1) for j in range(cote)]
+        reseau = ReseauRoutier(noeuds, aretes)
+    rng = np.random.default_rng(0)
+    bornes = reseau.noeuds.min(axis=0), reseau.noeuds.max(axis=0)
+    for n in (10, 50, 100):
+        positions = [tuple(bornes[0] + (bornes[1] - bornes[0]) * rng.random(2)) for _ in range(n)]
+        debut = time.perf_counter()
+        routes = reseau.matrice(positions)
+        duree = time.perf_counter() - debut
+        directes = matrice_distances(positions)
+        rapport = routes[directes > 0] / directes[directes > 0]
+        print(f"{len(reseau)} nœuds, {n:>3} arrêts : matrice en {duree:.3f} s, "
+              f"route / vol d'oiseau = {rapport.mean():.2f} (min {rapport.min():.2f})")
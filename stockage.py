@@ -0,0 +1,644 @@
+import atexit
+import copy
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from datetime import datetime
+
+from modeles import en_json
+
+# Fichiers de persistance par collection
+FICHIERS = {
+    "magasins_source": "magasins_source.json",
+    "clients": "clients.json",
+    "commandes": "commandes.json",
+    "livraisons": "livraisons.json",
+    "tresorerie": "tresorerie.json",
+}
+
+# Collections indexées par clé (dictionnaires) ou par champ 'id' (listes) ;
+# la trésorerie est une liste indexée par position
+COLLECTIONS_PAR_CLE = ("magasins_source", "clients")
+COLLECTIONS_PAR_ID = ("commandes", "livraisons")
+
+# Numéro de version porté par chaque enregistrement, incrémenté à chaque écriture
+CHAMP_VERSION = "_version"
+
+
+class SuiviModifications:
+    """Suivi des collections (et enregistrements) modifiés depuis la dernière sauvegarde"""
+
+    def __init__(self):
+        # collection -> ensemble des clés d'enregistrements modifiés
+        # (None = collection entière à réécrire)
+        self.modifications = {}
+        # Ensembles de (collection, clé) modifiés par une même action, terminés
+        # ou en cours (par groupe, par exemple le thread d'une session),
+        # annulés ensemble en cas de conflit
+        self.groupes_termines = []
+        self.groupes_en_cours = {}
+
+    def marquer(self, collection, cle=None, groupe=None):
+        if collection not in FICHIERS:
+            raise KeyError(f"Collection inconnue: {collection}")
+        if cle is not None and groupe is not None:
+            self.groupes_en_cours.setdefault(groupe, set()).add((collection, cle))
+        if cle is None:
+            self.modifications[collection] = None
+        elif collection not in self.modifications:
+            self.modifications[collection] = {cle}
+        elif self.modifications[collection] is not None:
+            self.modifications[collection].add(cle)
+
+    def terminer_groupe(self, groupe):
+        """Clore l'action en cours d'un groupe : ses modifications suivantes formeront une autre action"""
+        cles = self.groupes_en_cours.pop(groupe, None)
+        if cles:
+            self.groupes_termines.append(cles)
+
+    def groupes(self):
+        return self.groupes_termines + list(self.groupes_en_cours.values())
+
+    def collections_modifiees(self):
+        return list(self.modifications.keys())
+
+    def cles_modifiees(self, collection):
+        """Clés modifiées d'une collection (None si toute la collection est concernée)"""
+        return self.modifications.get(collection)
+
+    def est_modifie(self, collection=None):
+        if collection is None:
+            return bool(self.modifications)
+        return collection in self.modifications
+
+    def vider(self, collection=None):
+        if collection is None:
+            self.modifications.clear()
+            self.groupes_termines.clear()
+            self.groupes_en_cours.clear()
+        else:
+            self.modifications.pop(collection, None)
+
+    def fusionner(self, autre):
+        """Reprendre les modifications d'un autre suivi (par exemple après un échec d'écriture)"""
+        for collection, cles in autre.modifications.items():
+            if cles is None:
+                self.marquer(collection)
+            else:
+                for cle in cles:
+                    self.marquer(collection, cle)
+        self.groupes_termines.extend(autre.groupes())
+
+
+def charger_collection(nom, defaut):
+    """Charger une collection depuis son fichier JSON (valeur par défaut si absent)"""
+    try:
+        with open(FICHIERS[nom], 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return defaut
+
+
+def ecrire_json(chemin, donnees, compact=False):
+    """Écrire un fichier JSON, retourne le nombre d'octets écrits
+
+    L'écriture passe par un fichier temporaire renommé ensuite, pour ne
+    jamais laisser un fichier à moitié écrit en cas d'interruption.
+    `compact` retire l'indentation et les espaces (gros fichiers techniques).
+    """
+    if compact:
+        contenu = json.dumps(donnees, separators=(',', ':'), default=en_json).encode('utf-8')
+    else:
+        contenu = json.dumps(donnees, indent=4, default=en_json).encode('utf-8')
+    temporaire = chemin + '.tmp'
+    with open(temporaire, 'wb') as f:
+        f.write(contenu)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporaire, chemin)
+    return len(contenu)
+
+
+def ecrire_collection(nom, donnees):
+    """Écrire une collection dans son fichier JSON, retourne le nombre d'octets écrits"""
+    return ecrire_json(FICHIERS[nom], donnees)
+
+
+def signature_fichier(chemin):
+    try:
+        etat = os.stat(chemin)
+        return (etat.st_mtime_ns, etat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+class VerrouFichier:
+    """Verrou exclusif entre processus, posé sur un fichier dédié"""
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self.fichier = None
+
+    def __enter__(self):
+        self.fichier = open(self.chemin, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.fichier.fileno(), fcntl.LOCK_EX)
+        else:
+            self.fichier.seek(0)
+            msvcrt.locking(self.fichier.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fichier.fileno(), fcntl.LOCK_UN)
+        else:
+            self.fichier.seek(0)
+            msvcrt.locking(self.fichier.fileno(), msvcrt.LK_UNLCK, 1)
+        self.fichier.close()
+        self.fichier = None
+
+
+def instantane(valeur):
+    """Copie indépendante (au format JSON) d'une collection ou de valeurs à écrire"""
+    return json.loads(json.dumps(valeur, default=en_json))
+
+
+def collection_vide(nom):
+    return {} if nom in COLLECTIONS_PAR_CLE else []
+
+
+def version_enregistrement(valeur):
+    """Version d'une valeur issue de valeurs_modifiees() (None si l'enregistrement n'existe pas)"""
+    if not valeur:
+        return None
+    if isinstance(valeur, list):
+        return max(enregistrement.get(CHAMP_VERSION, 0) for enregistrement in valeur)
+    return valeur.get(CHAMP_VERSION, 0)
+
+
+def valeurs_modifiees(nom, donnees, cles):
+    """Valeurs actuelles des enregistrements `cles` d'une collection
+
+    Pour une liste indexée par 'id', la valeur est la liste des
+    enregistrements portant cet identifiant (vide s'il a été supprimé),
+    dans l'ordre de la collection pour que les ajouts rejoués le gardent ;
+    sinon l'enregistrement lui-même (None s'il a été supprimé).
+    """
+    if nom in COLLECTIONS_PAR_CLE:
+        return [(cle, donnees.get(cle)) for cle in cles]
+    if nom in COLLECTIONS_PAR_ID:
+        cles = set(cles)
+        par_id = {}
+        for enregistrement in donnees:
+            if enregistrement['id'] in cles:
+                par_id.setdefault(enregistrement['id'], []).append(enregistrement)
+        return list(par_id.items()) + [(cle, []) for cle in sorted(cles - par_id.keys())]
+    return [(rang, donnees[rang] if rang < len(donnees) else None) for rang in sorted(cles)]
+
+
+def appliquer_modifications(nom, donnees, modifications):
+    """Appliquer une suite de (clé, valeur) issues de valeurs_modifiees() sur une collection"""
+    if nom in COLLECTIONS_PAR_CLE:
+        for cle, valeur in modifications:
+            if valeur is None:
+                donnees.pop(cle, None)
+            else:
+                donnees[cle] = valeur
+        return donnees
+    if nom in COLLECTIONS_PAR_ID:
+        positions = {}
+        for i, enregistrement in enumerate(donnees):
+            positions.setdefault(enregistrement['id'], []).append(i)
+        for cle, valeurs in modifications:
+            anciennes = positions.get(cle, [])
+            for position, valeur in zip(anciennes, valeurs):
+                donnees[position] = valeur
+            for position in anciennes[len(valeurs):]:
+                donnees[position] = None
+            nouvelles = []
+            for valeur in valeurs[len(anciennes):]:
+                donnees.append(valeur)
+                nouvelles.append(len(donnees) - 1)
+            positions[cle] = anciennes[:len(valeurs)] + nouvelles
+        return [enregistrement for enregistrement in donnees if enregistrement is not None]
+    for rang, valeur in modifications:
+        while len(donnees) <= rang:
+            donnees.append(None)
+        donnees[rang] = valeur
+    return [mouvement for mouvement in donnees if mouvement is not None]
+
+
+class StockageJSON:
+    """Stockage par fichiers JSON (un fichier par collection)"""
+
+    nom = "json"
+    # Les requêtes filtrent les collections en mémoire
+    requetes_sur_disque = False
+    # Même pour quelques enregistrements modifiés, le fichier est réécrit à partir de la collection en mémoire
+    ecrit_collection_entiere = True
+    chemin_verrou = "donnees.lock"
+
+    def charger(self, nom, defaut):
+        return charger_collection(nom, defaut)
+
+    def _contenu_disque(self, nom):
+        return self.charger(nom, collection_vide(nom))
+
+    def ecrire(self, nom, donnees, modifications=None, fusion=False):
+        """Écrire une collection, retourne le nombre d'octets écrits
+
+        `modifications` est la liste des (clé, valeur) modifiées, None pour
+        une réécriture complète. Avec `fusion`, elles sont appliquées au
+        contenu actuel du fichier, qui peut contenir les écritures d'un autre
+        processus, plutôt qu'au contenu en mémoire.
+        """
+        if fusion and modifications is not None:
+            donnees = appliquer_modifications(nom, self._contenu_disque(nom), modifications)
+        # Un fichier JSON se réécrit toujours en entier
+        return ecrire_collection(nom, donnees)
+
+    def lire_enregistrements(self, nom, cles):
+        """Valeurs enregistrées sur disque pour les clés données, au format de valeurs_modifiees()"""
+        return valeurs_modifiees(nom, self._contenu_disque(nom), cles)
+
+    def taille(self, nom):
+        return len(self._contenu_disque(nom))
+
+    def signature(self):
+        """Empreinte (date de modification, taille) des fichiers, pour détecter les écritures externes"""
+        return tuple(signature_fichier(chemin) for chemin in FICHIERS.values())
+
+    def rechercher_commandes(self, commandes, date_livraison=None, statuts=None, magasin_id=None, date_min=None):
+        return [cmd for cmd in commandes
+                if (date_livraison is None or cmd['date_livraison_prevue'] == date_livraison)
+                and (date_min is None or cmd['date_livraison_prevue'] >= date_min)
+                and (statuts is None or cmd['statut'] in statuts)
+                and (magasin_id is None or cmd.get('magasin_source', 'depot_central') == magasin_id)]
+
+    def compter_commandes_par_statut(self, commandes):
+        comptes = {}
+        for cmd in commandes:
+            comptes[cmd['statut']] = comptes.get(cmd['statut'], 0) + 1
+        return comptes
+
+
+def ouvrir_stockage():
+    """Ouvrir le stockage configuré par la variable d'environnement GESTION_STOCKAGE (json, sqlite ou journal)"""
+    mode = os.environ.get("GESTION_STOCKAGE", "json")
+    if mode == "sqlite":
+        from stockage_sqlite import StockageSQLite
+        return StockageSQLite(os.environ.get("GESTION_SQLITE", StockageSQLite.CHEMIN_DEFAUT))
+    if mode == "journal":
+        from stockage_journal import StockageJournal
+        return StockageJournal(seuil_compaction=int(os.environ.get("GESTION_JOURNAL_SEUIL", StockageJournal.SEUIL_DEFAUT)))
+    return StockageJSON()
+
+
+class DonneesPartagees:
+    """Données communes à toutes les sessions d'un même processus
+
+    Chaque collection est chargée une seule fois, au premier accès, et
+    partagée par référence entre les sessions ; elles sont rechargées
+    lorsque les fichiers ont été modifiés par un autre processus. `version` augmente à chaque chargement
+    et à chaque sauvegarde.
+    """
+
+    def __init__(self, stockage, defauts, modele=None):
+        self.stockage = stockage
+        self.defauts = defauts
+        # Conversion optionnelle des collections chargées (par exemple modeles.depuis_json)
+        self.modele = modele
+        self.modifications = SuiviModifications()
+        # `verrou` protège l'état en mémoire, `verrou_ecriture` les écritures sur disque
+        self.verrou = threading.RLock()
+        self.verrou_ecriture = threading.Lock()
+        self.version = 0
+        self.collections = {}
+        self.ecriture_differee = None
+        self.derniere_sauvegarde = None
+        self.conflits = []
+        # Modifications en cours d'écriture, pas encore visibles des requêtes sur disque
+        self.en_ecriture = None
+        # Commandes en mémoire par identifiant, pour les requêtes sur disque
+        self.index_commandes = None
+        self.ids_a_reindexer = set()
+        self.charger()
+
+    def __getitem__(self, nom):
+        if nom not in self.collections:
+            with self.verrou:
+                if nom not in self.collections:
+                    collection = self.stockage.charger(nom, copy.deepcopy(self.defauts[nom]))
+                    self.collections[nom] = self.modele(nom, collection) if self.modele else collection
+        return self.collections[nom]
+
+    def charger(self):
+        """(Re)partir d'un état vide : les collections seront lues à leur prochain accès"""
+        with self.verrou:
+            self.collections = {}
+            self.index_commandes = None
+            self.modifications.vider()
+            self.signature = self.stockage.signature()
+            self.version += 1
+
+    def recharger_si_modifie(self):
+        """Recharger les collections si le stockage a changé depuis le dernier chargement"""
+        # Pendant une écriture, la signature change de notre propre fait : rien à recharger
+        if not self.verrou_ecriture.acquire(blocking=False):
+            return False
+        try:
+            with self.verrou:
+                if self.modifications.est_modifie() or self.stockage.signature() == self.signature:
+                    return False
+                self.charger()
+                return True
+        finally:
+            self.verrou_ecriture.release()
+
+    def marquer(self, collection, cle=None):
+        """Marquer un enregistrement (ou une collection) à écrire
+
+        Les marques d'un même thread jusqu'à `demander_sauvegarde` forment
+        une action (celle d'une session) : en cas de conflit avec un autre
+        processus, elle est annulée en entier.
+        """
+        with self.verrou:
+            self.modifications.marquer(collection, cle, groupe=threading.get_ident())
+            if collection == "commandes":
+                if cle is None:
+                    self.index_commandes = None
+                else:
+                    self.ids_a_reindexer.add(cle)
+
+    def sauvegarder(self):
+        """Écrire immédiatement les modifications en attente, retourne {collection: octets écrits}
+
+        Les modifications sont détachées et copiées sous verrou puis écrites
+        sans bloquer les sessions ; en cas d'échec elles sont remises en attente.
+        L'écriture se fait sous un verrou de fichier partagé avec les autres
+        processus. Si l'un d'eux a écrit depuis notre chargement, chaque
+        enregistrement est comparé à sa version sur disque : en cas de
+        conflit, toute l'action qui l'a modifié est annulée, la version déjà
+        enregistrée de chacun de ses enregistrements remplaçant la nôtre en
+        mémoire (voir `_resoudre_conflits` et `conflits`). Une suppression
+        l'emporte toujours, de même qu'une réécriture complète de collection.
+        """
+        if not self.modifications.est_modifie():
+            # Rien en attente (arrêt du processus, écriture différée à vide) : pas de verrou de fichier
+            return {}
+        with self.verrou_ecriture, VerrouFichier(self.stockage.chemin_verrou):
+            with self.verrou:
+                a_ecrire, self.modifications = self.modifications, SuiviModifications()
+                self.en_ecriture = a_ecrire
+            externe = self.stockage.signature() != self.signature
+            octets_ecrits = {}
+            try:
+                with self.verrou:
+                    lots = {}
+                    for nom in a_ecrire.collections_modifiees():
+                        cles = a_ecrire.cles_modifiees(nom)
+                        lots[nom] = None if cles is None else valeurs_modifiees(nom, self.collections[nom], cles)
+                    if externe:
+                        lots = self._resoudre_conflits(lots, a_ecrire.groupes())
+                for nom, modifications in lots.items():
+                    if modifications == []:
+                        # Tout a été annulé par un conflit
+                        a_ecrire.vider(nom)
+                        continue
+                    # Les sessions modifient les collections sur place : ce qui est
+                    # écrit en est une copie, prise sous verrou
+                    with self.verrou:
+                        if modifications is None:
+                            donnees = instantane(self.collections[nom])
+                        else:
+                            self._incrementer_versions(modifications, 1)
+                            donnees = None
+                            if self.stockage.ecrit_collection_entiere and not externe:
+                                donnees = instantane(self.collections[nom])
+                        copie = None if modifications is None else instantane(modifications)
+                    try:
+                        octets_ecrits[nom] = self.stockage.ecrire(nom, donnees, copie, fusion=externe)
+                    except Exception:
+                        if modifications is not None:
+                            with self.verrou:
+                                self._incrementer_versions(modifications, -1)
+                        raise
+                    a_ecrire.vider(nom)
+            except Exception:
+                with self.verrou:
+                    self.modifications.fusionner(a_ecrire)
+                raise
+            finally:
+                with self.verrou:
+                    self.en_ecriture = None
+            if octets_ecrits:
+                with self.verrou:
+                    # Si un autre processus a écrit, la signature reste différente :
+                    # les collections seront rechargées dès qu'aucune modification n'est en attente
+                    if not externe:
+                        self.signature = self.stockage.signature()
+                    self.version += 1
+                self.derniere_sauvegarde = {
+                    "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "octets": octets_ecrits
+                }
+            return octets_ecrits
+
+    def _resoudre_conflits(self, lots, groupes):
+        """Écarter les modifications faites sur une version dépassée d'un enregistrement
+
+        `lots` associe à chaque collection ses (clé, valeur) à écrire (None
+        pour une réécriture complète). Les enregistrements d'un même groupe
+        (une action d'une session, voir `marquer`) sont écartés ensemble :
+        une livraison n'est pas enregistrée sans le statut de sa commande ni
+        son mouvement de trésorerie. Retourne les lots restant à écrire.
+        """
+        sur_disque = {nom: dict(self.stockage.lire_enregistrements(nom, [cle for cle, _ in modifications]))
+                      for nom, modifications in lots.items() if modifications}
+        en_conflit = []
+        for nom, modifications in lots.items():
+            for cle, valeur in modifications or ():
+                version = version_enregistrement(valeur)
+                version_disque = version_enregistrement(sur_disque[nom].get(cle))
+                ajout = nom == "tresorerie" and version == 0
+                if not (ajout or version is None or version_disque == version or (version_disque is None and version == 0)):
+                    en_conflit.append((nom, cle))
+        if not en_conflit:
+            rejetees = set()
+        else:
+            rejetees = set(en_conflit)
+            etendue = True
+            while etendue:
+                etendue = False
+                for groupe in groupes:
+                    if not groupe.isdisjoint(rejetees) and not groupe <= rejetees:
+                        rejetees |= groupe
+                        etendue = True
+            rejetees &= {(nom, cle) for nom, modifications in lots.items() for cle, _ in modifications or ()}
+            self.conflits.append({
+                "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "collection": en_conflit[0][0],
+                "cle": en_conflit[0][1],
+                "annulees": sorted(f"{nom} {cle}" for nom, cle in rejetees),
+            })
+            del self.conflits[:-20]
+
+        retenus = {}
+        for nom, modifications in lots.items():
+            if modifications is None:
+                retenus[nom] = None
+                continue
+            retenues, restaurees = [], []
+            prochain_rang = None
+            for cle, valeur in modifications:
+                if (nom, cle) in rejetees:
+                    restaurees.append((cle, self._depuis_disque(nom, sur_disque[nom].get(cle))))
+                elif nom == "tresorerie" and version_enregistrement(valeur) == 0 and (
+                        sur_disque[nom].get(cle) is not None or prochain_rang is not None):
+                    # Mouvements ajoutés en même temps qu'un autre processus : placés à la suite des siens
+                    if prochain_rang is None:
+                        prochain_rang = self.stockage.taille(nom)
+                    retenues.append((prochain_rang, valeur))
+                    prochain_rang += 1
+                else:
+                    retenues.append((cle, valeur))
+            if restaurees:
+                # La version déjà enregistrée remplace la nôtre en mémoire
+                collection = appliquer_modifications(nom, self.collections[nom], restaurees)
+                if nom not in COLLECTIONS_PAR_CLE:
+                    self.collections[nom][:] = collection
+                if nom == "commandes":
+                    self.ids_a_reindexer.update(cle for cle, _ in restaurees)
+            retenus[nom] = retenues
+        return retenus
+
+    def _depuis_disque(self, nom, valeur):
+        # Valeur lue sur disque, convertie comme les collections chargées
+        if self.modele is None or not valeur:
+            return valeur
+        if isinstance(valeur, list):
+            return self.modele(nom, valeur)
+        return self.modele(nom, [valeur])[0]
+
+    @staticmethod
+    def _incrementer_versions(modifications, pas):
+        for _, valeur in modifications:
+            for enregistrement in (valeur if isinstance(valeur, list) else [valeur] if valeur else []):
+                enregistrement[CHAMP_VERSION] = enregistrement.get(CHAMP_VERSION, 0) + pas
+
+    def demarrer_ecriture_differee(self, delai):
+        """Confier les sauvegardes à un thread d'arrière-plan (délai d'anti-rebond en secondes)"""
+        if self.ecriture_differee is None:
+            self.ecriture_differee = EcritureDifferee(self, delai)
+            self.ecriture_differee.start()
+        return self.ecriture_differee
+
+    def demander_sauvegarde(self):
+        """Sauvegarde différée si le thread d'écriture est actif, immédiate sinon"""
+        with self.verrou:
+            self.modifications.terminer_groupe(threading.get_ident())
+        if self.ecriture_differee is not None and self.ecriture_differee.is_alive():
+            self.ecriture_differee.demander()
+        else:
+            self.sauvegarder()
+
+    def _index_commandes(self, commandes):
+        """{id: [commande, ...]} des commandes en mémoire
+
+        Construit au premier usage, puis seuls les identifiants marqués
+        depuis (créations, remplacements, suppressions) sont recherchés
+        dans la collection.
+        """
+        if self.index_commandes is None or self.index_commandes[0] is not commandes:
+            index = {}
+            for cmd in commandes:
+                index.setdefault(cmd['id'], []).append(cmd)
+            self.index_commandes = (commandes, index)
+            self.ids_a_reindexer = set()
+        elif self.ids_a_reindexer:
+            ids, self.ids_a_reindexer = self.ids_a_reindexer, set()
+            index = self.index_commandes[1]
+            for cle in ids:
+                index.pop(cle, None)
+            for cmd in commandes:
+                if cmd['id'] in ids:
+                    index.setdefault(cmd['id'], []).append(cmd)
+        return self.index_commandes[1]
+
+    def _commandes_en_attente(self):
+        # Identifiants des commandes pas encore écrites (None si toute la collection est à réécrire)
+        en_attente = set()
+        for suivi in (self.modifications, self.en_ecriture):
+            if suivi is not None and suivi.est_modifie("commandes"):
+                cles = suivi.cles_modifiees("commandes")
+                if cles is None:
+                    return None
+                en_attente |= cles
+        return en_attente
+
+    def _requete_commandes(self, requete, **filtres):
+        commandes = self["commandes"]
+        if not self.stockage.requetes_sur_disque:
+            return requete(commandes, **filtres)
+        # Requête sur disque : les commandes modifiées pas encore écrites sont
+        # reprises de la mémoire, sans forcer l'écriture différée
+        with self.verrou:
+            en_attente = self._commandes_en_attente()
+            index = None if en_attente is None else self._index_commandes(commandes)
+            return requete(commandes, **filtres, index=index, en_attente=en_attente or ())
+
+    def rechercher_commandes(self, **filtres):
+        return self._requete_commandes(self.stockage.rechercher_commandes, **filtres)
+
+    def compter_commandes_par_statut(self):
+        return self._requete_commandes(self.stockage.compter_commandes_par_statut)
+
+
+class EcritureDifferee(threading.Thread):
+    """Thread d'arrière-plan qui regroupe les demandes de sauvegarde
+
+    Une demande déclenche une écriture après `delai` secondes, ce qui
+    regroupe les clics rapprochés en une seule écriture. Les modifications
+    en attente sont écrites à l'arrêt du processus.
+    """
+
+    def __init__(self, donnees, delai=2.0):
+        super().__init__(name="ecriture-differee", daemon=True)
+        self.donnees = donnees
+        self.delai = delai
+        self.demande = threading.Event()
+        self.arret = threading.Event()
+        self.derniere_erreur = None
+        atexit.register(self.arreter)
+
+    def demander(self):
+        self.demande.set()
+
+    def run(self):
+        while not self.arret.is_set():
+            self.demande.wait()
+            # Anti-rebond : attendre que les modifications rapprochées s'accumulent
+            self.arret.wait(self.delai)
+            self.demande.clear()
+            try:
+                self.donnees.sauvegarder()
+                self.derniere_erreur = None
+            except Exception as e:
+                # Les modifications restent en attente : nouvel essai au prochain cycle
+                self.derniere_erreur = f"{datetime.now().strftime('%H:%M:%S')} - {e}"
+                self.demande.set()
+                self.arret.wait(self.delai)
+
+    def arreter(self, timeout=10):
+        """Arrêter le thread et écrire les dernières modifications"""
+        self.arret.set()
+        self.demande.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.donnees.sauvegarder()
@@ -0,0 +1,114 @@
+import copy
+import json
+import os
+from datetime import datetime
+
+from modeles import en_json
+from stockage import FICHIERS, StockageJSON, appliquer_modifications, charger_collection, collection_vide, ecrire_collection, signature_fichier
+
+
+class StockageJournal(StockageJSON):
+    """Stockage en journal d'événements au-dessus des instantanés JSON
+
+    Chaque enregistrement modifié (création, changement de statut,
+    suppression) ajoute une ligne au journal au lieu de réécrire sa
+    collection. Au démarrage, le journal est rejoué sur le dernier
+    instantané ; au-delà de `seuil_compaction` octets, il est replié dans
+    de nouveaux instantanés puis vidé. Rejouer un événement est idempotent,
+    une compaction interrompue peut donc être reprise sans perte.
+    """
+
+    nom = "journal"
+    CHEMIN_JOURNAL = "journal.jsonl"
+    SEUIL_DEFAUT = 5 * 1024 * 1024
+    # Seuls les enregistrements modifiés sont ajoutés au journal
+    ecrit_collection_entiere = False
+
+    def __init__(self, chemin_journal=CHEMIN_JOURNAL, seuil_compaction=SEUIL_DEFAUT):
+        self.chemin_journal = chemin_journal
+        self.seuil_compaction = seuil_compaction
+        self.defauts = {}
+        # Dernière lecture du journal : (signature du stockage, {collection: événements},
+        # collections déjà rejouées)
+        self.lecture = None
+
+    def lire_journal(self):
+        """Événements du journal, dans l'ordre d'écriture"""
+        evenements = []
+        try:
+            with open(self.chemin_journal, 'r') as f:
+                for ligne in f:
+                    try:
+                        evenements.append(json.loads(ligne))
+                    except json.JSONDecodeError:
+                        # Dernière ligne tronquée par un arrêt brutal : ignorée
+                        break
+        except FileNotFoundError:
+            pass
+        return evenements
+
+    @staticmethod
+    def par_collection(evenements):
+        """Événements regroupés par collection, dans l'ordre d'écriture"""
+        groupes = {}
+        for evt in evenements:
+            groupes.setdefault(evt['collection'], []).append(evt)
+        return groupes
+
+    def charger(self, nom, defaut):
+        """Instantané de la collection et ses événements rejoués
+
+        Le journal est lu une seule fois pour toutes les collections
+        chargées tant que le stockage ne change pas : chaque collection
+        prend ses événements (qui deviennent ses enregistrements) et les
+        retire de la lecture. Une collection rechargée relit le journal.
+        """
+        self.defauts[nom] = copy.deepcopy(defaut)
+        signature = self.signature()
+        if self.lecture is None or self.lecture[0] != signature or nom in self.lecture[2]:
+            self.lecture = (signature, self.par_collection(self.lire_journal()), set())
+        self.lecture[2].add(nom)
+        return self._rejouer(nom, self.lecture[1].pop(nom, []))
+
+    def _rejouer(self, nom, evenements):
+        donnees = charger_collection(nom, copy.deepcopy(self.defauts.get(nom, collection_vide(nom))))
+        return appliquer_modifications(nom, donnees, [(evt['cle'], evt['valeur']) for evt in evenements])
+
+    def _contenu_disque(self, nom):
+        return self._rejouer(nom, self.par_collection(self.lire_journal()).get(nom, []))
+
+    def ecrire(self, nom, donnees, modifications=None, fusion=False):
+        if modifications is None:
+            # Réécriture complète : on passe directement par l'instantané
+            self.compacter()
+            return ecrire_collection(nom, donnees)
+        # Les événements ne portent que sur les enregistrements modifiés :
+        # ceux des autres processus sont préservés sans fusion particulière
+        date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        lignes = "".join(
+            json.dumps({"date": date, "collection": nom, "cle": cle, "valeur": valeur}, default=en_json) + "\n"
+            for cle, valeur in modifications
+        ).encode('utf-8')
+        with open(self.chemin_journal, 'ab') as f:
+            f.write(lignes)
+            f.flush()
+            os.fsync(f.fileno())
+            taille = f.tell()
+        if taille > self.seuil_compaction:
+            self.compacter()
+        return len(lignes)
+
+    def signature(self):
+        return super().signature() + (signature_fichier(self.chemin_journal),)
+
+    def compacter(self):
+        """Replier le journal dans de nouveaux instantanés puis le vider"""
+        evenements = self.lire_journal()
+        if not evenements:
+            return
+        groupes = self.par_collection(evenements)
+        instantanes = {nom: self._rejouer(nom, groupes[nom]) for nom in FICHIERS if nom in groupes}
+        for nom, donnees in instantanes.items():
+            ecrire_collection(nom, donnees)
+        with open(self.chemin_journal, 'wb') as f:
+            os.fsync(f.fileno())
@@ -0,0 +1,346 @@
+import json
+import sqlite3
+import sys
+import threading
+
+from modeles import en_json
+from stockage import COLLECTIONS_PAR_CLE, FICHIERS, StockageJSON, charger_collection, signature_fichier
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    cle TEXT PRIMARY KEY,
+    valeur TEXT
+);
+CREATE TABLE IF NOT EXISTS magasins_source (
+    id TEXT PRIMARY KEY,
+    donnees TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clients (
+    id TEXT PRIMARY KEY,
+    nom TEXT,
+    telephone TEXT,
+    solde REAL,
+    donnees TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commandes (
+    num INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    client_id TEXT,
+    date_commande TEXT,
+    date_livraison_prevue TEXT,
+    statut TEXT,
+    magasin_source TEXT,
+    total_commande REAL,
+    cout_achat REAL,
+    donnees TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lignes_commande (
+    commande_num INTEGER NOT NULL,
+    rang INTEGER NOT NULL,
+    type_viande TEXT,
+    morceau TEXT,
+    quantite INTEGER,
+    prix_vente REAL,
+    prix_achat REAL,
+    quantite_livree INTEGER,
+    PRIMARY KEY (commande_num, rang)
+);
+CREATE TABLE IF NOT EXISTS livraisons (
+    num INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    commande_id TEXT,
+    client_id TEXT,
+    date_livraison TEXT,
+    statut TEXT,
+    montant_paye REAL,
+    donnees TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tresorerie (
+    rang INTEGER PRIMARY KEY,
+    date TEXT,
+    type TEXT,
+    montant REAL,
+    client_id TEXT,
+    commande_id TEXT,
+    donnees TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_commandes_id ON commandes(id);
+CREATE INDEX IF NOT EXISTS idx_commandes_date_statut ON commandes(date_livraison_prevue, statut);
+CREATE INDEX IF NOT EXISTS idx_commandes_statut ON commandes(statut);
+CREATE INDEX IF NOT EXISTS idx_commandes_client ON commandes(client_id);
+CREATE INDEX IF NOT EXISTS idx_commandes_magasin ON commandes(magasin_source, date_livraison_prevue);
+CREATE INDEX IF NOT EXISTS idx_livraisons_id ON livraisons(id);
+CREATE INDEX IF NOT EXISTS idx_livraisons_commande ON livraisons(commande_id);
+CREATE INDEX IF NOT EXISTS idx_tresorerie_date ON tresorerie(date);
+"""
+
+# Champs d'une ligne de commande stockés dans lignes_commande
+CHAMPS_LIGNE = ["type_viande", "morceau", "quantite", "prix_vente", "prix_achat", "quantite_livree"]
+
+
+class StockageSQLite:
+    """Stockage dans une base SQLite locale avec tables indexées
+
+    Les collections restent manipulées en mémoire sous leur forme JSON ;
+    seuls les enregistrements marqués comme modifiés sont réécrits. Les
+    filtres des pages sélectionnent les commandes par une requête SQL
+    indexée, les résultats étant les enregistrements en mémoire retrouvés
+    par identifiant (voir `rechercher_commandes`).
+    """
+
+    nom = "sqlite"
+    CHEMIN_DEFAUT = "gestion_livraisons.db"
+    # Les requêtes interrogent la base : les modifications doivent y être écrites avant
+    requetes_sur_disque = True
+    # Seules les lignes modifiées sont écrites
+    ecrit_collection_entiere = False
+
+    def __init__(self, chemin=CHEMIN_DEFAUT):
+        self.chemin = chemin
+        self.chemin_verrou = chemin + ".lock"
+        # Connexion partagée entre les threads des sessions et celui d'écriture
+        self.connexion = sqlite3.connect(chemin, check_same_thread=False)
+        self.verrou = threading.RLock()
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        self.connexion.executescript(SCHEMA)
+        if self._meta("migration_json") is None:
+            self.migrer_depuis_json()
+
+    def _meta(self, cle):
+        ligne = self.connexion.execute("SELECT valeur FROM meta WHERE cle = ?", (cle,)).fetchone()
+        return ligne[0] if ligne else None
+
+    def migrer_depuis_json(self):
+        """Migration unique des fichiers JSON existants vers la base"""
+        with self.verrou, self.connexion:
+            for nom in FICHIERS:
+                donnees = charger_collection(nom, None)
+                if donnees is not None:
+                    self._reecrire(nom, donnees)
+            self.connexion.execute("INSERT OR REPLACE INTO meta (cle, valeur) VALUES ('migration_json', datetime('now'))")
+
+    # Chargement
+
+    def charger(self, nom, defaut):
+        with self.verrou:
+            return self._charger(nom, defaut)
+
+    def _charger(self, nom, defaut):
+        if nom in COLLECTIONS_PAR_CLE:
+            lignes = self.connexion.execute(f"SELECT id, donnees FROM {nom} ORDER BY rowid").fetchall()
+            return {cle: json.loads(donnees) for cle, donnees in lignes} if lignes else defaut
+        if nom == "commandes":
+            return self._charger_commandes() or defaut
+        if nom == "livraisons":
+            lignes = self.connexion.execute("SELECT donnees FROM livraisons ORDER BY num").fetchall()
+        else:
+            lignes = self.connexion.execute("SELECT donnees FROM tresorerie ORDER BY rang").fetchall()
+        return [json.loads(donnees) for (donnees,) in lignes] or defaut
+
+    def _charger_commandes(self, ids=None):
+        filtre, parametres = "", ()
+        if ids is not None:
+            filtre = f" WHERE id IN ({', '.join('?' * len(ids))})"
+            parametres = tuple(ids)
+        produits = {}
+        for ligne in self.connexion.execute(
+                f"SELECT commande_num, {', '.join(CHAMPS_LIGNE)} FROM lignes_commande "
+                f"WHERE commande_num IN (SELECT num FROM commandes{filtre}) ORDER BY commande_num, rang", parametres):
+            produit = {champ: valeur for champ, valeur in zip(CHAMPS_LIGNE, ligne[1:]) if valeur is not None}
+            produits.setdefault(ligne[0], []).append(produit)
+        commandes = []
+        for num, donnees in self.connexion.execute(f"SELECT num, donnees FROM commandes{filtre} ORDER BY num", parametres):
+            commande = json.loads(donnees)
+            commande['produits'] = produits.get(num, [])
+            commandes.append(commande)
+        return commandes
+
+    def lire_enregistrements(self, nom, cles):
+        """Valeurs enregistrées pour les clés données, au format de valeurs_modifiees()"""
+        cles = list(cles)
+        marques = ', '.join('?' * len(cles))
+        with self.verrou:
+            if nom in COLLECTIONS_PAR_CLE:
+                lignes = dict(self.connexion.execute(f"SELECT id, donnees FROM {nom} WHERE id IN ({marques})", cles))
+                return [(cle, json.loads(lignes[cle]) if cle in lignes else None) for cle in cles]
+            if nom == "tresorerie":
+                lignes = dict(self.connexion.execute(f"SELECT rang, donnees FROM tresorerie WHERE rang IN ({marques})", cles))
+                return [(rang, json.loads(lignes[rang]) if rang in lignes else None) for rang in cles]
+            if nom == "commandes":
+                enregistrements = self._charger_commandes(cles)
+            else:
+                enregistrements = [json.loads(donnees) for (donnees,) in self.connexion.execute(
+                    f"SELECT donnees FROM livraisons WHERE id IN ({marques}) ORDER BY num", cles)]
+        par_id = {cle: [] for cle in cles}
+        for enregistrement in enregistrements:
+            par_id[enregistrement['id']].append(enregistrement)
+        return list(par_id.items())
+
+    def taille(self, nom):
+        with self.verrou:
+            if nom == "tresorerie":
+                return self.connexion.execute("SELECT COALESCE(MAX(rang) + 1, 0) FROM tresorerie").fetchone()[0]
+            return self.connexion.execute(f"SELECT COUNT(*) FROM {nom}").fetchone()[0]
+
+    # Écriture
+
+    def ecrire(self, nom, donnees, modifications=None, fusion=False):
+        """Écrire les (clé, valeur) modifiées, ou toute la collection si `modifications` vaut None
+
+        Une valeur absente correspond à une suppression. Seules les lignes
+        concernées sont touchées, la fusion avec les écritures d'autres
+        processus est donc implicite. Retourne le nombre d'octets sérialisés écrits.
+        """
+        with self.verrou, self.connexion:
+            if modifications is None:
+                return self._reecrire(nom, donnees)
+            if nom in COLLECTIONS_PAR_CLE:
+                return sum(self._ecrire_cle(nom, cle, valeur) for cle, valeur in modifications)
+            if nom == "tresorerie":
+                return sum(self._ecrire_mouvement(rang, valeur) for rang, valeur in modifications)
+            return sum(self._ecrire_id(nom, cle, valeurs) for cle, valeurs in modifications)
+
+    def _reecrire(self, nom, donnees):
+        if nom == "commandes":
+            self.connexion.execute("DELETE FROM lignes_commande")
+        self.connexion.execute(f"DELETE FROM {nom}")
+        if nom in COLLECTIONS_PAR_CLE:
+            return sum(self._ecrire_cle(nom, cle, enregistrement) for cle, enregistrement in donnees.items())
+        if nom == "tresorerie":
+            return sum(self._ecrire_mouvement(rang, mouvement) for rang, mouvement in enumerate(donnees))
+        return sum(self._inserer(nom, enregistrement) for enregistrement in donnees)
+
+    def _ecrire_cle(self, nom, cle, enregistrement):
+        if enregistrement is None:
+            self.connexion.execute(f"DELETE FROM {nom} WHERE id = ?", (cle,))
+            return 0
+        donnees = json.dumps(enregistrement, default=en_json)
+        if nom == "clients":
+            self.connexion.execute(
+                "INSERT INTO clients (id, nom, telephone, solde, donnees) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET nom = excluded.nom, telephone = excluded.telephone, "
+                "solde = excluded.solde, donnees = excluded.donnees",
+                (cle, enregistrement.get('nom'), enregistrement.get('telephone'), enregistrement.get('solde'), donnees))
+        else:
+            self.connexion.execute(
+                "INSERT INTO magasins_source (id, donnees) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET donnees = excluded.donnees",
+                (cle, donnees))
+        return len(donnees)
+
+    def _ecrire_mouvement(self, rang, mouvement):
+        if mouvement is None:
+            self.connexion.execute("DELETE FROM tresorerie WHERE rang = ?", (rang,))
+            return 0
+        donnees = json.dumps(mouvement, default=en_json)
+        self.connexion.execute(
+            "INSERT OR REPLACE INTO tresorerie (rang, date, type, montant, client_id, commande_id, donnees) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (rang, mouvement.get('date'), mouvement.get('type'), mouvement.get('montant'),
+             mouvement.get('client_id'), mouvement.get('commande_id'), donnees))
+        return len(donnees)
+
+    def _ecrire_id(self, nom, cle, enregistrements):
+        """Aligner les lignes portant l'identifiant `cle` sur les enregistrements en mémoire"""
+        nums = [num for (num,) in self.connexion.execute(f"SELECT num FROM {nom} WHERE id = ? ORDER BY num", (cle,))]
+        octets = 0
+        for num, enregistrement in zip(nums, enregistrements):
+            octets += self._inserer(nom, enregistrement, num)
+        for enregistrement in enregistrements[len(nums):]:
+            octets += self._inserer(nom, enregistrement)
+        for num in nums[len(enregistrements):]:
+            self.connexion.execute(f"DELETE FROM {nom} WHERE num = ?", (num,))
+            if nom == "commandes":
+                self.connexion.execute("DELETE FROM lignes_commande WHERE commande_num = ?", (num,))
+        return octets
+
+    def _inserer(self, nom, enregistrement, num=None):
+        if nom == "livraisons":
+            donnees = json.dumps(enregistrement, default=en_json)
+            self.connexion.execute(
+                "INSERT OR REPLACE INTO livraisons (num, id, commande_id, client_id, date_livraison, statut, montant_paye, donnees) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (num, enregistrement['id'], enregistrement.get('commande_id'), enregistrement.get('client_id'),
+                 enregistrement.get('date_livraison'), enregistrement.get('statut'),
+                 enregistrement.get('montant_paye'), donnees))
+            return len(donnees)
+
+        entete = {champ: valeur for champ, valeur in enregistrement.items() if champ != 'produits'}
+        donnees = json.dumps(entete, default=en_json)
+        curseur = self.connexion.execute(
+            "INSERT OR REPLACE INTO commandes (num, id, client_id, date_commande, date_livraison_prevue, statut, "
+            "magasin_source, total_commande, cout_achat, donnees) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (num, enregistrement['id'], enregistrement.get('client_id'), enregistrement.get('date_commande'),
+             enregistrement.get('date_livraison_prevue'), enregistrement.get('statut'),
+             enregistrement.get('magasin_source', 'depot_central'), enregistrement.get('total_commande'),
+             enregistrement.get('cout_achat'), donnees))
+        num = curseur.lastrowid if num is None else num
+        self.connexion.execute("DELETE FROM lignes_commande WHERE commande_num = ?", (num,))
+        lignes = [(num, rang) + tuple(produit.get(champ) for champ in CHAMPS_LIGNE)
+                  for rang, produit in enumerate(enregistrement.get('produits', []))]
+        self.connexion.executemany(
+            f"INSERT INTO lignes_commande (commande_num, rang, {', '.join(CHAMPS_LIGNE)}) "
+            f"VALUES ({', '.join('?' * (len(CHAMPS_LIGNE) + 2))})",
+            lignes)
+        return len(donnees) + len(json.dumps(enregistrement.get('produits', []), default=en_json))
+
+    def signature(self):
+        return (signature_fichier(self.chemin), signature_fichier(self.chemin + "-wal"))
+
+    # Requêtes
+
+    def rechercher_commandes(self, commandes, date_livraison=None, statuts=None, magasin_id=None, date_min=None,
+                             index=None, en_attente=()):
+        """Commandes en mémoire correspondant aux filtres
+
+        Les pages modifient les commandes retournées : ce sont celles de
+        `commandes`, retrouvées dans `index` ({id: [commande, ...]}, tenu à
+        jour par DonneesPartagees). La requête donne les identifiants des
+        commandes écrites ; celles `en_attente` d'écriture, dont la base n'a
+        pas la dernière version, sont filtrées en mémoire. Sans `index`,
+        toute la collection est filtrée en mémoire.
+        """
+        if index is None:
+            return StockageJSON().rechercher_commandes(commandes, date_livraison, statuts, magasin_id, date_min)
+        conditions, parametres = [], []
+        if date_livraison is not None:
+            conditions.append("date_livraison_prevue = ?")
+            parametres.append(date_livraison)
+        if date_min is not None:
+            conditions.append("date_livraison_prevue >= ?")
+            parametres.append(date_min)
+        if statuts is not None:
+            conditions.append(f"statut IN ({', '.join('?' * len(statuts))})")
+            parametres.extend(statuts)
+        if magasin_id is not None:
+            conditions.append("magasin_source = ?")
+            parametres.append(magasin_id)
+        requete = "SELECT DISTINCT id FROM commandes"
+        if conditions:
+            requete += " WHERE " + " AND ".join(conditions)
+        with self.verrou:
+            ids = [cle for (cle,) in self.connexion.execute(requete + " ORDER BY num", parametres)]
+        candidats = [cmd for cle in ids if cle not in en_attente for cmd in index.get(cle, ())]
+        candidats += [cmd for cle in sorted(en_attente) for cmd in index.get(cle, ())]
+        # Identifiants dupliqués et commandes en attente : filtres revérifiés sur les seuls candidats
+        return StockageJSON().rechercher_commandes(candidats, date_livraison, statuts, magasin_id, date_min)
+
+    def compter_commandes_par_statut(self, commandes, index=None, en_attente=()):
+        if index is None:
+            return StockageJSON().compter_commandes_par_statut(commandes)
+        exclus = sorted(en_attente)
+        with self.verrou:
+            comptes = dict(self.connexion.execute(
+                f"SELECT statut, COUNT(*) FROM commandes WHERE id NOT IN ({', '.join('?' * len(exclus))}) "
+                "GROUP BY statut", exclus))
+        for cle in exclus:
+            for cmd in index.get(cle, ()):
+                comptes[cmd['statut']] = comptes.get(cmd['statut'], 0) + 1
+        return comptes
+
+if __name__ == "__main__":
+    # Migration manuelle : python stockage_sqlite.py [chemin.db]
+    stockage = StockageSQLite(sys.argv[1] if len(sys.argv) > 1 else StockageSQLite.CHEMIN_DEFAUT)
+    stockage.migrer_depuis_json()
+    for nom in FICHIERS:
+        print(f"{nom}: {len(stockage.charger(nom, []))} enregistrements migrés")
@@ -0,0 +1,90 @@
+import copy
+from datetime import date
+
+import pytest
+
+import archives
+from archives import archiver, avec_archives, cle_mouvement, compter_archives_par_statut, partitions, sans_doublons
+from stockage import DonneesPartagees, StockageJSON
+
+DEFAUTS = {"magasins_source": {}, "clients": {}, "commandes": [], "livraisons": [], "tresorerie": []}
+AUJOURD_HUI = date.today().isoformat()
+
+
+@pytest.fixture
+def donnees(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Le cache des partitions est indexé par chemin relatif
+    archives._lire_partition.cache_clear()
+    donnees = DonneesPartagees(StockageJSON(), DEFAUTS)
+    donnees["commandes"].extend([
+        {"id": "CMD1", "statut": "livree", "date_commande": "2020-01-28", "date_livraison_reelle": "2020-02-03"},
+        {"id": "CMD2", "statut": "en_cours", "date_commande": "2020-01-05"},
+        {"id": "CMD3", "statut": "annulee", "date_commande": "2020-01-20"},
+        {"id": "CMD4", "statut": "livree", "date_commande": AUJOURD_HUI, "date_livraison_reelle": AUJOURD_HUI},
+    ])
+    donnees["livraisons"].extend([
+        {"id": "LIV1", "commande_id": "CMD1", "date_livraison": "2020-02-03"},
+        {"id": "LIV4", "commande_id": "CMD4", "date_livraison": AUJOURD_HUI},
+    ])
+    # Deux encaissements identiques le même jour : deux mouvements distincts
+    encaissement = {"date": "2020-02-03", "type": "encaissement", "montant": 10, "commande_id": "CMD1"}
+    donnees["tresorerie"].extend([dict(encaissement), dict(encaissement),
+                                  {"date": AUJOURD_HUI, "type": "encaissement", "montant": 5, "commande_id": "CMD4"}])
+    for nom in ("commandes", "livraisons"):
+        for e in donnees[nom]:
+            donnees.marquer(nom, e['id'])
+    for position in range(3):
+        donnees.marquer("tresorerie", position)
+    donnees.sauvegarder()
+    return donnees
+
+
+def ids(enregistrements):
+    return sorted(e['id'] for e in enregistrements)
+
+
+def test_archivage_par_mois(donnees):
+    originaux = {nom: copy.deepcopy(donnees[nom]) for nom in archives.COLLECTIONS_ARCHIVEES}
+    assert archiver(donnees) == {"commandes": 2, "livraisons": 1, "tresorerie": 2}
+    assert partitions("commandes") == ["2020-01", "2020-02"]
+    assert partitions("livraisons") == partitions("tresorerie") == ["2020-02"]
+    assert ids(archives.lire_partition("commandes", "2020-01")) == ["CMD3"]
+    assert compter_archives_par_statut() == {"livree": 1, "annulee": 1}
+
+    # Les données en ligne, relues du disque, ne gardent que le récent et l'en cours
+    relues = DonneesPartagees(StockageJSON(), DEFAUTS)
+    assert ids(relues["commandes"]) == ["CMD2", "CMD4"]
+    assert ids(relues["livraisons"]) == ["LIV4"]
+    assert [m['date'] for m in relues["tresorerie"]] == [AUJOURD_HUI]
+
+    # En ligne et archives réunies redonnent l'ensemble de départ
+    for nom, tous in originaux.items():
+        reunis = avec_archives(nom, relues[nom])
+        assert sorted(map(cle_mouvement, reunis)) == sorted(map(cle_mouvement, tous))
+    # Seules les partitions de la période sont lues
+    assert ids(avec_archives("commandes", [], date(2020, 2, 1), date(2020, 2, 29))) == ["CMD1"]
+    assert avec_archives("commandes", [], date(2021, 1, 1)) == []
+
+
+def test_archivage_interrompu_sans_doublons(donnees):
+    en_ligne = {nom: copy.deepcopy(donnees[nom]) for nom in archives.COLLECTIONS_ARCHIVEES}
+    archiver(donnees)
+    # Les partitions ont été écrites mais pas les données en ligne : on recommence
+    for nom, enregistrements in en_ligne.items():
+        donnees[nom][:] = enregistrements
+    assert archiver(donnees) == {"commandes": 2, "livraisons": 1, "tresorerie": 2}
+    assert len(archives.lire_partition("tresorerie", "2020-02")) == 2
+    assert archives.lire_index()["tresorerie"] == {"2020-02": {"nombre": 2}}
+    assert len(avec_archives("tresorerie", en_ligne["tresorerie"])) == 3
+
+
+def test_tresorerie_comparee_en_multiensemble():
+    a = {"date": "2020-02-03", "type": "encaissement", "montant": 10, "commande_id": "CMD1"}
+    b = dict(a, montant=12)
+    assert cle_mouvement(dict(a)) == cle_mouvement(a) != cle_mouvement(b)
+    assert cle_mouvement(dict(a, id="MVT1")) == "MVT1"
+    # Un mouvement déjà présent n'en retire qu'un seul identique
+    assert sans_doublons("tresorerie", [a, dict(a), b], [dict(a)]) == [a, b]
+    assert sans_doublons("tresorerie", [a, dict(a)], [a, a, a]) == []
+    assert sans_doublons("livraisons", [{"id": "L1"}, {"id": "L2"}], [{"id": "L1"}]) == [{"id": "L2"}]
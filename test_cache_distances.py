@@ -0,0 +1,49 @@
+from cache_distances import CacheDistances, cle_position
+
+A, B, C, D = (31.60, -7.97), (31.61, -7.98), (31.62, -7.99), (31.63, -8.00)
+
+
+def test_eviction_lru(tmp_path):
+    cache = CacheDistances(str(tmp_path / "distances.json"), capacite=3)
+    cache.ajouter("route", A, B, 1)
+    cache.ajouter("route", A, C, 2)
+    cache.ajouter("route", B, C, 3)
+    # Une lecture rend la paire la plus récente : A-C est alors la plus ancienne
+    assert cache.lire("route", B, A) == 1
+    cache.ajouter("route", C, D, 4)
+    assert len(cache) == 3
+    assert cache.lire("route", A, C) is None
+    assert [cache.lire("route", *paire) for paire in ((A, B), (B, C), (C, D))] == [1, 3, 4]
+    assert cache.lire("geodesique", A, B) is None
+    assert (cache.succes, cache.echecs) == (4, 2)
+    # Les paires retirées sont aussi retirées de l'index par position
+    assert cache.paires_par_position[cle_position(A)] == {"route|" + "|".join(sorted(map(cle_position, (A, B))))}
+
+
+def test_invalider(tmp_path):
+    chemin = str(tmp_path / "distances.json")
+    cache = CacheDistances(chemin)
+    cache.ajouter("route", A, B, 1)
+    cache.ajouter("geodesique", B, A, 1.1)
+    cache.ajouter("route", B, C, 2)
+    cache.ajouter("route", C, D, 3)
+    assert cache.enregistrer() == 4
+
+    # Un autre processus a calculé une distance depuis B entre-temps
+    autre = CacheDistances(chemin)
+    autre.ajouter("route", B, D, 5)
+    autre.enregistrer()
+
+    cache.invalider(B)
+    assert len(cache) == 1 and cache.lire("route", C, D) == 3
+    assert cache.lire("route", A, B) is None and cache.lire("geodesique", A, B) is None
+    assert cle_position(B) not in cache.paires_par_position
+    cache.invalider(None)
+    # La fusion avec le fichier n'y reprend pas les paires de la position invalidée
+    assert cache.enregistrer() == 1
+    relu = CacheDistances(chemin)
+    assert len(relu) == 1 and relu.lire("route", D, C) == 3
+    assert set(relu.paires_par_position) == {cle_position(C), cle_position(D)}
+    # Une nouvelle distance depuis la position déplacée est de nouveau en cache
+    relu.ajouter("route", B, C, 2.5)
+    assert relu.lire("route", C, B) == 2.5
@@ -0,0 +1,78 @@
+import numpy as np
+
+import itineraire as routage
+from horaires import Calendrier, Contraintes, minutes
+
+INF = float("inf")
+
+
+def points_alignes():
+    # Maison (0) puis quatre clients à 5, 10, 15 et 20 km sur une même route
+    x = np.array([0, 5, 10, 15, 20], dtype=float)
+    return np.abs(x[:, None] - x[None, :])
+
+
+def test_minutes():
+    assert minutes("08:30") == 510
+    assert minutes("") is None and minutes(None) is None
+
+
+def test_attente_et_retard():
+    matrice = points_alignes()
+    contraintes = Contraintes([-INF, 520, -INF, -INF, -INF], [INF, INF, INF, INF, 500], [0, 10, 10, 10, 10],
+                              depart=minutes("08:00"))
+    horaires = contraintes.horaires([0, 1, 2, 3, 4, 0], matrice.tolist())
+    # 5 km à 30 km/h : arrivée à 8 h 10, attente jusqu'à l'ouverture à 8 h 40
+    assert horaires[1]["arrivee"] == 490 and horaires[1]["attente"] == 30
+    assert horaires[4]["retard"] > 0
+    assert sum(h["retard"] for h in horaires) == contraintes.retard_total([0, 1, 2, 3, 4, 0], matrice.tolist())
+
+
+def test_fenetres_respectees_quand_c_est_possible():
+    matrice = points_alignes()
+    # Le client le plus éloigné doit être livré avant 9 h : l'ordre le plus court le ferait attendre
+    contraintes = Contraintes([-INF] * 5, [INF, INF, INF, INF, minutes("09:00")], [0, 10, 10, 10, 10],
+                              depart=minutes("08:00"))
+    plus_courte = [0, 1, 2, 3, 4, 0]
+    assert contraintes.retard_total(plus_courte, matrice.tolist()) > 0
+    tournee = routage.respecter_fenetres(plus_courte, matrice, contraintes, budget=1)
+    assert contraintes.retard_total(tournee, matrice.tolist()) == 0
+    assert sorted(tournee[1:-1]) == [1, 2, 3, 4] and tournee[0] == tournee[-1] == 0
+
+
+def test_cinquante_arrets_tous_dans_leur_fenetre():
+    for graine in range(5):
+        rng = np.random.default_rng(graine)
+        matrice = routage.matrice_distances(np.column_stack([31.45 + 0.25 * rng.random(51), -8.10 + 0.25 * rng.random(51)]))
+        distances = matrice.tolist()
+        services = [0] + [10] * 50
+        # Une tournée courte existe qui respecte toutes les fenêtres : un client sur deux doit être
+        # livré à une demi-heure près de son heure de passage sur cette tournée
+        reference = routage.ameliorer_tournee(routage.plus_proche_voisin(matrice), matrice, budget=1)
+        passages = Contraintes([-INF] * 51, [INF] * 51, services, minutes("08:00")).horaires(reference, distances)
+        ouvertures, fermetures = [-INF] * 51, [INF] * 51
+        for rang in range(1, 51, 2):
+            ouvertures[reference[rang]] = passages[rang]["arrivee"] - 30
+            fermetures[reference[rang]] = passages[rang]["arrivee"] + 30
+        contraintes = Contraintes(ouvertures, fermetures, services, minutes("08:00"))
+        for depart in (reference[::-1], routage.plus_proche_voisin(matrice)):
+            assert contraintes.retard_total(depart, distances) > 0
+            tournee = routage.respecter_fenetres(depart, matrice, contraintes, budget=5)
+            assert sorted(tournee[1:-1]) == list(range(1, 51)) and tournee[0] == tournee[-1] == 0
+            for point, horaire in zip(tournee, contraintes.horaires(tournee, distances)):
+                debut_service = horaire["arrivee"] + horaire["attente"]
+                assert ouvertures[point] <= debut_service <= fermetures[point]
+
+
+def test_calendrier_incremental_comme_un_calcul_complet():
+    rng = np.random.default_rng(0)
+    matrice = routage.matrice_distances(31.5 + 0.2 * rng.random((30, 2))).tolist()
+    ouvertures = [-INF] + (480 + 240 * rng.random(29)).tolist()
+    contraintes = Contraintes(ouvertures, [INF] + [o + 60 for o in ouvertures[1:]], [0] + [10] * 29, minutes("08:00"))
+    tournee = [0] + list(range(1, 30)) + [0]
+    calendrier = Calendrier(contraintes, tournee, matrice)
+    assert calendrier.retard == contraintes.retard_total(tournee, matrice)
+    for _ in range(200):
+        i, j = sorted(rng.choice(np.arange(1, 30), size=2, replace=False).tolist())
+        candidat = tournee[:i] + tournee[i:j + 1][::-1] + tournee[j + 1:]
+        assert abs(calendrier.retard_candidat(candidat, i, j) - contraintes.retard_total(candidat, matrice)) < 1e-6
@@ -0,0 +1,50 @@
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import identifiants
+from identifiants import AllocateurIdentifiants
+
+
+def reserver_dans_un_processus(chemin, prefixe):
+    allocateur = AllocateurIdentifiants(chemin)
+    return [allocateur.suivant(prefixe) for _ in range(30)] + allocateur.reserver(prefixe, 20)
+
+
+def test_format_et_ordre(tmp_path):
+    allocateur = AllocateurIdentifiants(str(tmp_path / "identifiants.json"))
+    avant = datetime.now().strftime('%Y%m%d%H%M%S')
+    premiers = [allocateur.suivant("CMD") for _ in range(5)] + allocateur.reserver("CMD", 3)
+    assert all(re.fullmatch(r"CMD\d{17}", i) for i in premiers)
+    assert avant <= premiers[0][3:17] <= datetime.now().strftime('%Y%m%d%H%M%S')
+    assert [int(i[3:]) for i in premiers] == list(range(int(premiers[0][3:]), int(premiers[0][3:]) + 8))
+    # Chaque préfixe a son propre compteur
+    assert re.fullmatch(r"CL\d{17}", allocateur.suivant("CL"))
+    # Un nouvel allocateur (redémarrage) reprend après le dernier numéro
+    assert AllocateurIdentifiants(allocateur.chemin).suivant("CMD") > premiers[-1]
+
+
+def test_horloge_qui_recule(tmp_path, monkeypatch):
+    allocateur = AllocateurIdentifiants(str(tmp_path / "identifiants.json"))
+    dernier = allocateur.suivant("LIV")
+
+    class Passe(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2001, 1, 1)
+
+    monkeypatch.setattr(identifiants, "datetime", Passe)
+    assert int(allocateur.suivant("LIV")[3:]) == int(dernier[3:]) + 1
+
+
+def test_uniques_entre_processus(tmp_path):
+    chemin = str(tmp_path / "identifiants.json")
+    contexte = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(4, mp_context=contexte) as executeur:
+        lots = list(executeur.map(reserver_dans_un_processus, [chemin] * 4, ["CMD"] * 4))
+    tous = [i for lot in lots for i in lot]
+    assert len(tous) == len(set(tous)) == 200
+    assert all(re.fullmatch(r"CMD\d{17}", i) for i in tous)
+    # Croissants dans chaque processus
+    assert all(lot == sorted(lot) for lot in lots)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from index_spatial import IndexDonnees, IndexSpatial
+from itineraire import distances_paires
+
+
+def index_aleatoire(n=3000, graine=0):
+    rng = np.random.default_rng(graine)
+    positions = {i: (31.3 + 0.6 * rng.random(), -8.3 + 0.6 * rng.random()) for i in range(n)}
+    index = IndexSpatial()
+    for cle, position in positions.items():
+        index.ajouter(cle, position)
+    return index, positions
+
+
+def parcours_complet(positions, centre):
+    cles = list(positions)
+    distances = distances_paires([centre] * len(cles), [positions[cle] for cle in cles])
+    return sorted(zip(cles, distances.tolist()), key=lambda r: r[1])
+
+
+def test_plus_proches_et_rayon_comme_un_parcours_complet():
+    index, positions = index_aleatoire()
+    for centre in [(31.609110, -7.968425), (31.3, -8.3), (32.5, -7.0)]:
+        attendus = parcours_complet(positions, centre)
+        assert [cle for cle, _ in index.plus_proches(centre, 10)] == [cle for cle, _ in attendus[:10]]
+        for rayon in (0.5, 3, 12):
+            assert {cle for cle, _ in index.dans_rayon(centre, rayon)} == {cle for cle, d in attendus if d <= rayon}
+
+
+def test_deplacement_et_retrait():
+    index, positions = index_aleatoire(500)
+    centre = (31.6, -8.0)
+    index.ajouter(0, centre)
+    positions[0] = centre
+    index.retirer(1)
+    del positions[1]
+    assert index.plus_proches(centre, 1)[0][0] == 0
+    assert [cle for cle, _ in index.plus_proches(centre, 20)] == [cle for cle, _ in parcours_complet(positions, centre)[:20]]
+    assert 1 not in index and len(index) == len(positions)
+
+
+def test_filtre():
+    index, positions = index_aleatoire(500)
+    centre = (31.6, -8.0)
+    pairs = {cle: position for cle, position in positions.items() if cle % 2 == 0}
+    trouves = index.plus_proches(centre, 5, filtre=lambda cle: cle % 2 == 0)
+    assert [cle for cle, _ in trouves] == [cle for cle, _ in parcours_complet(pairs, centre)[:5]]
+
+
+def test_index_des_donnees():
+    donnees = {
+        "clients": {"C1": {"position": (31.60, -7.97)}, "C2": {"position": (31.70, -8.10)}, "C3": {}},
+        "magasins_source": {"maison": {"type": "maison", "position": (31.36, -7.96)},
+                            "M1": {"type": "magasin", "position": (31.61, -7.96)}},
+    }
+    index = IndexDonnees(donnees)
+    assert len(index.index()) == 3
+    index.indexer("client", "C3", (31.605, -7.965))
+    index.indexer("client", "C2", None)
+    assert [cle for cle, _ in index.index().plus_proches((31.60, -7.97), 3)] == [
+        ("client", "C1"), ("client", "C3"), ("magasin", "M1")]
+    # Collections rechargées : l'index est reconstruit
+    donnees["clients"] = {"C4": {"position": (31.0, -8.0)}}
+    assert ("client", "C4") in index.index() and ("client", "C1") not in index.index()
@@ -0,0 +1,133 @@
+from itertools import permutations
+
+import numpy as np
+
+import itineraire as routage
+
+
+def matrice_aleatoire(n, graine=0):
+    rng = np.random.default_rng(graine)
+    positions = 31.5 + 0.2 * rng.random((n, 2))
+    return routage.matrice_distances(positions)
+
+
+def test_deux_opt_et_or_opt_ne_rallongent_jamais_la_tournee():
+    for graine in range(20):
+        matrice = matrice_aleatoire(15, graine)
+        rng = np.random.default_rng(graine)
+        tournee = np.array([0, 1] + list(rng.permutation(np.arange(2, 15))) + [0])
+        for mouvement in (routage.deux_opt, routage.or_opt):
+            avant = routage.longueur_tournee(tournee, matrice)
+            mouvement(tournee, matrice, 2, float("inf"))
+            assert routage.longueur_tournee(tournee, matrice) <= avant + 1e-9
+            # Maison et magasin en tête, retour final, chaque client une fois
+            assert list(tournee[:2]) == [0, 1] and tournee[-1] == 0
+            assert sorted(tournee[2:-1]) == list(range(2, 15))
+
+
+def test_amelioration_de_la_tournee_gloutonne():
+    for graine in range(10):
+        matrice = matrice_aleatoire(30, graine)
+        gloutonne = routage.plus_proche_voisin(matrice, premier=1)
+        amelioree = routage.ameliorer_tournee(gloutonne, matrice, debut=2, budget=10)
+        assert routage.longueur_tournee(amelioree, matrice) <= routage.longueur_tournee(gloutonne, matrice) + 1e-9
+        assert sorted(amelioree) == sorted(gloutonne)
+
+
+def optimum_force_brute(matrice, premier=None, dependances=None):
+    clients = [i for i in range(1, len(matrice)) if i != premier]
+    tete = [0] + ([premier] if premier is not None else [])
+    candidates = [tete + list(ordre) + [0] for ordre in permutations(clients)]
+    if dependances:
+        candidates = [t for t in candidates if routage.respecte_precedences(t, dependances)]
+    return min(routage.longueur_tournee(t, matrice) for t in candidates)
+
+
+def test_held_karp_egale_la_force_brute():
+    for n in range(2, 9):
+        for graine in range(3):
+            matrice = matrice_aleatoire(n, graine)
+            for premier in (None, 1):
+                tournee = routage.held_karp(matrice, premier=premier)
+                assert sorted(tournee[:-1]) == list(range(n))
+                assert abs(routage.longueur_tournee(tournee, matrice) - optimum_force_brute(matrice, premier)) < 1e-9
+
+
+def test_held_karp_avec_precedences():
+    for graine in range(5):
+        matrice = matrice_aleatoire(8, graine)
+        # Les points 1 et 2 sont des magasins à visiter avant leurs clients
+        dependances = {i: {1 + i % 2} for i in range(3, 8)}
+        tournee = routage.held_karp(matrice, dependances=dependances)
+        assert routage.respecte_precedences(tournee, dependances)
+        assert abs(routage.longueur_tournee(tournee, matrice) - optimum_force_brute(matrice, dependances=dependances)) < 1e-9
+
+
+def test_deux_opt_et_or_opt_sous_precedences():
+    for graine in range(10):
+        matrice = matrice_aleatoire(60, graine)
+        rng = np.random.default_rng(graine)
+        # Points 1 à 4 : magasins ; chaque client dépend d'un ou deux magasins
+        dependances = {i: set(rng.choice(np.arange(1, 5), size=rng.integers(1, 3), replace=False).tolist())
+                       for i in range(5, 60)}
+        gloutonne = routage.plus_proche_voisin(matrice, dependances=dependances)
+        paires = routage.paires_precedences(dependances)
+        for mouvement in (routage.deux_opt, routage.or_opt):
+            tournee = np.array(gloutonne)
+            mouvement(tournee, matrice, 1, float("inf"), paires=paires)
+            assert routage.respecte_precedences(tournee.tolist(), dependances)
+            assert routage.longueur_tournee(tournee, matrice) <= routage.longueur_tournee(gloutonne, matrice) + 1e-9
+        amelioree = routage.ameliorer_tournee(gloutonne, matrice, budget=10, dependances=dependances)
+        assert routage.respecte_precedences(amelioree, dependances) and sorted(amelioree) == sorted(gloutonne)
+        assert routage.longueur_tournee(amelioree, matrice) < routage.longueur_tournee(gloutonne, matrice)
+
+
+def test_plusieurs_magasins_retraits_avant_livraisons():
+    rng = np.random.default_rng(3)
+    magasins = [(f"M{m}", tuple(31.5 + 0.2 * rng.random(2))) for m in range(3)]
+    clients = [(f"CL{c}", tuple(31.5 + 0.2 * rng.random(2))) for c in range(40)]
+    dependances = {client_id: {f"M{c % 3}"} | ({"M0"} if c % 5 == 0 else set())
+                   for c, (client_id, _) in enumerate(clients)}
+    plan = routage.planifier_multi_magasins((31.6, -7.97), magasins, clients, dependances, budget=2)
+    assert plan["methode"] == "heuristique"
+    ordre = [plan["magasins_ids"][i] or plan["clients_ids"][i] for i in plan["tournee"][1:-1]]
+    assert sorted(ordre) == sorted([m for m, _ in magasins] + [c for c, _ in clients])
+    for client_id, magasins_du_client in dependances.items():
+        assert all(ordre.index(m) < ordre.index(client_id) for m in magasins_du_client)
+    assert routage.longueur_tournee(plan["tournee"], plan["matrice"]) <= \
+        routage.longueur_tournee(plan["tournee_gloutonne"], plan["matrice"]) + 1e-9
+
+
+def test_mise_a_jour_respecte_la_capacite():
+    matrice = matrice_aleatoire(12)
+    cles = ["maison", "magasin"] + [f"c{i}" for i in range(10)]
+    ordres = [["magasin"] + [f"c{i}" for i in range(5)], ["magasin"] + [f"c{i}" for i in range(5, 9)]]
+    # c1 a été modifié (charge 40) et c9 est nouveau : la première tournée dépasserait 60
+    charges = {i: 10 for i in range(2, 12)}
+    charges[3] = 40
+    tournees, non_affectes = routage.mettre_a_jour_tournees(matrice, cles, ordres, fixes=["c0"], premier=1,
+                                                            charges=charges, capacite=60)
+    for tournee in tournees:
+        assert sum(charges.get(i, 0) for i in tournee) <= 60
+    places = [i for tournee in tournees for i in tournee[2:-1]]
+    assert sorted(places + non_affectes) == list(range(2, 12))
+    # Le client livré garde sa place
+    assert tournees[0][2] == 2
+
+
+def test_routes_en_parallele_comme_en_sequence(monkeypatch):
+    matrice = matrice_aleatoire(52)
+    routes = [list(range(2 + 10 * v, 12 + 10 * v)) for v in range(5)]
+    contraintes = routage.preparer_contraintes([None, None] + [f"c{i}" for i in range(50)], depart=480,
+                                               fenetres={f"c{i}": (480 + 5 * i, 600 + 5 * i) for i in range(50)})
+    sequence = routage.optimiser_routes(matrice, routes, premier=1, budget=50, contraintes=contraintes)
+    # La machine de test peut n'avoir qu'un processeur : le parallélisme est forcé
+    monkeypatch.setattr(routage.os, "cpu_count", lambda: 2)
+    executeur = routage.creer_executeur(2)
+    try:
+        parallele = routage.optimiser_routes(matrice, routes, premier=1, budget=50, contraintes=contraintes,
+                                             executeur=executeur)
+    finally:
+        executeur.shutdown()
+    assert parallele == sequence
+    assert [sorted(tournee[2:-1]) for _, tournee, _ in parallele] == routes
@@ -0,0 +1,48 @@
+import json
+
+from modeles import Commande, LigneCommande, depuis_json, en_json, vers_json
+
+COLLECTIONS = {
+    "clients": {
+        "CL1": {"nom": "Client", "telephone": "0600000000", "position": [31.6, -7.97], "solde": 12.5,
+                "fenetre_debut": "08:00", "fenetre_fin": "", "remarque": "champ hors schéma"},
+        "CL2": {"nom": "Sans position"},
+    },
+    "commandes": [
+        {"id": "CMD1", "client_id": "CL1", "date_commande": "2024-03-01 10:00:00", "statut": "livree",
+         "produits": [{"type_viande": "Boeuf", "morceau": "Entrecôte", "quantite": 2, "prix_vente": 120.0,
+                       "prix_achat": 90.0, "quantite_livree": 2}],
+         "total_commande": 240.0, "date_livraison_reelle": "2024-03-02", "_version": 3},
+        {"id": "CMD2", "client_id": "CL2", "produits": [], "statut": "en_cours", "notes": None},
+    ],
+    "livraisons": [
+        {"id": "LIV1", "commande_id": "CMD1", "quantites_livrees": {"0": 2}, "montant_paye": 240.0},
+    ],
+    "tresorerie": [
+        {"date": "2024-03-02", "type": "encaissement", "montant": 240.0, "commande_id": "CMD1"},
+        {"date": "2024-03-02", "type": "achat", "montant": -90.0, "fournisseur": "hors schéma"},
+    ],
+    "magasins_source": {"maison": {"type": "maison", "position": [31.36, -7.96]}},
+}
+
+
+def test_aller_retour_json():
+    for nom, collection in COLLECTIONS.items():
+        compacte = depuis_json(nom, json.loads(json.dumps(collection)))
+        assert vers_json(compacte) == collection
+        # Sérialisé directement par json.dumps : même contenu (les champs suivent l'ordre du schéma)
+        assert json.loads(json.dumps(compacte, default=en_json)) == collection
+
+
+def test_enregistrement_comme_un_dictionnaire():
+    commande = depuis_json("commandes", [COLLECTIONS["commandes"][0]])[0]
+    assert isinstance(commande, Commande) and isinstance(commande["produits"][0], LigneCommande)
+    assert "notes" not in commande and commande.get("notes", "") == ""
+    commande["statut"] = "annulee"
+    commande["motif"] = "client absent"
+    del commande["date_livraison_reelle"]
+    assert commande["statut"] == "annulee" and commande["motif"] == "client absent"
+    assert "date_livraison_reelle" not in vers_json(commande)
+    # Produits ajoutés sous forme de dictionnaires : convertis à l'affectation
+    commande["produits"] = commande["produits"] + [{"type_viande": "Agneau", "quantite": 1}]
+    assert all(isinstance(p, LigneCommande) for p in commande["produits"])
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+
+import pytest
+
+from modeles import depuis_json
+from stockage import DonneesPartagees, StockageJSON, SuiviModifications
+from stockage_journal import StockageJournal
+from stockage_sqlite import StockageSQLite
+
+DEFAUTS = {"magasins_source": {}, "clients": {}, "commandes": [], "livraisons": [], "tresorerie": []}
+
+STOCKAGES = {
+    "json": StockageJSON,
+    "sqlite": lambda: StockageSQLite("gestion.db"),
+    "journal": StockageJournal,
+}
+
+
+@pytest.fixture(params=sorted(STOCKAGES))
+def ouvrir(request, tmp_path, monkeypatch):
+    # Chaque appel ouvre les mêmes fichiers, comme un autre processus
+    monkeypatch.chdir(tmp_path)
+    stockage = STOCKAGES[request.param]
+
+    def ouvrir():
+        return DonneesPartagees(stockage(), DEFAUTS, depuis_json)
+
+    donnees = ouvrir()
+    donnees["clients"]["CL1"] = depuis_json("clients", {"CL1": {"nom": "Client", "solde": 0}})["CL1"]
+    donnees["commandes"].extend(depuis_json("commandes", [
+        {"id": "CMD1", "client_id": "CL1", "statut": "en_cours", "produits": [{"quantite": 2, "prix_vente": 10}]},
+    ]))
+    donnees.marquer("clients", "CL1")
+    donnees.marquer("commandes", "CMD1")
+    donnees.demander_sauvegarde()
+    return ouvrir
+
+
+def livrer(donnees, montant):
+    # Même enchaînement que la page Livraisons : commande, livraison, solde et trésorerie
+    commande = donnees["commandes"][0]
+    commande["statut"] = "livree"
+    donnees["livraisons"].append({"id": f"LIV{montant}", "commande_id": "CMD1", "montant_paye": montant})
+    donnees["clients"]["CL1"]["solde"] += 20 - montant
+    donnees["tresorerie"].append({"type": "encaissement", "montant": montant, "commande_id": "CMD1"})
+    donnees.marquer("commandes", "CMD1")
+    donnees.marquer("livraisons", f"LIV{montant}")
+    donnees.marquer("clients", "CL1")
+    donnees.marquer("tresorerie", len(donnees["tresorerie"]) - 1)
+    donnees.demander_sauvegarde()
+
+
+def test_conflit_la_version_enregistree_est_conservee(ouvrir):
+    a, b = ouvrir(), ouvrir()
+    commande_b = b["commandes"][0]
+    a["commandes"][0]["statut"] = "annulee"
+    a.marquer("commandes", "CMD1")
+    a.sauvegarder()
+    commande_b["statut"] = "partiellement_livre"
+    b.marquer("commandes", "CMD1")
+    b.sauvegarder()
+    assert b["commandes"][0]["statut"] == "annulee"
+    assert [(c["collection"], c["cle"]) for c in b.conflits] == [("commandes", "CMD1")]
+    assert ouvrir()["commandes"][0]["statut"] == "annulee"
+
+
+def test_conflit_annule_toute_l_action(ouvrir):
+    a, b = ouvrir(), ouvrir()
+    for nom in DEFAUTS:
+        b[nom]
+    a["commandes"][0]["statut"] = "annulee"
+    a.marquer("commandes", "CMD1")
+    a.sauvegarder()
+
+    # La livraison est rejetée en entier ; l'action d'une autre session, sans conflit, est écrite
+    b.demarrer_ecriture_differee(3600)
+    livrer(b, 5)
+    autre_session = threading.Thread(target=lambda: (b["clients"].update(depuis_json("clients", {"CL2": {"nom": "Autre"}})),
+                                                     b.marquer("clients", "CL2"), b.demander_sauvegarde()))
+    autre_session.start()
+    autre_session.join()
+    b.ecriture_differee.arreter()
+
+    assert b.conflits[-1]["annulees"] == ["clients CL1", "commandes CMD1", "livraisons LIV5", "tresorerie 0"]
+    relu = ouvrir()
+    assert relu["commandes"][0]["statut"] == "annulee"
+    assert relu["livraisons"] == [] and relu["tresorerie"] == []
+    assert relu["clients"]["CL1"]["solde"] == 0 and "CL2" in relu["clients"]
+    assert b["livraisons"] == [] and b["clients"]["CL1"]["solde"] == 0
+
+
+def test_ajouts_simultanes_fusionnes(ouvrir):
+    a, b = ouvrir(), ouvrir()
+    for nom in DEFAUTS:
+        a[nom], b[nom]
+    a["livraisons"].append({"id": "LIVA", "commande_id": "CMD1"})
+    a["tresorerie"].append({"type": "encaissement", "montant": 5})
+    a.marquer("livraisons", "LIVA")
+    a.marquer("tresorerie", 0)
+    a.sauvegarder()
+    b["livraisons"].append({"id": "LIVB", "commande_id": "CMD1"})
+    b["tresorerie"].append({"type": "encaissement", "montant": 8})
+    b.marquer("livraisons", "LIVB")
+    b.marquer("tresorerie", 0)
+    b.sauvegarder()
+    assert not b.conflits
+    relu = ouvrir()
+    assert sorted(liv["id"] for liv in relu["livraisons"]) == ["LIVA", "LIVB"]
+    assert [mvt["montant"] for mvt in relu["tresorerie"]] == [5, 8]
+
+
+def test_sans_conflit_les_versions_progressent(ouvrir):
+    a = ouvrir()
+    livrer(a, 20)
+    relu = ouvrir()
+    assert relu["commandes"][0]["statut"] == "livree" and relu["commandes"][0]["_version"] == 2
+    assert relu["clients"]["CL1"]["solde"] == 0 and relu["tresorerie"][0]["montant"] == 20
+
+
+def test_requetes_sqlite_voient_les_modifications_pas_encore_ecrites(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageSQLite("gestion.db"), DEFAUTS, depuis_json)
+    commandes = donnees["commandes"]
+    commandes.extend(depuis_json("commandes", [
+        {"id": f"CMD{i}", "statut": "en_attente", "date_livraison_prevue": f"2026-01-0{1 + i % 2}", "produits": []}
+        for i in range(6)
+    ]))
+    for cmd in commandes:
+        donnees.marquer("commandes", cmd["id"])
+    donnees.sauvegarder()
+
+    donnees.demarrer_ecriture_differee(3600)
+    commandes[0]["statut"] = "livree"
+    del commandes[1]
+    commandes.append(depuis_json("commandes", [
+        {"id": "CMD9", "statut": "en_attente", "date_livraison_prevue": "2026-01-01", "produits": []}])[0])
+    for cle in ("CMD0", "CMD1", "CMD9"):
+        donnees.marquer("commandes", cle)
+
+    def verifier():
+        trouvees = donnees.rechercher_commandes(date_livraison="2026-01-01", statuts=["en_attente"])
+        assert [cmd["id"] for cmd in trouvees] == ["CMD2", "CMD4", "CMD9"]
+        # Ce sont les commandes en mémoire, que les pages modifient
+        assert trouvees[-1] is commandes[-1]
+        assert donnees.compter_commandes_par_statut() == {"en_attente": 5, "livree": 1}
+
+    def livrees_en_base():
+        return donnees.stockage.connexion.execute("SELECT COUNT(*) FROM commandes WHERE statut = 'livree'").fetchone()[0]
+
+    verifier()
+    # Rien n'a été écrit pour répondre aux requêtes
+    assert livrees_en_base() == 0
+    donnees.ecriture_differee.arreter()
+    assert livrees_en_base() == 1
+    verifier()
+
+
+def test_suivi_des_modifications():
+    suivi = SuiviModifications()
+    assert not suivi.est_modifie()
+    suivi.marquer("commandes", "CMD1")
+    suivi.marquer("commandes", "CMD2")
+    suivi.marquer("clients")
+    # Une collection à réécrire en entier le reste
+    suivi.marquer("clients", "CL1")
+    assert suivi.cles_modifiees("commandes") == {"CMD1", "CMD2"} and suivi.cles_modifiees("clients") is None
+    assert sorted(suivi.collections_modifiees()) == ["clients", "commandes"]
+    with pytest.raises(KeyError):
+        suivi.marquer("inconnue")
+    repris = SuiviModifications()
+    repris.marquer("commandes", "CMD3")
+    repris.fusionner(suivi)
+    assert repris.cles_modifiees("commandes") == {"CMD1", "CMD2", "CMD3"} and repris.cles_modifiees("clients") is None
+    suivi.vider("commandes")
+    assert suivi.collections_modifiees() == ["clients"]
+
+
+def test_seules_les_collections_modifiees_sont_ecrites(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageJSON(), DEFAUTS)
+    assert donnees.sauvegarder() == {}
+    donnees["clients"]["CL1"] = {"nom": "Client"}
+    donnees.marquer("clients", "CL1")
+    assert list(donnees.sauvegarder()) == ["clients"]
+    assert os.path.exists("clients.json") and not os.path.exists("commandes.json")
+    assert not donnees.modifications.est_modifie() and donnees.sauvegarder() == {}
+
+
+def test_seuls_les_enregistrements_modifies_sont_ecrits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageJournal(), DEFAUTS)
+    donnees["commandes"].extend({"id": f"CMD{i}", "statut": "en_attente", "produits": []} for i in range(3))
+    for i in range(3):
+        donnees.marquer("commandes", f"CMD{i}")
+    donnees.sauvegarder()
+    donnees["commandes"][1]["statut"] = "livree"
+    donnees.marquer("commandes", "CMD1")
+    donnees.sauvegarder()
+    evenements = donnees.stockage.lire_journal()
+    assert [evt["cle"] for evt in evenements] == ["CMD0", "CMD1", "CMD2", "CMD1"]
+    assert evenements[-1]["valeur"][0]["statut"] == "livree"
+
+
+def ajouter_client(donnees, cle):
+    donnees["clients"][cle] = {"nom": cle}
+    donnees.marquer("clients", cle)
+    donnees.demander_sauvegarde()
+
+
+def test_ecriture_differee_apres_le_delai(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageJSON(), DEFAUTS)
+    ecritures = []
+    sauvegarder = donnees.sauvegarder
+    monkeypatch.setattr(donnees, "sauvegarder", lambda: ecritures.append(sauvegarder()))
+    ecriture = donnees.demarrer_ecriture_differee(0.3)
+    for cle in ("CL1", "CL2", "CL3"):
+        ajouter_client(donnees, cle)
+    assert not os.path.exists("clients.json")
+    limite = time.monotonic() + 5
+    while not ecritures and time.monotonic() < limite:
+        time.sleep(0.02)
+    # Les demandes rapprochées sont regroupées en une écriture
+    assert [list(octets) for octets in ecritures] == [["clients"]]
+    assert ecriture.is_alive() and ecriture.derniere_erreur is None
+    assert set(DonneesPartagees(StockageJSON(), DEFAUTS)["clients"]) == {"CL1", "CL2", "CL3"}
+    ecriture.arreter()
+
+
+def test_ecriture_differee_a_l_arret(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageJSON(), DEFAUTS)
+    ecriture = donnees.demarrer_ecriture_differee(3600)
+    ajouter_client(donnees, "CL1")
+    assert not os.path.exists("clients.json")
+    ecriture.arreter()
+    assert not ecriture.is_alive() and not donnees.modifications.est_modifie()
+    assert "CL1" in DonneesPartagees(StockageJSON(), DEFAUTS)["clients"]
@@ -0,0 +1,81 @@
+import json
+
+from stockage import FICHIERS, DonneesPartagees
+from stockage_journal import StockageJournal
+
+DEFAUTS = {"magasins_source": {}, "clients": {}, "commandes": [], "livraisons": [], "tresorerie": []}
+
+
+def remplir(donnees):
+    # Créations, modifications et suppressions sur plusieurs sauvegardes
+    donnees["clients"]["CL1"] = {"nom": "Client 1", "solde": 0}
+    donnees["clients"]["CL2"] = {"nom": "Client 2", "solde": 0}
+    donnees["commandes"].extend({"id": f"CMD{i}", "client_id": "CL1", "statut": "en_attente"} for i in range(4))
+    donnees["tresorerie"].append({"type": "encaissement", "montant": 10})
+    for cle in ("CL1", "CL2"):
+        donnees.marquer("clients", cle)
+    for i in range(4):
+        donnees.marquer("commandes", f"CMD{i}")
+    donnees.marquer("tresorerie", 0)
+    donnees.sauvegarder()
+
+    donnees["commandes"][1]["statut"] = "livree"
+    del donnees["commandes"][2]
+    del donnees["clients"]["CL2"]
+    donnees["clients"]["CL1"]["solde"] = 25
+    donnees["tresorerie"].append({"type": "depense", "montant": 4})
+    for cle in ("CMD1", "CMD2"):
+        donnees.marquer("commandes", cle)
+    for cle in ("CL1", "CL2"):
+        donnees.marquer("clients", cle)
+    donnees.marquer("tresorerie", 1)
+    donnees.sauvegarder()
+    return {nom: json.loads(json.dumps(donnees[nom])) for nom in FICHIERS}
+
+
+def relire():
+    donnees = DonneesPartagees(StockageJournal(), DEFAUTS)
+    return {nom: donnees[nom] for nom in FICHIERS}
+
+
+def test_rejeu_et_compaction_comme_un_instantane(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    attendu = remplir(DonneesPartagees(StockageJournal(), DEFAUTS))
+    assert relire() == attendu
+
+    stockage = StockageJournal()
+    with open(stockage.chemin_journal) as f:
+        journal = f.read()
+    stockage.compacter()
+    assert stockage.lire_journal() == []
+    for nom in ("clients", "commandes", "tresorerie"):
+        with open(FICHIERS[nom]) as f:
+            assert json.load(f) == attendu[nom]
+    assert relire() == attendu
+    # Compaction interrompue avant de vider le journal : le rejeu est idempotent
+    with open(stockage.chemin_journal, 'w') as f:
+        f.write(journal)
+    assert relire() == attendu
+
+
+def test_compaction_au_dela_du_seuil(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    donnees = DonneesPartagees(StockageJournal(seuil_compaction=200), DEFAUTS)
+    attendu = remplir(donnees)
+    # 12 événements écrits, repliés dans les instantanés au fil des sauvegardes
+    assert len(donnees.stockage.lire_journal()) < 12
+    assert relire() == attendu
+
+
+def test_journal_lu_une_fois_par_chargement(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    attendu = remplir(DonneesPartagees(StockageJournal(), DEFAUTS))
+    lectures = []
+    lire_journal = StockageJournal.lire_journal
+    monkeypatch.setattr(StockageJournal, "lire_journal", lambda self: lectures.append(1) or lire_journal(self))
+    donnees = DonneesPartagees(StockageJournal(), DEFAUTS)
+    assert {nom: donnees[nom] for nom in FICHIERS} == attendu
+    assert len(lectures) == 1
+    # Après un rechargement, les collections sont relues en entier
+    donnees.charger()
+    assert donnees["commandes"] == attendu["commandes"] and len(lectures) == 2
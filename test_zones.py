@@ -0,0 +1,49 @@
+import numpy as np
+
+from zones import TOLERANCE_CHARGE, decouper_zones, enveloppe_convexe
+
+
+def clients_aleatoires(n, graine=0):
+    rng = np.random.default_rng(graine)
+    positions = np.column_stack([31.45 + 0.25 * rng.random(n), -8.10 + 0.25 * rng.random(n)])
+    return positions, rng.integers(1, 10, size=n).astype(float)
+
+
+def test_charge_des_zones_dans_la_limite():
+    for graine in range(10):
+        for k in (2, 3, 5, 8):
+            positions, charges = clients_aleatoires(200, graine)
+            etiquettes = decouper_zones(positions, charges, k, centre=(31.609110, -7.968425))
+            assert etiquettes.min() >= 0 and etiquettes.max() < k
+            plafond = max(charges.sum() / k * (1 + TOLERANCE_CHARGE), charges.max())
+            assert np.bincount(etiquettes, weights=charges, minlength=k).max() <= plafond + 1e-9
+
+
+def test_sans_charges_meme_nombre_d_arrets():
+    positions, _ = clients_aleatoires(90, 1)
+    etiquettes = decouper_zones(positions, k=3)
+    assert np.bincount(etiquettes, minlength=3).max() <= 90 / 3 * (1 + TOLERANCE_CHARGE)
+
+
+def test_cas_limites():
+    assert len(decouper_zones([], k=3)) == 0
+    # Plus de zones que de points : une zone par point
+    assert sorted(decouper_zones([(31.5, -8.0), (31.6, -8.1)], k=5).tolist()) == [0, 1]
+
+
+def test_enveloppe_convexe():
+    carre = [(0, 0), (0, 1), (1, 1), (1, 0), (0.5, 0.5)]
+    assert sorted(enveloppe_convexe(carre)) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+
+def test_charge_totale_au_dessus_de_la_capacite():
+    positions, charges = clients_aleatoires(100, 2)
+    k, capacite = 3, 100.0
+    assert charges.sum() > k * capacite
+    etiquettes = decouper_zones(positions, charges, k, capacite=capacite)
+    affectes = etiquettes >= 0
+    assert etiquettes.max() < k and not affectes.all()
+    assert np.bincount(etiquettes[affectes], weights=charges[affectes], minlength=k).max() <= capacite
+    # Un point non affecté ne tenait dans aucune zone
+    restes = capacite - np.bincount(etiquettes[affectes], weights=charges[affectes], minlength=k)
+    assert (charges[~affectes] > restes.max()).all()
@@ -0,0 +1,51 @@
+import json
+import threading
+from datetime import date, timedelta
+
+from stockage import VerrouFichier, ecrire_json
+
+
+class RegistreTournees:
+    """Dernier ordre de passage retenu pour chaque jour et chaque planification
+
+    La clé est "AAAA-MM-JJ|magasin" ("combine" pour la tournée combinée),
+    la valeur un dictionnaire (voir plans.tournee_retenue) : "ordres", par
+    véhicule, les clés des arrêts (client ou magasin) dans l'ordre de
+    passage, "gloutonnes" les tournées gloutonnes correspondantes, et les
+    commandes, horaires et paramètres du calcul. Elle sert de point de
+    départ aux mises à jour incrémentales, pour que l'ordre annoncé au
+    livreur reste stable. Les tournées de plus de `jours_conserves` jours
+    sont oubliées.
+    """
+
+    CHEMIN_DEFAUT = "tournees.json"
+
+    def __init__(self, chemin=CHEMIN_DEFAUT, jours_conserves=7):
+        self.chemin = chemin
+        self.chemin_verrou = chemin + ".lock"
+        self.jours_conserves = jours_conserves
+        self.verrou = threading.Lock()
+
+    @staticmethod
+    def cle(date_livraison, magasin_id=None):
+        return f"{date_livraison}|{magasin_id or 'combine'}"
+
+    def _lire(self):
+        try:
+            with open(self.chemin, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def lire(self, cle):
+        """Tournée retenue, ou None si aucune tournée n'a été retenue"""
+        return self._lire().get(cle)
+
+    def enregistrer(self, cle, retenue):
+        limite = (date.today() - timedelta(days=self.jours_conserves)).isoformat()
+        with self.verrou, VerrouFichier(self.chemin_verrou):
+            tournees = {c: o for c, o in self._lire().items() if c.split('|')[0] >= limite}
+            if tournees.get(cle) == retenue:
+                return
+            tournees[cle] = retenue
+            ecrire_json(self.chemin, tournees)
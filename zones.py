@@ -0,0 +1,131 @@
+import numpy as np
+
+# Longueur (km) d'un degré de latitude
+KM_PAR_DEGRE = 111.32
+
+# Nombre d'arrêts à partir duquel la page Itinéraire propose un découpage en zones
+SEUIL_ZONES = 80
+
+# Dépassement admis de la charge moyenne d'une zone
+TOLERANCE_CHARGE = 0.1
+
+
+def projeter(positions, latitude_reference):
+    """Positions (lat, lon) -> coordonnées planes (km), suffisantes à l'échelle d'une ville"""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    return np.column_stack([
+        positions[:, 1] * KM_PAR_DEGRE * np.cos(np.radians(latitude_reference)),
+        positions[:, 0] * KM_PAR_DEGRE,
+    ])
+
+
+def balayage(xy, centre, poids, k):
+    """Secteurs angulaires autour du `centre`, de charges égales
+
+    Le balayage commence au plus grand vide angulaire pour qu'aucun
+    secteur ne soit coupé en deux.
+    """
+    angles = np.arctan2(xy[:, 1] - centre[1], xy[:, 0] - centre[0])
+    ordre = np.argsort(angles)
+    tries = angles[ordre]
+    ecarts = np.diff(np.concatenate([tries, tries[:1] + 2 * np.pi]))
+    ordre = np.roll(ordre, -(int(np.argmax(ecarts)) + 1))
+    cumul = np.cumsum(poids[ordre]) - poids[ordre] / 2
+    etiquettes = np.empty(len(xy), dtype=int)
+    etiquettes[ordre] = np.minimum((cumul / poids.sum() * k).astype(int), k - 1)
+    return etiquettes
+
+
+def affecter_equilibre(distances, poids, plafond):
+    """Chaque point au centre le plus proche dont la charge reste sous le `plafond`
+
+    Les points pour lesquels le choix compte le plus (écart entre le
+    premier et le second centre) sont placés en premier. Un point qui ne
+    tient dans aucune zone reçoit l'étiquette -1 (non affecté).
+    """
+    n, k = distances.shape
+    preferences = np.argsort(distances, axis=1)
+    if k > 1:
+        regrets = distances[np.arange(n), preferences[:, 1]] - distances[np.arange(n), preferences[:, 0]]
+    else:
+        regrets = np.zeros(n)
+    charges = np.zeros(k)
+    etiquettes = np.empty(n, dtype=int)
+    for i in np.argsort(-regrets):
+        for zone in preferences[i]:
+            if charges[zone] + poids[i] <= plafond:
+                break
+        else:
+            etiquettes[i] = -1
+            continue
+        etiquettes[i] = zone
+        charges[zone] += poids[i]
+    return etiquettes
+
+
+def decouper_zones(positions, charges=None, k=2, centre=None, iterations=30, tolerance=TOLERANCE_CHARGE,
+                   capacite=None):
+    """Zone (0 à k-1) de chaque position : k-means équilibré en charge
+
+    Les zones initiales sont des secteurs angulaires autour du `centre`
+    (dépôt), puis chaque itération recalcule les centres des zones
+    (moyennes pondérées) et réaffecte les points au centre le plus proche
+    sans dépasser la charge moyenne de plus de `tolerance`, ni la
+    `capacite` d'une zone si elle est donnée. Sans charges (ou toutes
+    nulles), les zones ont le même nombre d'arrêts. Aucune zone ne
+    dépasse ce plafond : les points qui n'y tiennent pas ont l'étiquette
+    -1 (non affectés).
+    """
+    n = len(positions)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    k = max(1, min(int(k), n))
+    latitude_reference = float(np.mean(np.asarray(positions, dtype=float).reshape(-1, 2)[:, 0]))
+    xy = projeter(positions, latitude_reference)
+    poids = np.ones(n) if charges is None else np.asarray(charges, dtype=float)
+    if poids.sum() <= 0:
+        poids = np.ones(n)
+    centre = xy.mean(axis=0) if centre is None else projeter([centre], latitude_reference)[0]
+    etiquettes = balayage(xy, centre, poids, k)
+    plafond = max(poids.sum() / k * (1 + tolerance), poids.max())
+    if capacite is not None:
+        plafond = min(plafond, capacite)
+    for _ in range(iterations):
+        # Centres calculés sur les points affectés à l'itération précédente
+        affectes = etiquettes >= 0
+        masses = np.bincount(etiquettes[affectes], weights=poids[affectes], minlength=k)
+        centres = np.column_stack([np.bincount(etiquettes[affectes], weights=(poids * xy[:, d])[affectes], minlength=k)
+                                   for d in (0, 1)])
+        vides = masses == 0
+        centres[~vides] /= masses[~vides, None]
+        if vides.any():
+            # Zone vide : repartir des points non affectés, puis des plus éloignés du centre de leur zone
+            eloignes = np.argsort(-np.where(affectes, ((xy - centres[np.maximum(etiquettes, 0)]) ** 2).sum(axis=1), np.inf))
+            centres[vides] = xy[eloignes[:int(vides.sum())]]
+        distances = ((xy[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        nouvelles = affecter_equilibre(distances, poids, plafond)
+        if np.array_equal(nouvelles, etiquettes):
+            break
+        etiquettes = nouvelles
+    return etiquettes
+
+
+def enveloppe_convexe(positions):
+    """Enveloppe convexe (chaîne monotone) de positions (lat, lon), pour dessiner une zone"""
+    points = sorted(set(tuple(p) for p in positions))
+    if len(points) <= 2:
+        return points
+
+    def produit(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    bas, haut = [], []
+    for p in points:
+        while len(bas) >= 2 and produit(bas[-2], bas[-1], p) <= 0:
+            bas.pop()
+        bas.append(p)
+    for p in reversed(points):
+        while len(haut) >= 2 and produit(haut[-2], haut[-1], p) <= 0:
+            haut.pop()
+        haut.append(p)
+    return bas[:-1] + haut[:-1]